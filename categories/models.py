@@ -4,6 +4,8 @@ class Category(models.Model):
     name = models.CharField(max_length=100, unique=True)
     description = models.TextField(blank=True, null=True)
     icon = models.ImageField(upload_to="category_icons/", blank=True, null=True)
+    # Resized copies of the icon, see products/images.py
+    icon_variants = models.JSONField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
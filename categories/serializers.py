@@ -1,9 +1,12 @@
 from rest_framework import serializers
+from instrumentation import TimedSerializerMixin
+from products.images import variant_urls
 from .models import Category
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     created_at = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S", read_only=True)
     updated_at = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S", read_only=True)
+    icon_srcset = serializers.SerializerMethodField()
 
     class Meta:
         model = Category
@@ -12,11 +15,16 @@ class CategorySerializer(serializers.ModelSerializer):
             'name',
             'description',
             'icon',
+            'icon_srcset',
             'created_at',
             'updated_at'
         ]
         read_only_fields = ['created_at', 'updated_at']
 
+    def get_icon_srcset(self, obj):
+        """URLs of the resized icon variants by format and width, empty until they are rendered."""
+        return variant_urls(obj.icon, obj.icon_variants, self.context.get('request'))
+
     def validate_name(self, value):
         if not value:
             raise serializers.ValidationError("Category name is required.")
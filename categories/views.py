@@ -2,6 +2,7 @@ from rest_framework import viewsets
 from .models import Category
 from .serializers import CategorySerializer
 from rest_framework.permissions import AllowAny, IsAuthenticated
+from products.cache import cache_catalog_response, conditional_catalog_response
 
 class CategoryViewSet(viewsets.ModelViewSet):
     queryset = Category.objects.all()
@@ -10,4 +11,13 @@ class CategoryViewSet(viewsets.ModelViewSet):
     def get_permissions(self):
         if self.request.method == 'GET':
             return [AllowAny()]
-        return [IsAuthenticated()]
\ No newline at end of file
+        return [IsAuthenticated()]
+
+    @conditional_catalog_response
+    @cache_catalog_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_catalog_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
\ No newline at end of file
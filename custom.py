@@ -1,4 +1,13 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 from rest_framework.response import Response as DRFResponse
 from rest_framework.exceptions import AuthenticationFailed
 from rest_framework_simplejwt.authentication import JWTAuthentication
@@ -53,6 +62,185 @@ class CustomPagination(pagination.PageNumberPagination):
             }
         )
 
+class CustomCursorPagination(pagination.CursorPagination):
+    """
+    Keyset (cursor) Pagination Class.
+
+    Pages are located with a WHERE clause on the ordering columns instead of
+    COUNT(*) and OFFSET, so page N costs the same as page 1. The ordering is
+    taken from the view's `get_pagination_ordering()` when it has one and must
+    end with a unique column (`id`) as tiebreaker. NULLs are always sorted last.
+
+    Lists are paginated by default. Pages have no count, the response holds
+    `page_size`, the `next` and `previous` links (null at either end) and the
+    `results`. Clients which still need the whole list in one response send
+    `paginate=false`.
+    """
+
+    page_size = 20  # Default page size
+    page_size_query_param = "page_size"
+    max_page_size = 100  # Maximum allowed page size
+    ordering = ("-created_at", "-id")
+    # Query parameter to opt out of pagination with `paginate=false`
+    paginate_query_param = "paginate"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if request.query_params.get(self.paginate_query_param) == "false":
+            return None
+
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.fields = [self._get_ordering_field(queryset, field.lstrip("-")) for field in self.ordering]
+        self.cursor = self.decode_cursor(request)
+        reverse = self.cursor is not None and self.cursor.reverse
+
+        if self.cursor is not None:
+            queryset = queryset.filter(self._get_keyset_filter(self.cursor))
+        queryset = queryset.order_by(*self._get_order_by(reverse))
+
+        # Fetch one extra row to know whether there is a following page
+        results = list(queryset[: self.page_size + 1])
+        has_more = len(results) > self.page_size
+        self.page = results[: self.page_size]
+        if reverse:
+            self.page.reverse()
+
+        self.has_next = has_more if not reverse else True
+        self.has_previous = has_more if reverse else self.cursor is not None
+        if not self.page:
+            # Going past either end, only offer the way back
+            self.has_next, self.has_previous = reverse, not reverse and self.cursor is not None
+
+        self.display_page_controls = self.has_next or self.has_previous
+        return self.page
+
+    def get_ordering(self, request, queryset, view):
+        get_pagination_ordering = getattr(view, "get_pagination_ordering", None)
+        if get_pagination_ordering is not None:
+            return tuple(get_pagination_ordering())
+        return self.ordering
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self._get_position(self.page[-1], reverse=False))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.base_url, self.cursor_query_param)
+        return self.encode_cursor(self._get_position(self.page[0], reverse=True))
+
+    def decode_cursor(self, request):
+        """Return the decoded cursor dict of the request or None"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            padding = "=" * (-len(encoded) % 4)
+            cursor = json.loads(urlsafe_b64decode(encoded + padding))
+            values = cursor["p"]
+            if not isinstance(values, list) or len(values) != len(self.fields):
+                raise ValueError
+            values = [
+                None if value is None else field.to_python(value)
+                for field, value in zip(self.fields, values)
+            ]
+            return _Cursor(reverse=bool(cursor.get("r")), values=values)
+        except (TypeError, ValueError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, cursor):
+        """Return the url of the page which starts after the given cursor"""
+        payload = {"p": cursor.values}
+        if cursor.reverse:
+            payload["r"] = 1
+        encoded = urlsafe_b64encode(
+            json.dumps(payload, separators=(",", ":")).encode()
+        ).decode().rstrip("=")
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_paginated_response(self, data):
+        """Structure of CustomPagination without the counts, which cost a COUNT(*) per page"""
+        return Response(
+            {
+                "page_size": self.page_size,
+                "next": self.get_next_link(),
+                "previous": self.get_previous_link(),
+                "results": data,  # Paginated data
+            }
+        )
+
+    def _get_ordering_field(self, queryset, name):
+        """Model field or annotation output field used to parse cursor values"""
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.get_field(name)
+
+    def _get_position(self, instance, reverse):
+        values = []
+        for field in self.ordering:
+            value = getattr(instance, field.lstrip("-"))
+            if isinstance(value, (date, datetime)):
+                value = value.isoformat()
+            elif isinstance(value, Decimal):
+                value = str(value)
+            values.append(value)
+        return _Cursor(reverse=reverse, values=values)
+
+    def _get_order_by(self, reverse):
+        order_by = []
+        for field, model_field in zip(self.ordering, self.fields):
+            descending = field.startswith("-") != reverse
+            expression = F(field.lstrip("-"))
+            # NULLs stay last in the forward direction
+            nulls = {}
+            if model_field.null:
+                nulls = {"nulls_first": True} if reverse else {"nulls_last": True}
+            order_by.append(expression.desc(**nulls) if descending else expression.asc(**nulls))
+        return order_by
+
+    def _get_keyset_filter(self, cursor):
+        """
+        Build `(a > x) OR (a = x AND b > y) OR ...` for the cursor position,
+        where `>` means "comes after" in the requested direction.
+        """
+        keyset_filter = Q(pk__in=[])
+        equal = Q()
+        for field, model_field, value in zip(self.ordering, self.fields, cursor.values):
+            name = field.lstrip("-")
+            descending = field.startswith("-") != cursor.reverse
+            lookup = "lt" if descending else "gt"
+
+            if value is None:
+                # NULLs sort last, only non-NULL rows come before them
+                after = Q(**{f"{name}__isnull": False}) if cursor.reverse else Q(pk__in=[])
+                same = Q(**{f"{name}__isnull": True})
+            else:
+                after = Q(**{f"{name}__{lookup}": value})
+                if model_field.null and not cursor.reverse:
+                    after |= Q(**{f"{name}__isnull": True})
+                same = Q(**{name: value})
+
+            keyset_filter |= equal & after
+            equal &= same
+        return keyset_filter
+
+
+class _Cursor:
+    """Position of a page boundary row, `values` follow the pagination ordering"""
+
+    def __init__(self, reverse, values):
+        self.reverse = reverse
+        self.values = values
+
+
 class CustomJWTAuthentication(JWTAuthentication):
     """
     Custom JWT Authentication
@@ -72,4 +260,4 @@ class CustomJWTAuthentication(JWTAuthentication):
                 return (user, validated_token)
             except AuthenticationFailed:
                 return None
-        return None
\ No newline at end of file
+        return None
@@ -0,0 +1,16 @@
+#!/bin/bash
+# Run the web server and the worker of the database task queue (see
+# products/tasks.py) side by side. When either exits the other is stopped
+# too, so the container exits and is restarted as a whole.
+
+python manage.py run_tasks --concurrency "${TASK_CONCURRENCY:-2}" &
+worker=$!
+gunicorn furniture.wsgi:application --bind "0.0.0.0:${PORT}" --workers 3 --threads 2 &
+server=$!
+
+trap 'kill -TERM "$worker" "$server" 2>/dev/null' TERM INT
+wait -n
+status=$?
+kill -TERM "$worker" "$server" 2>/dev/null
+wait
+exit "$status"
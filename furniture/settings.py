@@ -51,7 +51,6 @@ INSTALLED_APPS = [
     "rest_framework_simplejwt",
     "rest_framework_simplejwt.token_blacklist",
     "drf_spectacular",
-    "debug_toolbar",
     "corsheaders",
     "users",
     "categories",
@@ -64,6 +63,7 @@ INTERNAL_IPS = [
 ]
 
 MIDDLEWARE = [
+    "instrumentation.ServerTimingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.security.SecurityMiddleware",
@@ -72,9 +72,14 @@ MIDDLEWARE = [
     "django.contrib.auth.middleware.AuthenticationMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
 ]
 
+# The toolbar is only for development, every request is measured by
+# instrumentation.ServerTimingMiddleware
+if DEBUG:
+    INSTALLED_APPS.append("debug_toolbar")
+    MIDDLEWARE.append("debug_toolbar.middleware.DebugToolbarMiddleware")
+
 ROOT_URLCONF = 'furniture.urls'
 
 TEMPLATES = [
@@ -127,6 +132,71 @@ DATABASES = {
     }
 }
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Shared by all gunicorn workers, so catalog cache invalidation reaches every worker
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": os.getenv("CACHE_LOCATION", str(BASE_DIR / ".cache")),
+        "OPTIONS": {
+            "MAX_ENTRIES": 10000,
+        },
+    }
+}
+
+# Serve dashboard stats from the CategoryStats table maintained by signals
+# instead of aggregating products, run `manage.py refresh_dashboard_stats` after enabling
+
+DASHBOARD_STATS_MATERIALIZED = os.getenv("DASHBOARD_STATS_MATERIALIZED", "False") == "True"
+
+# Salt of the hashids encoding of SKU numbers, never change it once products exist
+# or new SKUs may collide with existing ones
+
+SKU_HASHIDS_SALT = os.getenv("SKU_HASHIDS_SALT", "amjad-furniture-sku")
+
+# Chunks of resumable video uploads are assembled here, keep it on the filesystem
+# of MEDIA_ROOT so finished uploads are moved instead of copied
+
+CHUNKED_UPLOAD_DIR = os.getenv("CHUNKED_UPLOAD_DIR", str(BASE_DIR / ".uploads"))
+
+# Requests running more queries than the threshold of their view are logged as
+# warnings by instrumentation.ServerTimingMiddleware, thresholds are by URL name
+
+QUERY_COUNT_THRESHOLD = int(os.getenv("QUERY_COUNT_THRESHOLD", "20"))
+QUERY_COUNT_THRESHOLDS = {
+    "product-list": 5,
+    "product-detail": 5,
+    "product-facets": 5,
+    "category-list": 5,
+    "products_by_category": 5,
+    "dashboard_stats": 5,
+    "reviews-list-create": 5,
+}
+
+# Bearer token Prometheus scrapes /metrics with, the endpoint is closed while it is empty
+
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Only the requests over their query threshold are logged by default,
+# REQUEST_LOG_LEVEL=INFO logs a line for every request
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {
+        "console": {"class": "logging.StreamHandler"},
+    },
+    "loggers": {
+        "instrumentation": {
+            "handlers": ["console"],
+            "level": os.getenv("REQUEST_LOG_LEVEL", "WARNING"),
+            "propagate": False,
+        },
+    },
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -236,6 +306,19 @@ STATIC_URL = "/static/"
 MEDIA_ROOT = str(BASE_DIR / "media")
 MEDIA_URL = "/media/"
 
+# Media is served by products.media.serve_media with Range support. Set
+# MEDIA_SENDFILE_HEADER to X-Accel-Redirect (nginx, with an internal location at
+# MEDIA_ACCEL_REDIRECT_PREFIX aliased to MEDIA_ROOT) or X-Sendfile (Apache, lighttpd)
+# to let the front server send the files
+
+MEDIA_SENDFILE_HEADER = os.getenv("MEDIA_SENDFILE_HEADER", "")
+MEDIA_ACCEL_REDIRECT_PREFIX = os.getenv("MEDIA_ACCEL_REDIRECT_PREFIX", "/protected-media/")
+# Image blobs and variants are named after their contents and cached as
+# immutable, other media (videos, icons) can be replaced under the same name
+# once deleted, so they are revalidated with their ETag after a short time
+MEDIA_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+MEDIA_REVALIDATE_MAX_AGE = 5 * 60
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
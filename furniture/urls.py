@@ -15,12 +15,11 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 
+import re
 from django.contrib import admin
 from django.conf import settings
 from django.contrib.staticfiles.urls import staticfiles_urlpatterns
-from django.urls import path, include
-from django.conf.urls.static import static
-from debug_toolbar.toolbar import debug_toolbar_urls
+from django.urls import path, include, re_path
 
 from drf_spectacular.views import (
     SpectacularAPIView,
@@ -38,8 +37,12 @@ from products.views import (
     ProductImageViewSet,
     ProductsByCategoryView,
     DashboardStatsView,
+    TaskQueueStatsView,
+    VideoUploadView,
     ReviewViewSet,
 )
+from products.media import serve_media
+from metrics import metrics_view
 from support.views import SupportViewSet
 
 router = DefaultRouter()
@@ -116,6 +119,9 @@ urlpatterns = [
         name="products_by_category",
     ),
     path("dashboard-stats/", DashboardStatsView.as_view(), name="dashboard_stats"),
+    path("metrics", metrics_view, name="metrics"),
+    path("task-queue-stats/", TaskQueueStatsView.as_view(), name="task_queue_stats"),
+    path("video-uploads/<uuid:upload_id>/", VideoUploadView.as_view(), name="video_upload"),
     path(
         "reviews/",
         ReviewViewSet.as_view(
@@ -129,6 +135,12 @@ urlpatterns = [
 ]
 
 
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+urlpatterns += [
+    re_path(r"^%s(?P<path>.*)$" % re.escape(settings.MEDIA_URL.lstrip("/")), serve_media, name="media"),
+]
 urlpatterns += staticfiles_urlpatterns()
-urlpatterns += debug_toolbar_urls()
+
+if settings.DEBUG:
+    from debug_toolbar.toolbar import debug_toolbar_urls
+
+    urlpatterns += debug_toolbar_urls()
@@ -0,0 +1,20 @@
+import os
+import shutil
+
+
+# Each worker writes its metrics to files of this directory, the metrics
+# endpoint sums them, see metrics.py. It must be set before the workers
+# import prometheus_client, so it is set here in the master.
+multiproc_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/furniture-prometheus")
+
+
+def on_starting(server):
+    # Files of an earlier run would be added to the new counts
+    shutil.rmtree(multiproc_dir, ignore_errors=True)
+    os.makedirs(multiproc_dir)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
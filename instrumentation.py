@@ -0,0 +1,140 @@
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import connections
+from metrics import observe_request
+
+
+logger = logging.getLogger(__name__)
+
+# Timings of the request being handled by the current thread
+_current = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    """Query count and seconds spent in the database, serializers and renderers by one request."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.render = 0.0
+        self.serializing = False
+        self.render_started = None
+
+    def execute(self, execute, sql, params, many, context):
+        """Database execute wrapper, see connection.execute_wrapper()."""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db += time.perf_counter() - started
+            self.queries += 1
+
+
+class ServerTimingMiddleware:
+    """
+    Measure every request and report it in a Server-Timing header, a log
+    line and the metrics of metrics.py.
+
+    The header has the database time with the query count, the serializer,
+    render and total times, in milliseconds. Requests running more queries
+    than the threshold of their view, QUERY_COUNT_THRESHOLDS by URL name or
+    else QUERY_COUNT_THRESHOLD, are logged as warnings so N+1 queries show
+    up as soon as they are introduced.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(timings.execute))
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        total = time.perf_counter() - started
+        match = request.resolver_match
+        view = match.view_name if match else None
+
+        response["Server-Timing"] = ", ".join(
+            [
+                f'db;dur={timings.db * 1000:.1f};desc="{timings.queries} queries"',
+                f"serialize;dur={timings.serialize * 1000:.1f}",
+                f"render;dur={timings.render * 1000:.1f}",
+                f"total;dur={total * 1000:.1f}",
+            ]
+        )
+        self.log(request, response, view, timings, total)
+        observe_request(request.method, view, response.status_code, total, timings.queries, timings.db)
+        return response
+
+    def process_template_response(self, request, response):
+        # Called right before the response is rendered, the callback right after
+        timings = _current.get()
+        if timings is not None:
+            timings.render_started = time.perf_counter()
+
+            def rendered(response):
+                timings.render += time.perf_counter() - timings.render_started
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def log(self, request, response, view, timings, total):
+        threshold = settings.QUERY_COUNT_THRESHOLDS.get(view, settings.QUERY_COUNT_THRESHOLD)
+        fields = {
+            "method": request.method,
+            "path": request.path,
+            "view": view,
+            "status": response.status_code,
+            "queries": timings.queries,
+            "db_ms": round(timings.db * 1000, 1),
+            "serialize_ms": round(timings.serialize * 1000, 1),
+            "render_ms": round(timings.render * 1000, 1),
+            "total_ms": round(total * 1000, 1),
+        }
+        if timings.queries > threshold:
+            fields["query_threshold"] = threshold
+        logger.log(
+            logging.WARNING if timings.queries > threshold else logging.INFO,
+            " ".join(f"{name}={value}" for name, value in fields.items()),
+            extra={"request_timings": fields},
+        )
+
+
+@contextmanager
+def serializer_timing():
+    """Count the time of the block as serializer time of the current request, nested blocks are counted once."""
+    timings = _current.get()
+    if timings is None or timings.serializing:
+        yield
+        return
+    timings.serializing = True
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.serialize += time.perf_counter() - started
+        timings.serializing = False
+
+
+class TimedSerializerMixin:
+    """
+    Serializer mixin reporting the time spent representing instances in
+    the serialize timing of ServerTimingMiddleware.
+
+    Each instance is timed, so it also covers serializers used with
+    many=True, whose list serializer calls the child for every instance.
+    """
+
+    def to_representation(self, instance):
+        with serializer_timing():
+            return super().to_representation(instance)
@@ -0,0 +1,73 @@
+import hmac
+import os
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+from django.views.decorators.http import require_safe
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+
+# Metrics of every process are written to files in PROMETHEUS_MULTIPROC_DIR
+# when it is set, as gunicorn.conf.py does, and summed when scraped. Requests
+# are labelled by URL name, not path, so the number of series stays bounded.
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to handle a request, by URL name.",
+    ["method", "view"],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+REQUESTS = Counter("http_requests", "Requests handled, by URL name and status code.", ["method", "view", "status"])
+REQUEST_QUERIES = Histogram(
+    "http_request_queries",
+    "SQL queries run by a request, by URL name.",
+    ["view"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+REQUEST_DB_LATENCY = Histogram(
+    "http_request_db_duration_seconds",
+    "Time a request spent in SQL queries, by URL name.",
+    ["view"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+# The hit ratio of a cache is hit / (hit + miss)
+CACHE_REQUESTS = Counter("cache_requests", "Cache lookups, by cache and result (hit or miss).", ["cache", "result"])
+UPLOAD_BYTES = Counter("upload_bytes", "Bytes of uploaded files received, by kind.", ["kind"])
+
+
+def observe_request(method, view, status, seconds, queries, db_seconds):
+    view = view or "unmatched"
+    REQUEST_LATENCY.labels(method, view).observe(seconds)
+    REQUESTS.labels(method, view, str(status)).inc()
+    REQUEST_QUERIES.labels(view).observe(queries)
+    REQUEST_DB_LATENCY.labels(view).observe(db_seconds)
+
+
+def count_cache(cache, hit):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def count_upload_bytes(kind, size):
+    if size:
+        UPLOAD_BYTES.labels(kind).inc(size)
+
+
+@require_safe
+def metrics_view(request):
+    """
+    Metrics in the Prometheus text format, summed over the gunicorn workers.
+
+    Scrapers authenticate with `Authorization: Bearer <METRICS_TOKEN>`, the
+    endpoint is closed while METRICS_TOKEN is not set.
+    """
+    token = settings.METRICS_TOKEN
+    header = request.headers.get("Authorization", "")
+    if not token or not hmac.compare_digest(header.encode(), f"Bearer {token}".encode()):
+        return HttpResponseForbidden("Forbidden", content_type="text/plain")
+
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -1,6 +1,9 @@
+from django.conf import settings
 from django.contrib import admin
 
-from products.models import Product, ProductImage
+from products.cache import bump_catalog_version
+from products.documents import refresh_product_documents
+from products.models import CategoryStats, Product, ProductImage, Task
 
 admin.site.register(ProductImage)
 
@@ -14,9 +17,24 @@ class ProductAdmin(admin.ModelAdmin):
     @admin.action(description="Activate selected products")
     def make_active(self, request, queryset):
         updated = queryset.update(is_active=True)
+        bump_catalog_version()  # update() does not send post_save
+        refresh_product_documents(queryset)
+        if settings.DASHBOARD_STATS_MATERIALIZED:
+            CategoryStats.refresh()
         self.message_user(request, f"{updated} products were activated.")
 
     @admin.action(description="Deactivate selected products")
     def make_inactive(self, request, queryset):
         updated = queryset.update(is_active=False)
+        bump_catalog_version()  # update() does not send post_save
+        refresh_product_documents(queryset)
+        if settings.DASHBOARD_STATS_MATERIALIZED:
+            CategoryStats.refresh()
         self.message_user(request, f"{updated} products were deactivated.")
+
+
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'run_at', 'created_at', 'finished_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('locked_by', 'started_at', 'finished_at', 'last_error')
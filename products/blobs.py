@@ -0,0 +1,228 @@
+import hashlib
+import os
+import posixpath
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from PIL import Image
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+
+# Product images saved directly in this folder are stored once per content,
+# under blobs/<aa>/<bb>/<sha256><extension>
+BLOB_DIR = "products-images/blobs"
+
+# Unreferenced blobs stored more recently than this are not collected, so
+# uploads whose images are still to be attached by a task are kept
+BLOB_GRACE_PERIOD = timedelta(days=1)
+
+# Uploads hashed and written at once by save_blobs
+BLOB_WRITE_WORKERS = 8
+
+# Extension of the blobs of each Pillow format, other files are stored as
+# .bin so they are never served with the type of their client file name
+BLOB_EXTENSIONS = {"JPEG": ".jpg", "MPO": ".jpg", "PNG": ".png"}
+
+
+def blob_name(digest, extension):
+    """Storage name of the blob with this sha256 hex digest."""
+    return posixpath.join(BLOB_DIR, digest[:2], digest[2:4], f"{digest}{extension.lower()}")
+
+
+def blob_extension(path):
+    """Extension of the file at path, from the format in its header and not from its name."""
+    try:
+        with Image.open(path) as image:
+            image_format = image.format
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return ".bin"
+    return BLOB_EXTENSIONS.get(image_format, ".bin")
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage which stores each distinct file saved in BLOB_DIR
+    once, named by the sha256 of its content.
+
+    Uploads are hashed while they are written to a temporary file, which is
+    renamed to the blob name or dropped when the blob already exists. The
+    extension comes from the image format read in the file. Files
+    saved anywhere else, such as the variants of the blobs, are stored as
+    usual.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        if posixpath.dirname(name) == BLOB_DIR:
+            # The name is chosen by the content in _save
+            return name
+        return super().get_available_name(name, max_length)
+
+    def _save(self, name, content):
+        if posixpath.dirname(name) != BLOB_DIR:
+            return super()._save(name, content)
+        temporary, digest, size = self._write_temporary(content)
+        return self._store_temporaries([(temporary, blob_name(digest, blob_extension(temporary)), size)])[0]
+
+    def save_blobs(self, files):
+        """
+        Store uploaded files as blobs, hashing and writing them concurrently,
+        and return their names in the same order.
+        """
+        with ThreadPoolExecutor(max_workers=max(1, min(len(files), BLOB_WRITE_WORKERS))) as executor:
+            futures = [executor.submit(self._write_temporary, file) for file in files]
+        written = [future.result() for future in futures if future.exception() is None]
+        try:
+            errors = [future.exception() for future in futures if future.exception() is not None]
+            if errors:
+                raise errors[0]
+            # Database rows are only touched from the calling thread
+            return self._store_temporaries(
+                [
+                    (temporary, blob_name(digest, blob_extension(temporary)), size)
+                    for temporary, digest, size in written
+                ]
+            )
+        except BaseException:
+            for temporary, _, _ in written:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+            raise
+
+    def _write_temporary(self, content):
+        """Copy the content to a temporary file of the blob folder, returns (path, sha256 hex digest, size)."""
+        directory = self.path(BLOB_DIR)
+        os.makedirs(directory, exist_ok=True)
+        temporary = os.path.join(directory, f".{uuid.uuid4().hex}.part")
+        hasher = hashlib.sha256()
+        size = 0
+        if hasattr(content, "temporary_file_path"):
+            # Large uploads are already on disk, they are hashed and moved
+            for chunk in content.chunks():
+                hasher.update(chunk)
+                size += len(chunk)
+            file_move_safe(content.temporary_file_path(), temporary)
+            return temporary, hasher.hexdigest(), size
+        try:
+            # Created like FileSystemStorage does, so the umask applies
+            fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+            with open(fd, "wb") as file:
+                for chunk in content.chunks():
+                    hasher.update(chunk)
+                    file.write(chunk)
+                    size += len(chunk)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+        return temporary, hasher.hexdigest(), size
+
+    def _store_temporaries(self, written):
+        """
+        Rename written temporary files to their blobs, or drop them when the
+        blob exists, given (temporary path, blob name, size). Returns the names.
+        """
+        try:
+            # Recorded before the files are looked up, so a collection running
+            # at the same time either waits for these rows or skips the blobs
+            touch_blobs({name: size for _, name, size in written})
+            for temporary, name, _ in written:
+                full_path = self.path(name)
+                if os.path.exists(full_path):
+                    os.remove(temporary)
+                else:
+                    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                    file_move_safe(temporary, full_path, allow_overwrite=True)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(full_path, self.file_permissions_mode)
+        except BaseException:
+            for temporary, _, _ in written:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+            raise
+        return [name for _, name, _ in written]
+
+
+blob_storage = ContentAddressedStorage()
+
+
+def is_blob(name):
+    return bool(name) and name.startswith(BLOB_DIR + "/")
+
+
+def touch_blobs(sizes):
+    """Record that the blobs, given as {name: size}, were just stored, creating their rows with no reference."""
+    from .models import ImageBlob
+
+    now = timezone.now()
+    ImageBlob.objects.bulk_create(
+        [ImageBlob(name=name, size=size, stored_at=now) for name, size in sizes.items()],
+        update_conflicts=True,
+        unique_fields=["name"],
+        update_fields=["stored_at"],
+    )
+
+
+def update_references(added=(), removed=()):
+    """Count the product images referencing the blobs, given the image names they gained and lost."""
+    from .models import ImageBlob
+
+    changes = Counter(name for name in added if is_blob(name))
+    changes.subtract(name for name in removed if is_blob(name))
+    for name, change in changes.items():
+        if change:
+            ImageBlob.objects.filter(name=name).update(ref_count=F("ref_count") + change)
+
+
+def recount_references():
+    """Set the reference counts of every blob from the product images, returns the blobs changed."""
+    from .models import ImageBlob, ProductImage
+
+    references = (
+        ProductImage.objects.filter(image=OuterRef("name"))
+        .order_by()
+        .values("image")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    count = Coalesce(Subquery(references), 0)
+    return ImageBlob.objects.exclude(ref_count=count).update(ref_count=count)
+
+
+def collect_garbage(grace_period=BLOB_GRACE_PERIOD):
+    """
+    Delete the blobs no product image references, with their variants.
+
+    Returns the number of blobs and bytes freed.
+    """
+    from .models import ImageBlob
+
+    with transaction.atomic():
+        blobs = list(
+            ImageBlob.objects.select_for_update(skip_locked=True).filter(
+                ref_count__lte=0, stored_at__lt=timezone.now() - grace_period
+            )
+        )
+        for blob in blobs:
+            delete_blob_files(blob.name)
+        ImageBlob.objects.filter(pk__in=[blob.pk for blob in blobs]).delete()
+    return len(blobs), sum(blob.size for blob in blobs)
+
+
+def delete_blob_files(name):
+    """Delete a blob and the variants rendered from it, see products/images.py."""
+    folder, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    variants = posixpath.join(folder, "variants")
+    if blob_storage.exists(variants):
+        for variant in blob_storage.listdir(variants)[1]:
+            if variant.startswith(f"{stem}-"):
+                blob_storage.delete(posixpath.join(variants, variant))
+    blob_storage.delete(name)
@@ -0,0 +1,176 @@
+import hashlib
+import threading
+import time
+from functools import wraps
+from urllib.parse import urlencode
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from metrics import count_cache
+
+
+# Any change to products, images or categories bumps this version, cached
+# responses of older versions are never read again and simply expire
+CATALOG_VERSION_KEY = "catalog:version"
+CATALOG_MODIFIED_KEY = "catalog:modified"
+CATALOG_CACHE_TIMEOUT = 60 * 60
+
+# Hits and misses of this process, counting them in the shared cache would
+# cost a cache write on every read. Metrics summed over the workers are
+# exported by metrics.count_cache.
+_cache_counts = {"hits": 0, "misses": 0}
+_cache_counts_lock = threading.Lock()
+
+
+def get_catalog_version():
+    """Return the current catalog version, starting one if there is none."""
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Start from the clock so a lost counter never reuses an old version
+        now = time.time()
+        cache.add(CATALOG_MODIFIED_KEY, now, timeout=None)
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def get_catalog_last_modified():
+    """Timestamp of the last catalog change, or of when tracking started."""
+    last_modified = cache.get(CATALOG_MODIFIED_KEY)
+    if last_modified is None:
+        last_modified = time.time()
+        cache.add(CATALOG_MODIFIED_KEY, last_modified, timeout=None)
+    return last_modified
+
+
+def bump_catalog_version():
+    """
+    Invalidate every cached catalog response once the current transaction
+    commits, right away outside of a transaction.
+
+    Bumping before the commit would let a concurrent read cache the old
+    data under the new version.
+    """
+    transaction.on_commit(_bump_catalog_version)
+
+
+def _bump_catalog_version():
+    cache.set(CATALOG_MODIFIED_KEY, time.time(), timeout=None)
+    # A plain set of the clock rather than incr, which is a read then a write
+    # on the file cache and can lose a concurrent bump. Concurrent bumps may
+    # overwrite each other, but each stores a version newer than any stored
+    # before its change was committed.
+    cache.set(CATALOG_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def get_catalog_cache_stats():
+    """Hit and miss counters of the catalog response cache in this process."""
+    with _cache_counts_lock:
+        hits, misses = _cache_counts["hits"], _cache_counts["misses"]
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": hits / (hits + misses) if hits + misses else None,
+        "version": get_catalog_version(),
+    }
+
+
+def _count(hit):
+    with _cache_counts_lock:
+        _cache_counts["hits" if hit else "misses"] += 1
+    count_cache("catalog", hit=hit)
+
+
+def get_catalog_cache_key(request, version):
+    """
+    Cache key of the request URL with its normalized query parameters.
+
+    Responses hold absolute URLs (pagination links, images) built from the
+    scheme and host, so those are part of the key.
+    """
+    params = sorted(
+        (name, value)
+        for name, values in request.query_params.lists()
+        for value in values
+        if value != ""
+    )
+    digest = hashlib.md5(
+        f"{request.scheme}://{request.get_host()}{request.path}?{urlencode(params)}:"
+        f"{request.accepted_renderer.format}".encode()
+    ).hexdigest()
+    return f"catalog:{version}:{digest}"
+
+
+def cache_catalog_response(view_method):
+    """
+    Cache the rendered JSON response of a catalog read for anonymous users.
+
+    The key is made of the URL, the normalized query parameters and the
+    catalog version, so no stale response is served after a change.
+    """
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.user.is_authenticated or request.accepted_renderer.format != "json":
+            return view_method(self, request, *args, **kwargs)
+
+        key = get_catalog_cache_key(request, get_catalog_version())
+        cached = cache.get(key)
+        if cached is not None:
+            _count(hit=True)
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            response["X-Cache"] = "HIT"
+            return response
+
+        _count(hit=False)
+        response = view_method(self, request, *args, **kwargs)
+
+        def store(rendered):
+            cache.set(key, (rendered.content, rendered["Content-Type"]), CATALOG_CACHE_TIMEOUT)
+
+        if response.status_code == 200:
+            response.add_post_render_callback(store)
+        response["X-Cache"] = "MISS"
+        return response
+
+    return wrapper
+
+
+def conditional_catalog_response(view_method):
+    """
+    Answer catalog reads with 304 Not Modified when the client copy is current.
+
+    The ETag is derived from the catalog version and the request, and
+    Last-Modified from the time of the last catalog change, so a matching
+    If-None-Match or If-Modified-Since returns before any query runs.
+    """
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        version = get_catalog_version()
+        # Authenticated users also see inactive products
+        digest = hashlib.md5(
+            f"{get_catalog_cache_key(request, version)}:{request.user.is_authenticated}".encode()
+        ).hexdigest()
+        etag = f'W/"{digest}"'
+        last_modified = int(get_catalog_last_modified())
+
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        count_cache("catalog_etag", hit=response is not None)
+        if response is None:
+            response = view_method(self, request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        if request.user.is_authenticated:
+            patch_cache_control(response, no_cache=True, private=True)
+        else:
+            patch_cache_control(response, no_cache=True)
+        return response
+
+    return wrapper
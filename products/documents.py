@@ -0,0 +1,100 @@
+import json
+
+
+# Batch size used when documents of many products are rebuilt at once
+DOCUMENT_BATCH_SIZE = 500
+
+
+def build_product_document(product):
+    """
+    Public representation of the product, as ProductSerializer renders it
+    without a request, so file URLs are relative.
+    """
+    from .serializers import ProductSerializer
+
+    # Round trip through JSON so the document compares equal once stored
+    return json.loads(json.dumps(ProductSerializer(product).data))
+
+
+def _build_documents(products):
+    from .serializers import ProductSerializer
+
+    # One serializer for the whole batch, its fields are only built once
+    return json.loads(json.dumps(ProductSerializer(products, many=True).data))
+
+
+def _store_documents(products):
+    from .models import Product
+
+    for product, document in zip(products, _build_documents(products)):
+        product.document = document
+    Product.objects.bulk_update(products, ["document"])
+
+
+def refresh_product_documents(queryset):
+    """Rebuild and store the documents of every product in the queryset."""
+    batch = []
+    products = queryset.select_related("category").prefetch_related("images").defer("search_vector")
+    for product in products.iterator(chunk_size=DOCUMENT_BATCH_SIZE):
+        batch.append(product)
+        if len(batch) >= DOCUMENT_BATCH_SIZE:
+            _store_documents(batch)
+            batch = []
+    if batch:
+        _store_documents(batch)
+
+
+def render_product_documents(products, request=None):
+    """
+    Render the documents of the products, see render_product_document.
+
+    Products without a stored document are loaded again with their category
+    and images, and their documents built in one batch, so no query runs
+    per product. They are not stored, reads never write: `manage.py
+    check_product_documents --fix` stores the missing ones.
+    """
+    from .models import Product
+
+    products = list(products)
+    missing = [product.pk for product in products if product.document is None]
+    if missing:
+        rebuilt = list(
+            Product.objects.filter(pk__in=missing)
+            .select_related("category")
+            .prefetch_related("images")
+            .defer("search_vector")
+        )
+        documents = {product.pk: document for product, document in zip(rebuilt, _build_documents(rebuilt))}
+        for product in products:
+            if product.document is None:
+                product.document = documents.get(product.pk)
+    return [render_product_document(product, request) for product in products]
+
+
+def render_product_document(product, request=None):
+    """
+    Return the stored document of the product with absolute file URLs,
+    building it on the fly when it was not stored yet.
+    """
+    document = product.document
+    if document is None:
+        document = build_product_document(product)
+    if request is None:
+        return document
+
+    for image in document["images"]:
+        if image["image"]:
+            image["image"] = request.build_absolute_uri(image["image"])
+        _absolutize_srcset(image.get("srcset"), request)
+    if document["product_video"]:
+        document["product_video"] = request.build_absolute_uri(document["product_video"])
+    if document["category"] and document["category"]["icon"]:
+        document["category"]["icon"] = request.build_absolute_uri(document["category"]["icon"])
+        _absolutize_srcset(document["category"].get("icon_srcset"), request)
+    return document
+
+
+def _absolutize_srcset(srcset, request):
+    for urls in (srcset or {}).values():
+        for width, url in urls.items():
+            urls[width] = request.build_absolute_uri(url)
@@ -0,0 +1,76 @@
+import csv
+import json
+from .documents import render_product_documents
+
+
+# Rows are read from the database this many at a time
+EXPORT_CHUNK_SIZE = 2000
+
+EXPORT_FIELDS = [
+    "id",
+    "sku",
+    "slug",
+    "name",
+    "category",
+    "description",
+    "price",
+    "color",
+    "length_cm",
+    "width_cm",
+    "height_cm",
+    "depth_cm",
+    "stock",
+    "country_of_origin",
+    "wood_material",
+    "fabric_material",
+    "upholstery_material",
+    "warranty_months",
+    "images",
+    "product_video",
+    "is_best_seller",
+    "is_active",
+    "created_at",
+    "updated_at",
+]
+
+
+def export_records(queryset, request=None):
+    """Yield one flat export record per product, reading the queryset in chunks."""
+    products = queryset.defer("search_vector").order_by("id")
+    chunk = []
+    for product in products.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+        chunk.append(product)
+        if len(chunk) >= EXPORT_CHUNK_SIZE:
+            yield from _records(chunk, request)
+            chunk = []
+    yield from _records(chunk, request)
+
+
+def _records(products, request):
+    for document in render_product_documents(products, request):
+        record = {field: document.get(field) for field in EXPORT_FIELDS}
+        record["category"] = document["category"]["name"] if document["category"] else None
+        record["images"] = [image["image"] for image in document["images"] if image["image"]]
+        yield record
+
+
+def export_ndjson(records):
+    """Yield one JSON line per record."""
+    for record in records:
+        yield json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+class _Echo:
+    """File-like object which returns what is written, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def export_csv(records):
+    """Yield the CSV header and one CSV line per record, images are separated by `|`."""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for record in records:
+        record["images"] = "|".join(record["images"])
+        yield writer.writerow([record[field] for field in EXPORT_FIELDS])
@@ -0,0 +1,239 @@
+import logging
+import threading
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+from decimal import Decimal
+from django.db import connection
+from .cache import get_catalog_version
+from .search import search_products
+
+
+logger = logging.getLogger(__name__)
+
+# Lower bounds of the price buckets, the last bucket has no upper bound
+PRICE_BUCKETS = (0, 1000, 2500, 5000, 10000, 25000, 50000)
+
+# Facets over text fields, values are compared case-insensitively
+TEXT_FACETS = (
+    ("colors", "color"),
+    ("wood_materials", "wood_material"),
+    ("fabric_materials", "fabric_material"),
+    ("upholstery_materials", "upholstery_material"),
+)
+
+
+def normalize_facet_value(value):
+    """Casefold the value and collapse its whitespace, so spelling variants are counted together."""
+    return " ".join(value.split()).casefold() if value else ""
+
+
+class FacetIndex:
+    """
+    In-memory bitmap index of the catalog for the filter sidebar.
+
+    Each product is a bit, numbered by ascending price so a price range is
+    a contiguous run of bits. Each facet value has the bitmap of its
+    products, so counting the products of a value under the current filters
+    is one AND and one popcount of Python integers.
+
+    Only the first lookup of a process waits for the index to be built.
+    When the catalog version changes, it is rebuilt in a background thread
+    and lookups keep using the previous index until the new one replaces it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.state = None
+
+    def invalidate(self):
+        """Drop the index, the next lookup builds it again."""
+        with self.lock:
+            self.version = None
+            self.state = None
+
+    def is_stale(self):
+        return self.version != get_catalog_version()
+
+    def build(self):
+        from categories.models import Category
+        from products.models import Product
+
+        fields = [field for _, field in TEXT_FACETS]
+        rows = list(
+            Product.objects.order_by("price", "pk").values_list(
+                "pk", "price", "category_id", "is_active", "is_best_seller", *fields
+            )
+        )
+        # NULL prices sort first, they are moved to the end so priced products stay contiguous
+        rows = [row for row in rows if row[1] is not None] + [row for row in rows if row[1] is None]
+
+        count = len(rows)
+        positions = {}
+        prices = []
+        active = []
+        best_seller = []
+        value_positions = {"categories": defaultdict(list), **{facet: defaultdict(list) for facet, _ in TEXT_FACETS}}
+        labels = {facet: defaultdict(Counter) for facet, _ in TEXT_FACETS}
+        for position, (pk, price, category_id, is_active, is_best_seller, *values) in enumerate(rows):
+            positions[pk] = position
+            if price is not None:
+                prices.append(price)
+            if is_active:
+                active.append(position)
+            if is_best_seller:
+                best_seller.append(position)
+            value_positions["categories"][category_id].append(position)
+            for (facet, _), value in zip(TEXT_FACETS, values):
+                key = normalize_facet_value(value)
+                if key:
+                    value_positions[facet][key].append(position)
+                    labels[facet][key][value.strip()] += 1
+
+        state = {
+            "count": count,
+            "positions": positions,
+            "prices": prices,
+            "active": bitmap(active, count),
+            "best_seller": bitmap(best_seller, count),
+            **{
+                facet: {key: bitmap(bits, count) for key, bits in values.items()}
+                for facet, values in value_positions.items()
+            },
+        }
+        # The most frequent spelling of each value is shown
+        state["labels"] = {
+            facet: {key: spellings.most_common(1)[0][0] for key, spellings in values.items()}
+            for facet, values in labels.items()
+        }
+        state["category_names"] = dict(Category.objects.values_list("pk", "name"))
+        return state
+
+    def get_state(self):
+        if self.state is None:
+            with self.lock:
+                if self.state is None:
+                    self.rebuild()
+        elif self.is_stale():
+            self.refresh()
+        return self.state
+
+    def refresh(self):
+        """Rebuild the index in a background thread, unless a rebuild is running already."""
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            threading.Thread(target=self._rebuild, name="facet-index", daemon=True).start()
+        except Exception:
+            self.lock.release()
+            raise
+
+    def rebuild(self):
+        # Read before the rows, a change made meanwhile is picked up by the next rebuild
+        version = get_catalog_version()
+        self.state = self.build()
+        self.version = version
+
+    def _rebuild(self):
+        try:
+            self.rebuild()
+        except Exception:
+            # The previous index is kept, the next lookup tries again
+            logger.exception("Rebuilding the facet index failed")
+        finally:
+            connection.close()
+            self.lock.release()
+
+    def facets(self, filters, active_only):
+        """
+        Product counts by category, color, material and price bucket.
+
+        `filters` may hold `category` (id), `color` (substring), `price_min`,
+        `price_max` (Decimal), `best_seller` (bool) and `search` (text), as
+        the product list does. The counts of a facet apply every filter but
+        its own, so the sidebar also shows the alternatives to a selection.
+        """
+        state = self.get_state()
+        everything = (1 << state["count"]) - 1
+
+        masks = {}
+        base = state["active"] if active_only else everything
+        if filters.get("best_seller") is not None:
+            base &= state["best_seller"] if filters["best_seller"] else ~state["best_seller"]
+        if filters.get("search"):
+            base &= self.search_mask(state, filters["search"])
+        if filters.get("category") is not None:
+            masks["categories"] = state["categories"].get(filters["category"], 0)
+        if filters.get("color"):
+            needle = normalize_facet_value(filters["color"])
+            masks["colors"] = 0
+            for key, bits in state["colors"].items():
+                if needle in key:
+                    masks["colors"] |= bits
+        if filters.get("price_min") is not None or filters.get("price_max") is not None:
+            masks["price_ranges"] = price_mask(state, filters.get("price_min"), filters.get("price_max"))
+
+        def mask_without(facet):
+            mask = base
+            for name, facet_mask in masks.items():
+                if name != facet:
+                    mask &= facet_mask
+            return mask
+
+        result = {"total": mask_without(None).bit_count()}
+        mask = mask_without("categories")
+        result["categories"] = _sorted_counts(
+            {"id": category_id, "name": state["category_names"].get(category_id), "count": (mask & bits).bit_count()}
+            for category_id, bits in state["categories"].items()
+        )
+        for facet, _ in TEXT_FACETS:
+            mask = mask_without(facet)
+            result[facet] = _sorted_counts(
+                {"value": state["labels"][facet][key], "count": (mask & bits).bit_count()}
+                for key, bits in state[facet].items()
+            )
+        mask = mask_without("price_ranges")
+        bounds = list(PRICE_BUCKETS) + [None]
+        result["price_ranges"] = [
+            {"min": low, "max": high, "count": (mask & price_mask(state, low, high, upper_inclusive=False)).bit_count()}
+            for low, high in zip(bounds, bounds[1:])
+        ]
+        return result
+
+    def search_mask(self, state, search):
+        from products.models import Product
+
+        positions = state["positions"]
+        pks = search_products(Product.objects.all(), search).values_list("pk", flat=True)
+        return bitmap((positions[pk] for pk in pks if pk in positions), state["count"])
+
+
+def bitmap(positions, size):
+    """Integer with the given bits set, built in a bytearray as setting bits one by one copies the integer."""
+    data = bytearray((size + 7) // 8)
+    for position in positions:
+        data[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(data, "little")
+
+
+def price_mask(state, low=None, high=None, upper_inclusive=True):
+    """Bitmap of the priced products with low <= price <= high, bounds are optional."""
+    prices = state["prices"]
+    start = bisect_left(prices, Decimal(low)) if low is not None else 0
+    if high is None:
+        end = len(prices)
+    elif upper_inclusive:
+        end = bisect_right(prices, Decimal(high))
+    else:
+        end = bisect_left(prices, Decimal(high))
+    if end <= start:
+        return 0
+    return ((1 << end) - 1) ^ ((1 << start) - 1)
+
+
+def _sorted_counts(items):
+    """Items with products, most products first."""
+    return sorted((item for item in items if item["count"]), key=lambda item: -item["count"])
+
+
+facet_index = FacetIndex()
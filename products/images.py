@@ -0,0 +1,182 @@
+import hashlib
+import io
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+from .cache import bump_catalog_version
+from .documents import refresh_product_documents
+
+
+# Pillow formats of accepted product image uploads, MPO is the JPEG of some cameras
+IMAGE_FORMATS = ("JPEG", "MPO", "PNG")
+MAX_IMAGE_SIZE = 5 * 1024 * 1024
+MAX_IMAGE_DIMENSION = 10000
+
+# Uploaded images checked at once by check_images
+IMAGE_CHECK_WORKERS = 8
+
+# Widths of the variants, wider ones are skipped for smaller originals
+PRODUCT_IMAGE_WIDTHS = (320, 640, 1024, 1600)
+CATEGORY_ICON_WIDTHS = (64, 128, 256)
+
+# Output format and Pillow save options of each variant format
+VARIANT_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+
+# Hex digits of the content hash in variant names
+VARIANT_DIGEST_LENGTH = 12
+
+
+def check_image(file):
+    """
+    Error message for an uploaded file which is not an acceptable product
+    image, or None. Only the header is read, the pixels are not decoded.
+    """
+    if file.size > MAX_IMAGE_SIZE:
+        return "Image file size should not exceed 5MB."
+    try:
+        file.seek(0)
+        with Image.open(file) as image:
+            image_format, (width, height) = image.format, image.size
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError):
+        return "The file is not a valid image."
+    finally:
+        file.seek(0)
+    if image_format not in IMAGE_FORMATS:
+        return "Only PNG, JPG, and JPEG images are allowed."
+    if max(width, height) > MAX_IMAGE_DIMENSION:
+        return f"Image dimensions should not exceed {MAX_IMAGE_DIMENSION} pixels."
+    return None
+
+
+def check_images(files):
+    """Check uploaded images concurrently, returns the errors as "<file name>: <error>"."""
+    with ThreadPoolExecutor(max_workers=max(1, min(len(files), IMAGE_CHECK_WORKERS))) as executor:
+        errors = list(executor.map(check_image, files))
+    return [f"{file.name}: {error}" for file, error in zip(files, errors) if error]
+
+
+def variant_name(name, width, extension, digest):
+    """
+    Storage name of a variant, next to the original in a `variants` folder.
+
+    The name holds the sha256 `digest` of the variant, so rendering the
+    variant again with other contents never reuses a name media responses
+    were cached under.
+    """
+    folder, filename = posixpath.split(name)
+    stem = posixpath.splitext(filename)[0]
+    return posixpath.join(folder, "variants", f"{stem}-{width}w-{digest[:VARIANT_DIGEST_LENGTH]}.{extension}")
+
+
+def render_variants(field_file, widths):
+    """
+    Save the resized variants of an image file and return their names,
+    as {"source": original name, format: {width: name}}.
+    """
+    storage = field_file.storage
+    with field_file.open("rb"), Image.open(field_file) as original:
+        # JPEG originals are decoded at a reduced scale when that is enough
+        original.draft("RGB", (max(widths), max(widths)))
+        image = ImageOps.exif_transpose(original)
+        image.load()
+
+    sizes = [width for width in widths if width < image.width] or [image.width]
+    if image.width not in sizes and image.width < max(widths):
+        sizes.append(image.width)
+
+    variants = {"source": field_file.name}
+    resized_images = {}
+    for extension, (image_format, options) in VARIANT_FORMATS.items():
+        source = _prepare(image, image_format)
+        variants[extension] = {}
+        for width in sizes:
+            # Formats sharing a mode share the resized image
+            key = (source.mode, width)
+            if key not in resized_images:
+                height = max(1, round(image.height * width / image.width))
+                resized_images[key] = source.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+            buffer = io.BytesIO()
+            resized_images[key].save(buffer, image_format, **options)
+
+            content = buffer.getvalue()
+            name = variant_name(field_file.name, width, extension, hashlib.sha256(content).hexdigest())
+            if not storage.exists(name):
+                name = storage.save(name, ContentFile(content))
+            variants[extension][str(width)] = name
+    return variants
+
+
+def _prepare(image, image_format):
+    """Convert the image to a mode the format can save, JPEG gets a white background."""
+    if image_format != "JPEG":
+        return image if image.mode in ("RGB", "RGBA") else image.convert("RGBA")
+    if image.mode == "RGB":
+        return image
+    rgba = image.convert("RGBA")
+    flattened = Image.new("RGB", rgba.size, "white")
+    flattened.paste(rgba, mask=rgba.getchannel("A"))
+    return flattened
+
+
+def has_current_variants(name, variants):
+    """Whether the variants were rendered from the file with this name."""
+    return bool(variants) and variants.get("source") == name
+
+
+def variant_urls(field_file, variants, request=None):
+    """
+    {format: {width: url}} of the variants of an image, for srcset attributes.
+
+    Empty until the variants of the current file are rendered.
+    """
+    if not field_file or not has_current_variants(field_file.name, variants):
+        return {}
+    urls = {}
+    for extension in VARIANT_FORMATS:
+        urls[extension] = {}
+        for width, name in variants.get(extension, {}).items():
+            url = field_file.storage.url(name)
+            urls[extension][width] = request.build_absolute_uri(url) if request is not None else url
+    return urls
+
+
+def create_product_image_variants(image_id, refresh=True):
+    """Render the variants of a product image and store their names."""
+    from .models import Product, ProductImage
+
+    product_image = ProductImage.objects.filter(pk=image_id).first()
+    if product_image is None or not product_image.image:
+        return None
+    # Images sharing a blob share its variants, see products/blobs.py
+    name = product_image.image.name
+    shared = ProductImage.objects.filter(image=name, variants__source=name).exclude(pk=image_id).first()
+    if shared is not None:
+        variants = shared.variants
+    else:
+        variants = render_variants(product_image.image, PRODUCT_IMAGE_WIDTHS)
+    # update() sends no signal, so saving the variants renders nothing again
+    ProductImage.objects.filter(pk=image_id, image=name).update(variants=variants)
+    if refresh:
+        refresh_product_documents(Product.objects.filter(pk=product_image.product_id))
+        bump_catalog_version()
+    return product_image.product_id
+
+
+def create_category_icon_variants(category_id, refresh=True):
+    """Render the variants of a category icon and store their names."""
+    from categories.models import Category
+    from .models import Product
+
+    category = Category.objects.filter(pk=category_id).first()
+    if category is None or not category.icon:
+        return None
+    variants = render_variants(category.icon, CATEGORY_ICON_WIDTHS)
+    Category.objects.filter(pk=category_id, icon=category.icon.name).update(icon_variants=variants)
+    if refresh:
+        refresh_product_documents(Product.objects.filter(category_id=category_id))
+        bump_catalog_version()
+    return category_id
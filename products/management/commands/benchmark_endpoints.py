@@ -0,0 +1,363 @@
+import http.client
+import json
+import os
+import platform
+import random
+import resource
+import signal
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from categories.models import Category
+from products.cache import bump_catalog_version
+from products.management.commands.import_products import import_products
+from products.models import CategoryStats, Product, Review
+from products.search import suggestion_index
+from users.models import User
+from users.utils import get_tokens
+
+
+# Seeded rows are recognized by these names and deleted afterwards
+CATEGORY_PREFIX = "Benchmark category"
+PRODUCT_PREFIX = "Benchmark product"
+REVIEW_PREFIX = "Benchmark review"
+USERNAME = "benchmark"
+PASSWORD = "benchmark-password"
+
+CATEGORY_COUNT = 20
+REVIEW_COUNT = 200
+PRODUCT_WORDS = ("كنبة", "Sofa", "طاولة", "Table", "كرسي", "Chair", "سرير", "Bed", "Wardrobe", "دولاب")
+COLORS = ("Beige", "Grey", "Walnut", "بني", "أزرق", "White", "Black")
+WOODS = ("Beech", "Oak", "زان", "MDF", None)
+FABRICS = ("Linen", "Velvet", "Leather", "قطيفة", None)
+
+# (name, method, path, authenticated), {category} is a seeded category id
+ENDPOINTS = (
+    ("products", "GET", "/products/?page_size=20", False),
+    ("products category", "GET", "/products/?page_size=20&category={category}", False),
+    ("products color", "GET", "/products/?page_size=20&color=beige", False),
+    ("products price range", "GET", "/products/?page_size=20&price_min=1000&price_max=5000", False),
+    ("products best seller", "GET", "/products/?page_size=20&best_seller=true", False),
+    ("products search", "GET", "/products/?page_size=20&search=sofa", False),
+    ("products order by price", "GET", "/products/?page_size=20&order_by_price=min", False),
+    ("products facets", "GET", "/products/facets/?category={category}", False),
+    ("categories", "GET", "/categories/", False),
+    ("category products", "GET", "/category/{category}/products/", True),
+    ("dashboard stats", "GET", "/dashboard-stats/", True),
+    ("reviews", "GET", "/reviews/", True),
+    ("login", "POST", "/auth/login", False),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed catalogs of increasing sizes and measure the latency of the public endpoints through the "
+        "Django test client and a gunicorn process. Writes the results as JSON, to compare with a baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="Catalog sizes.")
+        parser.add_argument("--requests", type=int, default=50, help="Timed requests per endpoint.")
+        parser.add_argument("--driver", choices=["client", "gunicorn", "both"], default="both")
+        parser.add_argument("--workers", type=int, default=3, help="gunicorn workers, as in the Dockerfile.")
+        parser.add_argument("--concurrency", type=int, default=1, help="Concurrent requests sent to gunicorn.")
+        parser.add_argument(
+            "--cold", action="store_true", help="Invalidate the catalog cache before every request."
+        )
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the generated catalog.")
+        parser.add_argument("--output", default="benchmark-results.json", help="File the results are written to.")
+        parser.add_argument("--compare", help="Results of an earlier run to compare with.")
+        parser.add_argument(
+            "--threshold", type=float, default=10.0, help="Slowdown of the p95 latency reported, in percent."
+        )
+        parser.add_argument("--keep", action="store_true", help="Keep the seeded rows.")
+        parser.add_argument("--noinput", "--no-input", action="store_false", dest="interactive")
+
+    def handle(self, *args, **options):
+        if options["interactive"]:
+            answer = input(
+                f"This adds up to {max(options['sizes'])} products to the database "
+                f"{connection.settings_dict['NAME']!r} and deletes them afterwards. Type 'yes' to continue: "
+            )
+            if answer != "yes":
+                raise CommandError("Benchmark cancelled.")
+
+        results = {"meta": self.meta(options), "results": [], "peak_rss_mb": {}}
+        seeder = CatalogSeeder(options["seed"])
+        try:
+            for size in sorted(options["sizes"]):
+                started = time.perf_counter()
+                seeder.seed(size)
+                self.stdout.write(f"Seeded {size} products in {time.perf_counter() - started:.1f}s.")
+                context = {"category": seeder.categories[0].pk}
+
+                if options["driver"] in ("client", "both"):
+                    results["results"] += self.run_client(size, context, seeder.token, options)
+                    results["peak_rss_mb"][f"client {size}"] = _max_rss_mb()
+                if options["driver"] in ("gunicorn", "both"):
+                    rows, rss = self.run_gunicorn(size, context, seeder.token, options)
+                    results["results"] += rows
+                    results["peak_rss_mb"][f"gunicorn {size}"] = rss
+        finally:
+            if not options["keep"]:
+                seeder.delete()
+
+        with open(options["output"], "w") as file:
+            json.dump(results, file, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {options['output']}."))
+        if options["compare"]:
+            self.compare(options["compare"], results, options["threshold"])
+
+    def meta(self, options):
+        try:
+            commit = subprocess.run(
+                ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            "commit": commit,
+            "date": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "django": django.get_version(),
+            "database": connection.vendor,
+            "cpus": os.cpu_count(),
+            **{name: options[name] for name in ("sizes", "requests", "workers", "concurrency", "cold", "seed")},
+        }
+
+    def run_client(self, size, context, token, options):
+        client = Client()
+        rows = []
+        for name, method, path, authenticated in ENDPOINTS:
+            path = path.format(**context)
+            headers = {"HTTP_AUTHORIZATION": token} if authenticated else {}
+            latencies = []
+            queries = []
+            for attempt in range(options["requests"] + 1):
+                if options["cold"]:
+                    bump_catalog_version()
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    if method == "POST":
+                        response = client.post(path, {"username": USERNAME, "password": PASSWORD}, **headers)
+                    else:
+                        response = client.get(path, **headers)
+                    elapsed = time.perf_counter() - started
+                if response.status_code >= 400:
+                    raise CommandError(f"{method} {path} answered {response.status_code}.")
+                # The first request warms the caches and is not counted
+                if attempt:
+                    latencies.append(elapsed)
+                    queries.append(len(captured))
+            rows.append(self.report(size, "client", name, latencies, queries=sum(queries) / len(queries)))
+        return rows
+
+    def run_gunicorn(self, size, context, token, options):
+        port = _free_port()
+        server = subprocess.Popen(
+            [
+                sys.executable, "-m", "gunicorn", "furniture.wsgi:application",
+                "--bind", f"127.0.0.1:{port}", "--workers", str(options["workers"]), "--log-level", "warning",
+            ],
+            cwd=settings.BASE_DIR,
+        )
+        try:
+            _wait_for_port(port, server)
+            rows = []
+            for name, method, path, authenticated in ENDPOINTS:
+                path = path.format(**context)
+                headers = {"Authorization": token} if authenticated else {}
+                body = None
+                if method == "POST":
+                    body = json.dumps({"username": USERNAME, "password": PASSWORD})
+                    headers["Content-Type"] = "application/json"
+
+                def send(_):
+                    if options["cold"]:
+                        bump_catalog_version()
+                    return _http_request(port, method, path, body, headers)
+
+                # Every worker warms its caches before the timed requests
+                for _ in range(options["workers"] * 2):
+                    send(None)
+                with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+                    started = time.perf_counter()
+                    latencies = list(executor.map(send, range(options["requests"])))
+                    wall = time.perf_counter() - started
+                rows.append(self.report(size, "gunicorn", name, latencies, throughput=len(latencies) / wall))
+            return rows, _process_tree_rss_mb(server.pid)
+        finally:
+            server.send_signal(signal.SIGTERM)
+            server.wait(timeout=30)
+
+    def report(self, size, driver, endpoint, latencies, **extra):
+        latencies = sorted(latencies)
+        row = {
+            "size": size,
+            "driver": driver,
+            "endpoint": endpoint,
+            "p50_ms": _percentile_ms(latencies, 0.50),
+            "p95_ms": _percentile_ms(latencies, 0.95),
+            "p99_ms": _percentile_ms(latencies, 0.99),
+            **{name: round(value, 2) for name, value in extra.items()},
+        }
+        details = "  ".join(f"{name} {row[name]}" for name in extra)
+        self.stdout.write(
+            f"{size:>7} {driver:<8} {endpoint:<24} p50 {row['p50_ms']:>8.2f} ms  p95 {row['p95_ms']:>8.2f} ms  "
+            f"p99 {row['p99_ms']:>8.2f} ms  {details}"
+        )
+        return row
+
+    def compare(self, path, results, threshold):
+        with open(path) as file:
+            baseline = json.load(file)
+        previous = {(row["size"], row["driver"], row["endpoint"]): row for row in baseline["results"]}
+        self.stdout.write(f"Compared with {path} (commit {baseline['meta'].get('commit')}):")
+        for row in results["results"]:
+            before = previous.get((row["size"], row["driver"], row["endpoint"]))
+            if before is None or not before["p95_ms"]:
+                continue
+            change = (row["p95_ms"] - before["p95_ms"]) / before["p95_ms"] * 100
+            line = (
+                f"{row['size']:>7} {row['driver']:<8} {row['endpoint']:<24} "
+                f"p95 {before['p95_ms']:>8.2f} -> {row['p95_ms']:>8.2f} ms ({change:+.0f}%)"
+            )
+            if "queries" in row and "queries" in before and row["queries"] != before["queries"]:
+                line += f"  queries {before['queries']} -> {row['queries']}"
+            self.stdout.write(self.style.ERROR(line) if change > threshold else line)
+
+
+class CatalogSeeder:
+    """Adds deterministic benchmark rows up to the requested catalog size."""
+
+    def __init__(self, seed):
+        self.rng = random.Random(seed)
+        self.count = 0
+        self.categories = []
+        self.token = None
+
+    def seed(self, size):
+        if not self.categories:
+            self.categories = [
+                Category.objects.create(name=f"{CATEGORY_PREFIX} {i}") for i in range(CATEGORY_COUNT)
+            ]
+            Review.objects.bulk_create(
+                Review(name=f"{REVIEW_PREFIX} {i}", review="Great quality and fast delivery.")
+                for i in range(REVIEW_COUNT)
+            )
+            user = User.objects.create_user(username=USERNAME, password=PASSWORD)
+            self.token = get_tokens(user)[0]
+
+        products = [self.build_product(i) for i in range(self.count, size)]
+        import_products(products, batch_size=1000)
+        self.count = max(self.count, size)
+
+    def build_product(self, i):
+        rng = self.rng
+        return Product(
+            name=f"{PRODUCT_PREFIX} {i} {rng.choice(PRODUCT_WORDS)}",
+            slug=f"benchmark-product-{i}",
+            description=f"{rng.choice(PRODUCT_WORDS)} {rng.choice(COLORS)}",
+            category=rng.choice(self.categories),
+            price=Decimal(rng.randint(200, 60000)),
+            color=rng.choice(COLORS),
+            wood_material=rng.choice(WOODS),
+            fabric_material=rng.choice(FABRICS),
+            stock=rng.randint(0, 50),
+            is_best_seller=rng.random() < 0.1,
+            is_active=rng.random() < 0.9,
+        )
+
+    def delete(self):
+        category_ids = [category.pk for category in self.categories]
+        if category_ids:
+            # A queryset delete would send several signals per product
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {Product._meta.db_table} WHERE category_id IN ({', '.join(['%s'] * len(category_ids))})",
+                    category_ids,
+                )
+            Category.objects.filter(pk__in=category_ids).delete()
+        Review.objects.filter(name__startswith=REVIEW_PREFIX).delete()
+        User.objects.filter(username=USERNAME).delete()
+        if settings.DASHBOARD_STATS_MATERIALIZED:
+            CategoryStats.refresh()
+        suggestion_index.invalidate()
+        bump_catalog_version()
+
+
+def _percentile_ms(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    return round(sorted_values[min(int(len(sorted_values) * fraction), len(sorted_values) - 1)] * 1000, 3)
+
+
+def _max_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def _process_tree_rss_mb(pid):
+    """Peak RSS of a process and each of its children, from /proc, or None elsewhere."""
+    peaks = {}
+    for child in [pid] + _children(pid):
+        try:
+            with open(f"/proc/{child}/status") as file:
+                for line in file:
+                    if line.startswith("VmHWM:"):
+                        peaks["master" if child == pid else f"worker {child}"] = round(int(line.split()[1]) / 1024, 1)
+        except OSError:
+            continue
+    return peaks or None
+
+
+def _children(pid):
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as file:
+            return [int(child) for child in file.read().split()]
+    except OSError:
+        return []
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, server, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise CommandError("gunicorn exited while starting.")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise CommandError("gunicorn did not start.")
+
+
+def _http_request(port, method, path, body, headers):
+    """Send one request on a new connection, returns the seconds until the whole response was read."""
+    started = time.perf_counter()
+    client = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+    try:
+        client.request(method, path, body=body, headers=headers)
+        response = client.getresponse()
+        response.read()
+    finally:
+        client.close()
+    if response.status >= 400:
+        raise CommandError(f"{method} {path} answered {response.status}.")
+    return time.perf_counter() - started
@@ -0,0 +1,97 @@
+import os
+import socket
+import threading
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory
+from django.views.static import serve
+from products.media import serve_media
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the throughput of serving a media file with the previous django.views.static.serve "
+        "and with products.media.serve_media, whole and as a seek to the middle of the file."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=64, help="Size of the served file in MB.")
+        parser.add_argument("--requests", type=int, default=10, help="Requests per measurement.")
+        parser.add_argument(
+            "--no-sendfile",
+            action="store_true",
+            help="Send every response through Python, like a server without wsgi.file_wrapper.",
+        )
+
+    def handle(self, *args, **options):
+        size = options["size"] * 1024 * 1024
+        path = "benchmark/media-benchmark.bin"
+        fullpath = os.path.join(settings.MEDIA_ROOT, path)
+        os.makedirs(os.path.dirname(fullpath), exist_ok=True)
+        with open(fullpath, "wb") as file:
+            for _ in range(options["size"]):
+                file.write(os.urandom(1024 * 1024))
+
+        views = (
+            ("static.serve", lambda request: serve(request, path, document_root=settings.MEDIA_ROOT)),
+            ("serve_media", lambda request: serve_media(request, path)),
+        )
+        # A player seeking to the middle asks for the rest of the file
+        cases = (("whole file", {}), ("seek to middle", {"HTTP_RANGE": f"bytes={size // 2}-"}))
+        try:
+            for case, headers in cases:
+                self.stdout.write(f"{case}:")
+                for name, view in views:
+                    sent, elapsed, status = measure(view, headers, options["requests"], not options["no_sendfile"])
+                    self.stdout.write(
+                        f"  {name:<13} {status}  {sent / options['requests'] / 1024 / 1024:8.1f} MB/request  "
+                        f"{elapsed / options['requests'] * 1000:8.2f} ms/request  "
+                        f"{sent / 1024 / 1024 / elapsed:8.1f} MB/s"
+                    )
+        finally:
+            os.remove(fullpath)
+
+
+def measure(view, headers, requests, sendfile):
+    """Send the responses of the view to a socket as a WSGI server would, returns (bytes, seconds, status)."""
+    factory = RequestFactory()
+    server, client = socket.socketpair()
+    reader = threading.Thread(target=_drain, args=(client,))
+    reader.start()
+    sent = 0
+    started = time.perf_counter()
+    try:
+        for _ in range(requests):
+            response = view(factory.get("/media/", **headers))
+            sent += _send(response, server, sendfile)
+            response.close()
+    finally:
+        elapsed = time.perf_counter() - started
+        server.close()
+        reader.join()
+        client.close()
+    return sent, elapsed, response.status_code
+
+
+def _send(response, sock, sendfile):
+    """Send the body of a response, with sendfile when it streams a file, like gunicorn does."""
+    file = getattr(response, "file_to_stream", None)
+    if sendfile and file is not None and hasattr(file, "fileno"):
+        fileno = file.fileno()
+        offset = os.lseek(fileno, 0, os.SEEK_CUR)
+        length = int(response["Content-Length"])
+        sent = 0
+        while sent < length:
+            sent += os.sendfile(sock.fileno(), fileno, offset + sent, length - sent)
+        return sent
+    sent = 0
+    for chunk in response:
+        sock.sendall(chunk)
+        sent += len(chunk)
+    return sent
+
+
+def _drain(sock):
+    while sock.recv(1024 * 1024):
+        pass
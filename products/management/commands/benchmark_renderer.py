@@ -0,0 +1,107 @@
+import hashlib
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from django.core.management.base import BaseCommand
+from renderers import CustomJSONRenderer
+
+
+class Command(BaseCommand):
+    help = "Compare the throughput of CustomJSONRenderer with orjson and with the stdlib json encoder."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=10000, help="Number of products in the payload.")
+        parser.add_argument("--repeat", type=int, default=5, help="Number of renders timed per encoder.")
+
+    def handle(self, *args, **options):
+        data = build_payload(options["products"])
+        context = {"response": _Response()}
+
+        results = {}
+        for name, use_orjson in (("stdlib", False), ("orjson", True)):
+            renderer = CustomJSONRenderer()
+            renderer.use_orjson = use_orjson
+            size = len(renderer.render(data, "application/json", context))
+
+            started = time.perf_counter()
+            for _ in range(options["repeat"]):
+                renderer.render(data, "application/json", context)
+            elapsed = (time.perf_counter() - started) / options["repeat"]
+
+            results[name] = size / elapsed
+            self.stdout.write(
+                f"{name:>7}: {size / 1024 / 1024:.2f} MB in {elapsed * 1000:.1f} ms, "
+                f"{results[name] / 1024 / 1024:.1f} MB/s"
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"orjson is {results['orjson'] / results['stdlib']:.1f}x faster."))
+
+
+class _Response:
+    status_code = 200
+    message = None
+
+
+def build_payload(count):
+    """Product list shaped like the ProductSerializer output, with Decimal dimensions."""
+    rng = random.Random(0)
+    created_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    colors = ["Beige", "Grey", "بني", "أزرق", "Walnut"]
+    products = []
+    for i in range(count):
+        timestamp = created_at + timedelta(minutes=i)
+        products.append(
+            {
+                "id": i,
+                "category": {
+                    "id": i % 12,
+                    "name": f"Category {i % 12}",
+                    "description": None,
+                    "icon": f"/media/category_icons/{i % 12}.png",
+                    "created_at": timestamp,
+                    "updated_at": timestamp,
+                },
+                "name": f"كنبة مودرن {i}",
+                "sku": f"SKU{i:09d}",
+                "slug": f"كنبة-مودرن-{i}",
+                "description": "Solid wood frame with high density foam cushions. " * 3,
+                "price": Decimal(rng.randint(1000, 900000)) / 100,
+                "color": rng.choice(colors),
+                "length_cm": Decimal(rng.randint(300, 3000)) / 10,
+                "width_cm": Decimal(rng.randint(300, 3000)) / 10,
+                "height_cm": Decimal(rng.randint(300, 3000)) / 10,
+                "depth_cm": Decimal(rng.randint(300, 3000)) / 10,
+                "stock": rng.randint(0, 50),
+                "country_of_origin": "Egypt",
+                "wood_material": "زان",
+                "fabric_material": "Linen",
+                "upholstery_material": None,
+                "warranty_months": 12,
+                "images": [_image(i * 3 + n, timestamp) for n in range(3)],
+                "product_video": None,
+                "is_best_seller": i % 10 == 0,
+                "is_active": True,
+                "created_at": timestamp,
+                "updated_at": timestamp,
+            }
+        )
+    return products
+
+
+def _image(pk, timestamp):
+    """Image shaped like ProductImageSerializer output, named after a content hash like stored blobs."""
+    digest = hashlib.sha256(str(pk).encode()).hexdigest()
+    folder = f"http://testserver/media/products-images/blobs/{digest[:2]}/{digest[2:4]}"
+    return {
+        "id": pk,
+        "image": f"{folder}/{digest}.jpg",
+        "srcset": {
+            extension: {
+                str(width): f"{folder}/variants/{digest}-{width}w-{digest[-12:]}.{extension}"
+                for width in (320, 640, 1024, 1600)
+            }
+            for extension in ("webp", "jpeg")
+        },
+        "created_at": timestamp,
+    }
@@ -0,0 +1,50 @@
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from products.models import Product
+from products.slugs import allocate_slug
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the insert latency of products sharing one base slug as duplicates grow, "
+        "with the slug counters and with the previous prefix scan. Nothing is kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--duplicates", type=int, default=2000, help="Products inserted per strategy.")
+        parser.add_argument("--window", type=int, default=500, help="Inserts averaged per reported line.")
+
+    def handle(self, *args, **options):
+        strategies = (("prefix scan", scan_slug), ("counter", allocate_slug))
+        for name, generate in strategies:
+            self.stdout.write(f"{name}:")
+            with transaction.atomic():
+                for start, latency in measure(generate, "كنبة-benchmark", options["duplicates"], options["window"]):
+                    self.stdout.write(f"  {start:>7} duplicates: {latency * 1000:.3f} ms per insert")
+                transaction.set_rollback(True)
+
+
+def scan_slug(base_slug):
+    """Previous Product.generate_slug, loading every slug with the same prefix."""
+    existing_slugs = list(Product.objects.filter(slug__startswith=base_slug).values_list("slug", flat=True))
+    slug = base_slug
+    counter = 1
+    while slug in existing_slugs:
+        slug = f"{base_slug}-{counter}"
+        counter += 1
+    return slug
+
+
+def measure(generate, base_slug, count, window):
+    """Yield (duplicates so far, mean seconds per slug and insert) for each window."""
+    elapsed = 0.0
+    for i in range(count):
+        started = time.perf_counter()
+        slug = generate(base_slug)
+        # bulk_create skips the save() slug generation and the product signals
+        Product.objects.bulk_create([Product(name=f"{base_slug} {i}", slug=slug, sku=f"BENCH{i:07d}", price=1)])
+        elapsed += time.perf_counter() - started
+        if (i + 1) % window == 0:
+            yield i + 1 - window, elapsed / window
+            elapsed = 0.0
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+from products.cache import bump_catalog_version
+from products.documents import DOCUMENT_BATCH_SIZE, build_product_document, refresh_product_documents
+from products.models import Product
+
+
+class Command(BaseCommand):
+    help = "Verify the stored product documents against the live ProductSerializer output."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--fix",
+            action="store_true",
+            help="Rebuild the missing and outdated documents.",
+        )
+
+    def handle(self, *args, **options):
+        missing = []
+        outdated = []
+        products = Product.objects.select_related("category").prefetch_related("images").defer("search_vector")
+        for product in products.iterator(chunk_size=DOCUMENT_BATCH_SIZE):
+            if product.document is None:
+                missing.append(product.id)
+            elif product.document != build_product_document(product):
+                outdated.append(product.id)
+
+        self.stdout.write(f"{len(missing)} missing and {len(outdated)} outdated documents.")
+        if outdated:
+            self.stdout.write(f"Outdated products: {', '.join(map(str, outdated[:100]))}")
+
+        if not missing and not outdated:
+            self.stdout.write(self.style.SUCCESS("All product documents are up to date."))
+        elif options["fix"]:
+            refresh_product_documents(Product.objects.filter(pk__in=missing + outdated))
+            bump_catalog_version()
+            self.stdout.write(self.style.SUCCESS(f"Rebuilt {len(missing) + len(outdated)} documents."))
+        else:
+            raise CommandError("Product documents are not consistent, run with --fix to rebuild them.")
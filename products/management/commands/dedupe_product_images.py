@@ -0,0 +1,110 @@
+import hashlib
+import os
+import posixpath
+from django.core.management.base import BaseCommand
+from products.blobs import BLOB_DIR, blob_extension, blob_name, blob_storage, is_blob, recount_references
+from products.cache import bump_catalog_version
+from products.documents import refresh_product_documents
+from products.images import VARIANT_FORMATS, has_current_variants, variant_name
+from products.models import Product, ProductImage
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the product images stored before content addressing into blobs, so each distinct file "
+        "is stored once, and count the references of every blob."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true", help="Only report the space which would be freed.")
+
+    def handle(self, *args, **options):
+        names = [
+            name
+            for name in ProductImage.objects.exclude(image="").exclude(image=None)
+            .order_by("image")
+            .values_list("image", flat=True)
+            .distinct()
+            if not is_blob(name)
+        ]
+        self.stdout.write(f"{len(names)} product image files are not stored as blobs.")
+
+        digests = set()
+        moved = 0
+        freed = 0
+        product_ids = set()
+        for name in names:
+            if not blob_storage.exists(name):
+                self.stderr.write(f"{name} is missing, its images are left as they are.")
+                continue
+            size = blob_storage.size(name)
+            if options["dry_run"]:
+                digest = _digest(name)
+                if digest in digests or blob_storage.exists(blob_name(digest, blob_extension(blob_storage.path(name)))):
+                    freed += size
+                digests.add(digest)
+                continue
+
+            with blob_storage.open(name, "rb") as file:
+                blob = blob_storage.save(posixpath.join(BLOB_DIR, posixpath.basename(name)), file)
+            if blob in digests or ProductImage.objects.filter(image=blob).exists():
+                freed += size
+            digests.add(blob)
+
+            images = ProductImage.objects.filter(image=name)
+            product_ids.update(images.values_list("product_id", flat=True))
+            images.update(image=blob, variants=_move_variants(name, blob, images.first().variants))
+            blob_storage.delete(name)
+            moved += 1
+
+        if options["dry_run"]:
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{len(digests)} distinct files, {freed / 1024 / 1024:.1f} MB would be freed."
+                )
+            )
+            return
+
+        recounted = recount_references()
+        refresh_product_documents(Product.objects.filter(pk__in=product_ids))
+        if moved:
+            bump_catalog_version()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Moved {moved} files into {len(digests)} blobs, freed {freed / 1024 / 1024:.1f} MB, "
+                f"recounted the references of {recounted} blobs."
+            )
+        )
+
+
+def _digest(name):
+    hasher = hashlib.sha256()
+    with blob_storage.open(name, "rb") as file:
+        for chunk in file.chunks():
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def _move_variants(name, blob, variants):
+    """
+    Variants of the blob: those of another image of the blob, or else the
+    variants of the old file renamed after the blob. Old variants are removed.
+    """
+    shared = ProductImage.objects.filter(image=blob, variants__source=blob).first()
+    if not has_current_variants(name, variants):
+        return shared.variants if shared is not None else None
+
+    moved = {"source": blob}
+    for extension in VARIANT_FORMATS:
+        moved[extension] = {}
+        for width, old in variants.get(extension, {}).items():
+            if not blob_storage.exists(old):
+                continue
+            if shared is not None:
+                blob_storage.delete(old)
+                continue
+            new = variant_name(blob, width, extension, _digest(old))
+            os.makedirs(os.path.dirname(blob_storage.path(new)), exist_ok=True)
+            os.replace(blob_storage.path(old), blob_storage.path(new))
+            moved[extension][width] = new
+    return shared.variants if shared is not None else moved
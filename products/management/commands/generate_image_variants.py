@@ -0,0 +1,71 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from categories.models import Category
+from products.cache import bump_catalog_version
+from products.documents import refresh_product_documents
+from products.images import create_category_icon_variants, create_product_image_variants, has_current_variants
+from products.models import Product, ProductImage
+
+
+class Command(BaseCommand):
+    help = "Render the resized variants of product images and category icons which do not have current ones."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Images rendered in parallel.")
+        parser.add_argument("--force", action="store_true", help="Render the variants of every image again.")
+
+    def handle(self, *args, **options):
+        tasks = []
+        for pk, image, variants in ProductImage.objects.exclude(image="").exclude(image=None).values_list(
+            "pk", "image", "variants"
+        ).iterator():
+            if options["force"] or not has_current_variants(image, variants):
+                tasks.append((create_product_image_variants, pk))
+        for pk, icon, variants in Category.objects.exclude(icon="").exclude(icon=None).values_list(
+            "pk", "icon", "icon_variants"
+        ).iterator():
+            if options["force"] or not has_current_variants(icon, variants):
+                tasks.append((create_category_icon_variants, pk))
+
+        self.stdout.write(f"Rendering variants of {len(tasks)} images with {options['workers']} workers.")
+        started = time.perf_counter()
+        product_ids = set()
+        category_ids = set()
+        failed = 0
+        with ThreadPoolExecutor(max_workers=options["workers"]) as executor:
+            futures = {executor.submit(_render, task, pk): (task, pk) for task, pk in tasks}
+            for future in as_completed(futures):
+                task, pk = futures[future]
+                try:
+                    result = future.result()
+                except Exception as error:
+                    failed += 1
+                    self.stderr.write(f"{task.__name__}({pk}) failed: {error}")
+                    continue
+                if result is not None:
+                    (product_ids if task is create_product_image_variants else category_ids).add(result)
+
+        # Documents are rebuilt once at the end instead of once per image
+        refresh_product_documents(
+            Product.objects.filter(pk__in=product_ids) | Product.objects.filter(category_id__in=category_ids)
+        )
+        if product_ids or category_ids:
+            bump_catalog_version()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rendered variants of {len(tasks) - failed} images in {elapsed:.1f}s "
+                f"({(len(tasks) - failed) / max(elapsed, 1e-9):.1f} images/s), {failed} failed."
+            )
+        )
+
+
+def _render(task, pk):
+    try:
+        return task(pk, refresh=False)
+    finally:
+        close_old_connections()
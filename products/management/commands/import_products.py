@@ -0,0 +1,257 @@
+import csv
+import json
+import time
+from pathlib import Path
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import BooleanField
+from categories.models import Category
+from products.cache import bump_catalog_version
+from products.documents import refresh_product_documents
+from products.models import ArabicSlugify, CategoryStats, Product, SlugCounter
+from products.search import build_search_vector, suggestion_index
+from products.sku import reserve_skus
+from products.slugs import store_slug_counters
+
+
+# Columns which can be imported, other columns (id, sku, slug, images, ...) are ignored
+IMPORT_FIELDS = [
+    "name",
+    "description",
+    "price",
+    "color",
+    "length_cm",
+    "width_cm",
+    "height_cm",
+    "depth_cm",
+    "stock",
+    "country_of_origin",
+    "wood_material",
+    "fabric_material",
+    "upholstery_material",
+    "warranty_months",
+    "is_best_seller",
+    "is_active",
+]
+
+# Spellings accepted for boolean columns, as for the `best_seller` filter
+BOOLEAN_VALUES = {
+    "true": True,
+    "1": True,
+    "yes": True,
+    "false": False,
+    "0": False,
+    "no": False,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Import products from a CSV, JSON (list of objects) or NDJSON file. "
+        "Categories are given by `category_id` or by `category` name."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to import.")
+        parser.add_argument(
+            "--format",
+            choices=["csv", "json", "ndjson"],
+            help="File format, guessed from the extension by default.",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000, help="Products inserted per transaction.")
+        parser.add_argument("--skip-invalid", action="store_true", help="Import the valid rows and skip the others.")
+        parser.add_argument("--dry-run", action="store_true", help="Validate the file without importing it.")
+
+    def handle(self, *args, **options):
+        path = Path(options["path"])
+        file_format = options["format"] or path.suffix.lstrip(".").lower()
+        if file_format not in ("csv", "json", "ndjson"):
+            raise CommandError("Unknown file format, use --format.")
+
+        started = time.perf_counter()
+        with path.open(encoding="utf-8-sig", newline="") as file:
+            rows = list(read_rows(file, file_format))
+
+        validator = ProductRowValidator()
+        products, errors = validator.validate(rows)
+        for line, error in errors[:50]:
+            self.stderr.write(f"Row {line}: {error}")
+        if errors and not options["skip_invalid"]:
+            raise CommandError(
+                f"{len(errors)} invalid rows, nothing was imported. Use --skip-invalid to import the others."
+            )
+
+        validated = time.perf_counter()
+        self.stdout.write(
+            f"Validated {len(rows)} rows in {validated - started:.1f}s "
+            f"({len(rows) / max(validated - started, 1e-9):.0f} rows/s), {len(errors)} invalid."
+        )
+        if options["dry_run"]:
+            return
+
+        created = import_products(products, options["batch_size"])
+        store_slug_counters(validator.allocated_slug_counters)
+        elapsed = time.perf_counter() - validated
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {created} products in {elapsed:.1f}s ({created / max(elapsed, 1e-9):.0f} rows/s)."
+            )
+        )
+
+
+def read_rows(file, file_format):
+    """Yield (line, row dict) pairs of the file."""
+    if file_format == "csv":
+        for line, row in enumerate(csv.DictReader(file), start=2):
+            yield line, row
+    elif file_format == "json":
+        data = json.load(file)
+        if not isinstance(data, list):
+            raise CommandError("JSON files must contain a list of products.")
+        for line, row in enumerate(data, start=1):
+            yield line, row
+    else:
+        for line, text in enumerate(file, start=1):
+            if text.strip():
+                yield line, json.loads(text)
+
+
+class ProductRowValidator:
+    """
+    Validate import rows and build unsaved products with their slug.
+
+    Existing categories, names, slugs and slug counters are loaded once, so
+    no query runs per row.
+    """
+
+    def __init__(self):
+        categories = dict(Category.objects.values_list("name", "id"))
+        self.category_ids = set(categories.values())
+        self.category_names = categories
+        self.names = set(Product.objects.values_list("name", flat=True))
+        self.slugs = set(Product.objects.values_list("slug", flat=True))
+        self.slug_counters = dict(SlugCounter.objects.values_list("base_slug", "next_suffix"))
+        self.allocated_slug_counters = {}
+        self.fields = {field: Product._meta.get_field(field) for field in IMPORT_FIELDS}
+
+    def validate(self, rows):
+        products = []
+        errors = []
+        for line, row in rows:
+            try:
+                products.append(self.build_product(row))
+            except ValidationError as error:
+                messages = (
+                    f"{field}: {' '.join(field_errors)}"
+                    for field, field_errors in error.message_dict.items()
+                )
+                errors.append((line, "; ".join(messages)))
+        return products, errors
+
+    def build_product(self, row):
+        if not isinstance(row, dict):
+            raise ValidationError({"row": ["Must be an object."]})
+
+        values = {}
+        errors = {}
+        for name, field in self.fields.items():
+            value = row.get(name)
+            if isinstance(value, str):
+                value = value.strip()
+                if isinstance(field, BooleanField):
+                    value = BOOLEAN_VALUES.get(value.lower(), value)
+            if value is None or value == "":
+                if not field.null and field.has_default():
+                    continue
+                value = None
+            try:
+                values[name] = field.to_python(value)
+            except ValidationError as error:
+                errors[name] = error.messages
+
+        values["category_id"] = self.get_category_id(row, errors)
+        product = Product(**values)
+        try:
+            product.clean_fields(exclude=["category", "sku", "slug", "search_vector", "document", *errors])
+        except ValidationError as error:
+            errors.update(error.message_dict)
+        if not errors and product.price is not None:
+            try:
+                product.clean()
+            except ValidationError as error:
+                errors.update(error.message_dict)
+
+        if product.name in self.names:
+            errors["name"] = ["A product with this name already exists."]
+        if errors:
+            raise ValidationError(errors)
+
+        self.names.add(product.name)
+        product.slug = self.allocate_slug(product.name)
+        return product
+
+    def get_category_id(self, row, errors):
+        category_id = row.get("category_id")
+        if category_id not in (None, ""):
+            try:
+                category_id = int(category_id)
+            except (TypeError, ValueError):
+                category_id = None
+            if category_id not in self.category_ids:
+                errors["category_id"] = ["Unknown category."]
+            return category_id
+
+        category = row.get("category")
+        if category in (None, ""):
+            return None
+        if category not in self.category_names:
+            errors["category"] = ["Unknown category."]
+        return self.category_names.get(category)
+
+    def allocate_slug(self, name):
+        """Same allocation as products.slugs.allocate_slug, in memory."""
+        base_slug = ArabicSlugify.slugify(name)
+        counter = self.slug_counters.get(base_slug)
+        if counter is None and base_slug not in self.slugs:
+            slug, counter = base_slug, 1
+        else:
+            counter = counter or 1
+            slug = f"{base_slug}-{counter}"
+            while slug in self.slugs:
+                counter += 1
+                slug = f"{base_slug}-{counter}"
+            counter += 1
+        self.slug_counters[base_slug] = self.allocated_slug_counters[base_slug] = counter
+        self.slugs.add(slug)
+        return slug
+
+
+def import_products(products, batch_size):
+    """
+    Insert the products in transactional batches, reserving one block of
+    SKUs per batch.
+
+    bulk_create does not send signals, so the work of the product signals
+    (search vector, documents, stats, caches) is done here per batch.
+    """
+    created = 0
+    for start in range(0, len(products), batch_size):
+        batch = products[start:start + batch_size]
+        for product, sku in zip(batch, reserve_skus(len(batch))):
+            product.sku = sku
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                for product in batch:
+                    product.search_vector = build_search_vector(product)
+            batch = Product.objects.bulk_create(batch)
+            refresh_product_documents(Product.objects.filter(pk__in=[product.pk for product in batch]))
+        created += len(batch)
+
+    if created:
+        if settings.DASHBOARD_STATS_MATERIALIZED:
+            CategoryStats.refresh()
+        suggestion_index.invalidate()
+        bump_catalog_version()
+    return created
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from products.models import CategoryStats
+
+
+class Command(BaseCommand):
+    help = "Recompute the materialized dashboard stats table from the products table."
+
+    def handle(self, *args, **options):
+        CategoryStats.refresh()
+        self.stdout.write(self.style.SUCCESS(f"Refreshed stats for {CategoryStats.objects.count()} categories."))
@@ -0,0 +1,87 @@
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from products.tasks import TASK_VISIBILITY_TIMEOUT, claim_tasks, prune_tasks, run_task
+
+
+# Finished tasks older than the retention period are deleted this often
+PRUNE_INTERVAL = 60 * 60
+
+
+class Command(BaseCommand):
+    help = (
+        "Run the tasks of the database task queue. Several workers can run at once, "
+        "each task is claimed by one of them."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=4, help="Tasks run at once by this worker.")
+        parser.add_argument(
+            "--visibility-timeout",
+            type=int,
+            default=TASK_VISIBILITY_TIMEOUT,
+            help="Seconds before a task which is still running is given to another worker.",
+        )
+        parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between polls of an empty queue.")
+        parser.add_argument("--once", action="store_true", help="Exit once no task is due.")
+
+    def handle(self, *args, **options):
+        worker = f"{socket.gethostname()}:{os.getpid()}"
+        concurrency = options["concurrency"]
+        stopping = threading.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, lambda *args: stopping.set())
+
+        self.stdout.write(f"Worker {worker} running {concurrency} tasks at once.")
+        pruned_at = 0
+        running = set()
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="task-worker") as executor:
+            while not stopping.is_set():
+                if time.monotonic() - pruned_at > PRUNE_INTERVAL:
+                    prune_tasks()
+                    pruned_at = time.monotonic()
+
+                running = {future for future in running if not future.done()}
+                tasks = []
+                if len(running) < concurrency:
+                    tasks = claim_tasks(worker, concurrency - len(running), options["visibility_timeout"])
+                for task in tasks:
+                    future = executor.submit(_run, task)
+                    future.add_done_callback(self.report)
+                    running.add(future)
+                if tasks:
+                    continue
+
+                if options["once"] and not running:
+                    break
+                if running:
+                    wait(running, timeout=options["poll_interval"], return_when=FIRST_COMPLETED)
+                else:
+                    stopping.wait(options["poll_interval"])
+
+            if running:
+                self.stdout.write(f"Waiting for {len(running)} running tasks.")
+        close_old_connections()
+
+    def report(self, future):
+        task, succeeded, elapsed = future.result()
+        waited = (task.started_at - task.created_at).total_seconds()
+        if succeeded:
+            self.stdout.write(f"{task.name} #{task.pk} done in {elapsed:.2f}s, waited {waited:.2f}s.")
+        else:
+            self.stderr.write(f"{task.name} #{task.pk} failed attempt {task.attempts}/{task.max_attempts}.")
+
+
+def _run(task):
+    close_old_connections()
+    started = time.perf_counter()
+    try:
+        succeeded = run_task(task)
+    finally:
+        close_old_connections()
+    return task, succeeded, time.perf_counter() - started
@@ -0,0 +1,404 @@
+import io
+import math
+import random
+import time
+from decimal import Decimal
+from itertools import accumulate
+from PIL import Image, ImageDraw
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from categories.models import Category
+from products.blobs import BLOB_DIR, blob_storage, recount_references
+from products.cache import bump_catalog_version
+from products.documents import refresh_product_documents
+from products.models import ArabicSlugify, CategoryStats, Product, ProductImage, Review
+from products.search import SEARCH_CONFIG, SEARCH_FIELDS, normalize_search_text, suggestion_index
+from products.sku import reserve_skus
+from support.models import Support
+
+
+# (English, Arabic, price range, length, width and height ranges in cm, upholstered)
+PRODUCT_TYPES = (
+    ("Sofa", "كنبة", (4000, 45000), (160, 320), (80, 110), (70, 100), True),
+    ("Corner sofa", "ركنة", (9000, 70000), (220, 340), (160, 260), (70, 100), True),
+    ("Armchair", "فوتيه", (1500, 12000), (60, 100), (60, 95), (70, 110), True),
+    ("Bed", "سرير", (5000, 50000), (190, 220), (90, 200), (90, 140), True),
+    ("Dining table", "سفرة", (3000, 40000), (120, 300), (80, 120), (74, 78), False),
+    ("Coffee table", "ترابيزة", (800, 9000), (60, 140), (40, 80), (35, 50), False),
+    ("Chair", "كرسي", (400, 5000), (40, 60), (40, 60), (80, 110), True),
+    ("Wardrobe", "دولاب", (6000, 60000), (80, 300), (55, 65), (180, 240), False),
+    ("Desk", "مكتب", (1500, 15000), (100, 180), (50, 80), (72, 78), False),
+    ("Bookcase", "مكتبة", (1200, 14000), (60, 200), (25, 40), (100, 220), False),
+    ("TV unit", "وحدة تلفزيون", (1500, 18000), (120, 240), (35, 50), (40, 60), False),
+    ("Dressing table", "تسريحة", (2000, 16000), (80, 140), (40, 50), (75, 160), False),
+)
+STYLES = (
+    ("Modern", "مودرن"),
+    ("Classic", "كلاسيك"),
+    ("Neo-classic", "نيو كلاسيك"),
+    ("Scandinavian", "إسكندنافي"),
+    ("Boho", "بوهو"),
+    ("Art deco", "آرت ديكو"),
+)
+COLLECTIONS = ("Oslo", "Cairo", "Luxor", "Milano", "Aswan", "Siwa", "Verona", "Nile", "Alexandria", "Sahara")
+
+# (value, weight), None leaves the field empty
+COLORS = (
+    ("Beige", 20), ("Grey", 18), ("Off white", 12), ("Brown", 12), ("Black", 8), ("Navy", 6),
+    ("Olive", 5), ("Walnut", 5), ("بيج", 8), ("رمادي", 6), ("أزرق", 3), (None, 2),
+)
+WOOD_MATERIALS = (
+    ("Beech", 30), ("زان", 15), ("MDF", 20), ("Oak", 10), ("Pine", 10), ("Mahogany", 5), ("Walnut", 5), (None, 5),
+)
+FABRIC_MATERIALS = (("Linen", 25), ("Velvet", 20), ("Chenille", 15), ("Leather", 10), ("قطيفة", 10), ("Cotton", 10))
+UPHOLSTERY_MATERIALS = (("High density foam", 40), ("Memory foam", 15), ("Pocket springs", 20), ("فايبر", 10))
+COUNTRIES = (("Egypt", 70), ("China", 10), ("Turkey", 10), ("Italy", 5), ("Malaysia", 5))
+WARRANTY_MONTHS = ((12, 40), (24, 30), (6, 10), (60, 10), (None, 10))
+
+DESCRIPTIONS = (
+    "{style_en} {type_en} from the {collection} collection, made of {wood}.",
+    "{type_ar} {style_ar} من مجموعة {collection}، خشب {wood}.",
+    "{type_ar} {style_ar} بتصميم عصري وجودة عالية. {style_en} {type_en}, {color}.",
+)
+
+CATEGORY_NAMES = (
+    "Living room - غرف المعيشة",
+    "Bedrooms - غرف النوم",
+    "Dining rooms - غرف السفرة",
+    "Kids rooms - غرف الأطفال",
+    "Office - المكاتب",
+    "Outdoor - الحدائق",
+    "Storage - التخزين",
+    "Decor - الديكور",
+)
+
+FIRST_NAMES = ("Ahmed", "Mohamed", "Sara", "Mona", "Omar", "Laila", "أحمد", "محمد", "سارة", "منى", "عمر", "ليلى")
+LAST_NAMES = ("Hassan", "Ali", "Mahmoud", "Saleh", "Fathy", "حسن", "علي", "محمود", "صالح", "فتحي")
+REVIEWS = (
+    "Great quality and fast delivery.",
+    "The color is exactly as in the pictures.",
+    "Comfortable, but the delivery took two weeks.",
+    "منتج ممتاز والتوصيل سريع.",
+    "الخامة ممتازة والسعر مناسب.",
+    "التركيب كان سهل وفريق التوصيل محترم.",
+)
+SUPPORT_MESSAGES = (
+    "When will my order be delivered?",
+    "Can I change the fabric color of my order?",
+    "One of the chair legs arrived broken.",
+    "هل يوجد تقسيط على المنتجات؟",
+    "أريد تغيير عنوان التوصيل.",
+    "متى يصل الطلب؟",
+)
+
+# Product fields the generator fills, the others keep their defaults
+PRODUCT_COLUMNS = (
+    "category", "name", "sku", "slug", "description", "price", "color", "length_cm", "width_cm", "height_cm",
+    "depth_cm", "stock", "country_of_origin", "wood_material", "fabric_material", "upholstery_material",
+    "warranty_months", "is_best_seller", "is_active",
+)
+
+# Distinct image files written with --image-files, product images reuse them
+IMAGE_POOL_SIZE = 32
+IMAGE_SIZE = (320, 240)
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate a synthetic catalog for scale testing: products with Arabic and English names, "
+        "categories, product images, reviews and support messages. The same --seed always generates "
+        "the same catalog, except for SKUs and creation dates."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=10000, help="Products to generate.")
+        parser.add_argument(
+            "--start", type=int, default=0, help="Number of the first product, to extend a seeded catalog."
+        )
+        parser.add_argument("--categories", type=int, default=len(CATEGORY_NAMES), help="Categories to use.")
+        parser.add_argument("--images", type=int, default=3, help="Maximum images per product.")
+        parser.add_argument(
+            "--image-files",
+            action="store_true",
+            help=f"Store {IMAGE_POOL_SIZE} small real images for the product images to use, "
+            "instead of names of missing files.",
+        )
+        parser.add_argument("--reviews", type=int, default=1000, help="Reviews to generate.")
+        parser.add_argument("--support-messages", type=int, default=1000, help="Support messages to generate.")
+        parser.add_argument("--seed", type=int, default=0, help="Seed of the generated data.")
+        parser.add_argument("--batch-size", type=int, default=5000, help="Products inserted per transaction.")
+        parser.add_argument(
+            "--no-documents",
+            action="store_false",
+            dest="documents",
+            help="Leave the product documents to be built on the fly, which is much faster.",
+        )
+
+    def handle(self, *args, **options):
+        if options["batch_size"] <= 0:
+            raise CommandError("--batch-size must be positive.")
+        generator = CatalogGenerator(options["seed"])
+        started = time.perf_counter()
+
+        categories = generator.categories(options["categories"])
+        images = store_image_pool(generator) if options["image_files"] else None
+
+        created = 0
+        end = options["start"] + options["products"]
+        for start in range(options["start"], end, options["batch_size"]):
+            batch_started = time.perf_counter()
+            numbers = range(start, min(start + options["batch_size"], end))
+            products = [generator.product(number, categories) for number in numbers]
+            existing = Product.objects.filter(name__in=[product.name for product in products]).first()
+            if existing is not None:
+                raise CommandError(f"{existing.name!r} was already seeded, use another --start or --seed.")
+
+            with transaction.atomic():
+                pks = insert_products(products)
+                insert_rows(
+                    ProductImage,
+                    ["product_id", "image"],
+                    [
+                        (pk, image)
+                        for pk, number in zip(pks, numbers)
+                        for image in generator.product_images(number, options["images"], images)
+                    ],
+                )
+                if options["documents"]:
+                    refresh_product_documents(Product.objects.filter(pk__in=pks))
+            created += len(pks)
+            elapsed = time.perf_counter() - batch_started
+            self.stdout.write(f"{created} products ({len(pks) / max(elapsed, 1e-9):.0f} rows/s).")
+
+        insert_rows(Review, ["name", "review"], generator.reviews(options["start"], options["reviews"]))
+        insert_rows(
+            Support,
+            ["name", "email", "phone_number", "message"],
+            generator.support_messages(options["start"], options["support_messages"]),
+        )
+
+        if images:
+            recount_references()
+        if settings.DASHBOARD_STATS_MATERIALIZED:
+            CategoryStats.refresh()
+        suggestion_index.invalidate()
+        bump_catalog_version()
+        if connection.vendor == "postgresql":
+            # Planner statistics of the new rows, so query plans look like production
+            with connection.cursor() as cursor:
+                cursor.execute(f"ANALYZE {Product._meta.db_table}, {ProductImage._meta.db_table}")
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Seeded {created} products, {options['reviews']} reviews and {options['support_messages']} "
+                f"support messages in {elapsed:.1f}s ({created / max(elapsed, 1e-9):.0f} products/s)."
+            )
+        )
+
+
+class CatalogGenerator:
+    """
+    Deterministic catalog data. Each product, review and message is drawn
+    from a generator seeded by the seed and its number, so a product does
+    not depend on the batch size or on where seeding started.
+    """
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.rng = random.Random()
+        self.weights = {
+            choices: list(accumulate(weight for _, weight in choices))
+            for choices in (COLORS, WOOD_MATERIALS, FABRIC_MATERIALS, UPHOLSTERY_MATERIALS, COUNTRIES, WARRANTY_MONTHS)
+        }
+
+    def reseed(self, kind, number):
+        self.rng.seed(f"{self.seed}:{kind}:{number}")
+        return self.rng
+
+    def pick(self, choices):
+        return self.rng.choices(choices, cum_weights=self.weights[choices])[0][0]
+
+    def categories(self, count):
+        """The first `count` seed categories, created when missing."""
+        names = [
+            CATEGORY_NAMES[number % len(CATEGORY_NAMES)]
+            + (f" {number // len(CATEGORY_NAMES) + 1}" if number >= len(CATEGORY_NAMES) else "")
+            for number in range(count)
+        ]
+        return [Category.objects.get_or_create(name=name)[0] for name in names]
+
+    def product(self, number, categories):
+        rng = self.reseed("product", number)
+        type_en, type_ar, prices, length, width, height, upholstered = rng.choice(PRODUCT_TYPES)
+        style_en, style_ar = rng.choice(STYLES)
+        collection = rng.choice(COLLECTIONS)
+        if rng.random() < 0.5:
+            name = f"{type_ar} {style_ar} {collection} {number + 1}"
+        else:
+            name = f"{collection} {style_en} {type_en} {number + 1}"
+
+        color = self.pick(COLORS)
+        wood = self.pick(WOOD_MATERIALS)
+        description = rng.choice(DESCRIPTIONS).format(
+            type_en=type_en.lower(),
+            type_ar=type_ar,
+            style_en=style_en,
+            style_ar=style_ar,
+            collection=collection,
+            wood=wood or "MDF",
+            color=color or "",
+        )
+        # Prices are log-uniform, so cheap products are more frequent, rounded to 5
+        low, high = prices
+        price = Decimal(round(math.exp(rng.uniform(math.log(low), math.log(high))) / 5) * 5)
+        width_cm = _dimension(rng, width)
+        return Product(
+            name=name,
+            slug=ArabicSlugify.slugify(name),
+            description=description,
+            category=categories[rng.randrange(len(categories))] if categories else None,
+            price=price,
+            color=color,
+            length_cm=_dimension(rng, length),
+            width_cm=width_cm,
+            height_cm=_dimension(rng, height),
+            depth_cm=None if upholstered else width_cm,
+            stock=rng.choice((0, rng.randint(1, 10), rng.randint(1, 100))),
+            country_of_origin=self.pick(COUNTRIES),
+            wood_material=wood,
+            fabric_material=self.pick(FABRIC_MATERIALS) if upholstered else None,
+            upholstery_material=self.pick(UPHOLSTERY_MATERIALS) if upholstered else None,
+            warranty_months=self.pick(WARRANTY_MONTHS),
+            is_best_seller=rng.random() < 0.05,
+            is_active=rng.random() < 0.95,
+        )
+
+    def product_images(self, number, maximum, pool=None):
+        """Image names of a product, from the stored pool or else names of files which do not exist."""
+        rng = self.reseed("images", number)
+        count = rng.randint(1, maximum) if maximum > 0 else 0
+        if pool:
+            return [rng.choice(pool) for _ in range(count)]
+        return [f"products-images/seed/{number + 1}-{index + 1}.jpg" for index in range(count)]
+
+    def reviews(self, start, count):
+        for number in range(start, start + count):
+            rng = self.reseed("review", number)
+            yield f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {number + 1}", rng.choice(REVIEWS)
+
+    def support_messages(self, start, count):
+        for number in range(start, start + count):
+            rng = self.reseed("support", number)
+            yield (
+                f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                f"customer{number + 1}@example.com",
+                f"01{rng.choice('0125')}{rng.randint(0, 99999999):08d}",
+                rng.choice(SUPPORT_MESSAGES),
+            )
+
+    def image(self, number):
+        """A small JPEG of a few coloured shapes."""
+        rng = self.reseed("image", number)
+        image = Image.new("RGB", IMAGE_SIZE, tuple(rng.randint(120, 255) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(4):
+            x, y = rng.randrange(IMAGE_SIZE[0]), rng.randrange(IMAGE_SIZE[1])
+            draw.rectangle(
+                (x, y, x + rng.randint(20, 160), y + rng.randint(20, 120)),
+                fill=tuple(rng.randint(0, 200) for _ in range(3)),
+            )
+        output = io.BytesIO()
+        image.save(output, "JPEG", quality=80)
+        return ContentFile(output.getvalue(), name=f"{BLOB_DIR}/seed-{number + 1}.jpg")
+
+
+def _dimension(rng, bounds):
+    return Decimal(rng.randint(bounds[0] * 10, bounds[1] * 10)) / 10
+
+
+def store_image_pool(generator):
+    """Store the pool of seed images as blobs, returns their names."""
+    return blob_storage.save_blobs([generator.image(number) for number in range(IMAGE_POOL_SIZE)])
+
+
+def insert_products(products):
+    """
+    Insert unsaved products with their slug, returns their primary keys in
+    the same order. SKUs are reserved here.
+
+    PostgreSQL copies the rows into a temporary table and inserts them from
+    there, computing the search vectors in the same statement. Other
+    databases use bulk_create.
+    """
+    for product, sku in zip(products, reserve_skus(len(products))):
+        product.sku = sku
+    if connection.vendor != "postgresql":
+        return [product.pk for product in Product.objects.bulk_create(products)]
+
+    fields = [field for field in Product._meta.concrete_fields if field.name in PRODUCT_COLUMNS]
+    search_columns = [f"search_{name}" for name, _ in SEARCH_FIELDS]
+    vector = " || ".join(
+        f"setweight(to_tsvector('{SEARCH_CONFIG}', {column}), '{weight}')"
+        for column, (_, weight) in zip(search_columns, SEARCH_FIELDS)
+    )
+    columns = [field.column for field in fields]
+    rows = [
+        [field.get_db_prep_save(getattr(product, field.attname), connection) for field in fields]
+        + [normalize_search_text(getattr(product, name)) for name, _ in SEARCH_FIELDS]
+        for product in products
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMPORARY TABLE seed_products AS "
+            f"SELECT {', '.join(columns)}, {', '.join(f'NULL::text AS {column}' for column in search_columns)} "
+            f"FROM {Product._meta.db_table} WITH NO DATA"
+        )
+        _copy(cursor, "seed_products", columns + search_columns, rows)
+        cursor.execute(
+            f"INSERT INTO {Product._meta.db_table} ({', '.join(columns)}, created_at, updated_at, search_vector) "
+            f"SELECT {', '.join(columns)}, now(), now(), {vector} FROM seed_products RETURNING id, sku"
+        )
+        pks = {sku: pk for pk, sku in cursor.fetchall()}
+        cursor.execute("DROP TABLE seed_products")
+    return [pks[product.sku] for product in products]
+
+
+def insert_rows(model, fields, rows):
+    """Insert (value, ...) tuples of the given fields, with COPY on PostgreSQL."""
+    rows = list(rows)
+    if not rows:
+        return
+    if connection.vendor != "postgresql":
+        model.objects.bulk_create([model(**dict(zip(fields, row))) for row in rows], batch_size=5000)
+        return
+    with connection.cursor() as cursor:
+        # Creation dates are set by auto_now_add otherwise
+        dated = any(field.name == "created_at" for field in model._meta.concrete_fields)
+        if dated:
+            cursor.execute("SELECT now()")
+            now = cursor.fetchone()[0]
+            rows = [(*row, now) for row in rows]
+        _copy(cursor, model._meta.db_table, fields + (["created_at"] if dated else []), rows)
+
+
+def _copy(cursor, table, columns, rows):
+    """COPY the rows into the table, in text format."""
+    data = io.StringIO()
+    for row in rows:
+        data.write("\t".join(_copy_value(value) for value in row))
+        data.write("\n")
+    data.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", data)
+
+
+def _copy_value(value):
+    if value is None:
+        return r"\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (
+        str(value).replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+    )
@@ -0,0 +1,176 @@
+import mimetypes
+import os
+import posixpath
+import re
+import stat
+from urllib.parse import quote
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+from .blobs import BLOB_DIR
+
+
+# Files are read this many bytes at a time when the server cannot sendfile
+BLOCK_SIZE = 256 * 1024
+
+# Only single ranges are answered with 206, a client asking for several
+# gets the whole file, which RFC 9110 allows
+RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+class _RangeFile:
+    """
+    File object limited to `length` bytes from its current position.
+
+    The wrapped file keeps its descriptor, so a WSGI server with a
+    sendfile-capable `wsgi.file_wrapper`, such as gunicorn, still sends the
+    range with sendfile, from the current offset for Content-Length bytes.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+def media_etag(stat_result):
+    """Strong ETag of a file, changing with its modification time or size."""
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def parse_range(header, size):
+    """
+    Parse a `Range` header into an inclusive (start, end) byte range.
+
+    Returns None when the header is ignored and the whole file is sent,
+    raises ValueError when the range cannot be satisfied.
+    """
+    match = RANGE.match(header.strip())
+    if not match or not any(match.groups()):
+        return None
+    start, end = match.groups()
+    if not start:
+        # Suffix range, the last `end` bytes
+        length = int(end)
+        if not length or not size:
+            raise ValueError("Empty suffix range.")
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size:
+        raise ValueError("Range starts after the end of the file.")
+    if end < start:
+        return None
+    return start, end
+
+
+def is_immutable_media(path):
+    """
+    Whether the file is named after its contents: image blobs and the
+    variants of images and icons, see products/blobs.py and images.py.
+    """
+    return path.startswith(f"{BLOB_DIR}/") or posixpath.basename(posixpath.dirname(path)) == "variants"
+
+
+def _if_range_matches(request, etag, last_modified):
+    """Whether the `If-Range` validator, if any, still matches the file."""
+    if_range = request.META.get("HTTP_IF_RANGE")
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    # A date only matches if it is exactly the modification time
+    return parse_http_date_safe(if_range) == last_modified
+
+
+@require_safe
+def serve_media(request, path):
+    """
+    Serve a file of MEDIA_ROOT, answering `Range` requests with 206 so
+    video players can seek without downloading the file from the start.
+
+    With MEDIA_SENDFILE_HEADER set, the front server is asked to send the
+    file with X-Accel-Redirect (nginx) or X-Sendfile (Apache, lighttpd) and
+    handles ranges itself. Otherwise the file is returned as a FileResponse,
+    which gunicorn sends with sendfile.
+    """
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        stat_result = os.stat(fullpath)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        raise Http404("File not found.")
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise Http404("File not found.")
+
+    etag = media_etag(stat_result)
+    last_modified = int(stat_result.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _file_response(request, path, fullpath, stat_result, etag, last_modified)
+    if is_immutable_media(path):
+        response["Cache-Control"] = f"public, max-age={settings.MEDIA_CACHE_MAX_AGE}, immutable"
+    else:
+        # A deleted file's name is free again for the next upload
+        response["Cache-Control"] = f"public, max-age={settings.MEDIA_REVALIDATE_MAX_AGE}"
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    response["Accept-Ranges"] = "bytes"
+    return response
+
+
+def _file_response(request, path, fullpath, stat_result, etag, last_modified):
+    content_type, encoding = mimetypes.guess_type(fullpath)
+    content_type = content_type if content_type and not encoding else "application/octet-stream"
+    size = stat_result.st_size
+
+    sendfile_header = settings.MEDIA_SENDFILE_HEADER
+    if sendfile_header:
+        response = HttpResponse(content_type=content_type)
+        if sendfile_header.lower() == "x-accel-redirect":
+            # nginx decodes the URI of the redirect, so names with spaces,
+            # "%" or "?" must be quoted to reach the right file
+            response[sendfile_header] = settings.MEDIA_ACCEL_REDIRECT_PREFIX + quote(path)
+        else:
+            response[sendfile_header] = fullpath
+        return response
+
+    byte_range = None
+    range_header = request.META.get("HTTP_RANGE")
+    if range_header and _if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+
+    start, end = byte_range or (0, size - 1)
+    length = end - start + 1
+    if request.method == "HEAD":
+        response = HttpResponse(content_type=content_type)
+    else:
+        file = open(fullpath, "rb")
+        file.seek(start)
+        response = FileResponse(_RangeFile(file, length), content_type=content_type)
+        response.block_size = BLOCK_SIZE
+    if byte_range:
+        response.status_code = 206
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    response["Content-Length"] = length
+    return response
@@ -0,0 +1,50 @@
+from django.db import migrations
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+
+
+def create_search_index(apps, schema_editor):
+    """GIN indexes only exist on PostgreSQL, other databases search in Python."""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "CREATE INDEX product_search_vector_idx ON products_product USING gin (search_vector)"
+    )
+
+    from products.search import build_search_vector
+
+    Product = apps.get_model("products", "Product")
+    for product in Product.objects.only("pk", "name", "description", "color").iterator():
+        Product.objects.filter(pk=product.pk).update(search_vector=build_search_vector(product))
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS product_search_vector_idx")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.AddIndex(
+                    model_name='product',
+                    index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+                ),
+            ],
+            database_operations=[
+                migrations.RunPython(create_search_index, drop_search_index),
+            ],
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_categorystats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='document',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import migrations, models
+
+
+def create_sku_sequence(apps, schema_editor):
+    """SKU numbers come from a sequence on PostgreSQL, other databases use SkuCounter."""
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("CREATE SEQUENCE IF NOT EXISTS products_sku_seq")
+
+
+def drop_sku_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP SEQUENCE IF EXISTS products_sku_seq")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0004_product_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SkuCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('next_value', models.PositiveBigIntegerField(default=1)),
+            ],
+        ),
+        migrations.RunPython(create_sku_sequence, drop_sku_sequence),
+    ]
@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+
+def create_slug_counters(apps, schema_editor):
+    """Count the suffixes of the existing slugs, so new slugs need no scan."""
+    from products.slugs import SUFFIXED_SLUG
+
+    Product = apps.get_model("products", "Product")
+    SlugCounter = apps.get_model("products", "SlugCounter")
+
+    counters = {}
+    for slug in Product.objects.values_list("slug", flat=True).iterator():
+        counters.setdefault(slug, 1)
+        match = SUFFIXED_SLUG.match(slug)
+        if match:
+            base_slug = match["base"]
+            counters[base_slug] = max(counters.get(base_slug, 1), int(match["suffix"]) + 1)
+
+    SlugCounter.objects.bulk_create(
+        [SlugCounter(base_slug=base_slug, next_suffix=suffix) for base_slug, suffix in counters.items()],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0005_skucounter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlugCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('base_slug', models.CharField(max_length=100, unique=True)),
+                ('next_suffix', models.PositiveIntegerField(default=1)),
+            ],
+        ),
+        migrations.RunPython(create_slug_counters, migrations.RunPython.noop),
+    ]
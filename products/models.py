@@ -1,11 +1,23 @@
-import random
-import string
 import re
-from django.db import models
-from django.db.models.signals import pre_save
+import uuid
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import Count, F, Q
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from categories.models import Category
+from .blobs import BLOB_DIR, blob_storage, update_references
+from .cache import bump_catalog_version
+from .documents import refresh_product_documents
+from .images import has_current_variants
+from .search import build_search_vector, suggestion_index
+from .sku import sku_allocator
+from .slugs import allocate_slug
+from .tasks import enqueue
 
 
 class ArabicSlugify:
@@ -25,7 +37,8 @@ class Product(models.Model):
     sku = models.CharField(max_length=12, unique=True, blank=True, editable=False, verbose_name="SKU")
     slug = models.SlugField(max_length=100, unique=True, blank=True, allow_unicode=True, verbose_name="Slug")
     description = models.TextField(blank=True, null=True, verbose_name="Description")
-    price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Price", null=True, blank=True)
+    # NOT NULL as created by the initial migration, so price ordering needs no NULLS LAST
+    price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name="Price")
     color = models.CharField(max_length=50, verbose_name="Color", blank=True, null=True)
     length_cm = models.DecimalField(max_digits=5, decimal_places=1, null=True, blank=True, verbose_name="Length (cm)")
     width_cm = models.DecimalField(max_digits=5, decimal_places=1, null=True, blank=True, verbose_name="Width (cm)")
@@ -44,6 +57,9 @@ class Product(models.Model):
     is_active = models.BooleanField(default=True, help_text="Set to False to hide the product from being displayed.")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Precomputed public representation, see products/documents.py
+    document = models.JSONField(null=True, blank=True, editable=False)
 
     # Optional: Add a custom manager if you want to filter only active products by default
     objects = models.Manager()  # Default manager
@@ -53,31 +69,45 @@ class Product(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+            # Filter paths of the product list, anonymous users only see
+            # active products so most of these are partial indexes
+            models.Index(
+                fields=['-created_at', '-id'],
+                name='product_active_created_idx',
+                condition=Q(is_active=True),
+            ),
+            models.Index(
+                fields=['-created_at', '-id'],
+                name='product_best_seller_idx',
+                condition=Q(is_active=True, is_best_seller=True),
+            ),
+            models.Index(fields=['price', 'id'], name='product_active_price_idx', condition=Q(is_active=True)),
+            models.Index(fields=['category', 'is_active', '-created_at'], name='product_cat_active_created_idx'),
+            models.Index(fields=['category', 'price', 'id'], name='product_cat_price_idx', condition=Q(is_active=True)),
+        ]
 
     def __str__(self):
         return self.name
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored category and status so dashboard stats can be
+        # updated incrementally when they change
+        if "category_id" in instance.__dict__ and "is_active" in instance.__dict__:
+            instance._stats_key = (instance.category_id, instance.is_active)
+        return instance
+
     @staticmethod
     def generate_sku():
-        """Generate a unique 12-character SKU with uppercase letters and numbers."""
-        return ''.join(random.choices(string.ascii_uppercase + string.digits, k=12))
+        """Allocate a unique 12-character SKU with uppercase letters and numbers."""
+        return sku_allocator.allocate()
 
     def generate_slug(self):
         """Generate a unique slug for the product name."""
-        base_slug = ArabicSlugify.slugify(self.name)
-        slug = base_slug
-        existing_slugs = list(Product.objects.filter(slug__startswith=base_slug).values_list('slug', flat=True))
-
-        if slug not in existing_slugs:
-            return slug
-
-        # Generate a unique slug by appending a number
-        counter = 1
-        while slug in existing_slugs:
-            slug = f"{base_slug}-{counter}"
-            counter += 1
-
-        return slug
+        return allocate_slug(ArabicSlugify.slugify(self.name))
 
     def clean(self):
         """Model validation for custom constraints."""
@@ -103,37 +133,312 @@ class Product(models.Model):
 
         if not self.sku:
             self.sku = self.generate_sku()
-            while Product.objects.filter(sku=self.sku).exists():
-                self.sku = self.generate_sku()
 
         super().save(*args, **kwargs)
 
 
 @receiver(pre_save, sender=Product)
 def product_pre_save(sender, instance, *args, **kwargs):
-    """Signal to set slug and SKU before saving if they are empty."""
+    """Signal to set the slug before saving if it is empty, and refresh the search vector."""
     if not instance.slug:
         instance.slug = instance.generate_slug()
-    if not instance.sku:
-        unique_sku = instance.generate_sku()
-        while Product.objects.filter(sku=unique_sku).exists():
-            unique_sku = instance.generate_sku()
-        instance.sku = unique_sku
+    # Keep the full-text search column in sync with the product text
+    if connection.vendor == "postgresql":
+        instance.search_vector = build_search_vector(instance)
+
+
+class SkuCounter(models.Model):
+    """
+    Next SKU number to reserve, on databases without sequences.
+
+    PostgreSQL reserves SKU numbers from a sequence instead, see products/sku.py.
+    """
+    next_value = models.PositiveBigIntegerField(default=1)
+
+    def __str__(self):
+        return f"Next SKU number {self.next_value}"
+
+
+class SlugCounter(models.Model):
+    """
+    Next numeric suffix of each product base slug, see products/slugs.py.
+
+    A row exists once the base slug itself is taken.
+    """
+    base_slug = models.CharField(max_length=100, unique=True)
+    next_suffix = models.PositiveIntegerField(default=1)
+
+    def __str__(self):
+        return f"{self.base_slug}-{self.next_suffix}"
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+def refresh_suggestion_index(sender, instance, *args, **kwargs):
+    """Signal to rebuild the autocomplete index after a name may have changed."""
+    # A rebuild started before the commit would read the old names
+    transaction.on_commit(suggestion_index.invalidate)
+
+
+class CategoryStats(models.Model):
+    """
+    Materialized product counts per category for the dashboard.
+
+    Kept up to date by signals when DASHBOARD_STATS_MATERIALIZED is enabled,
+    run `manage.py refresh_dashboard_stats` after enabling it. The row without
+    a category counts uncategorized products.
+    """
+    category = models.OneToOneField(Category, on_delete=models.CASCADE, null=True, blank=True, related_name="stats")
+    product_count = models.IntegerField(default=0)
+    active_count = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name_plural = "Category stats"
+
+    def __str__(self):
+        return f"Stats for {self.category or 'uncategorized products'}"
+
+    @classmethod
+    def add(cls, category_id, products, active):
+        """Add to the counts of a category, creating its row if needed."""
+        updated = cls.objects.filter(category_id=category_id).update(
+            product_count=F("product_count") + products,
+            active_count=F("active_count") + active,
+        )
+        if not updated:
+            cls.objects.create(category_id=category_id, product_count=products, active_count=active)
+
+    @classmethod
+    def refresh(cls):
+        """Recompute every row from the products table."""
+        counts = Product.objects.values_list("category_id").annotate(
+            product_count=Count("id"),
+            active_count=Count("id", filter=Q(is_active=True)),
+        )
+        rows = {
+            category_id: cls(category_id=category_id)
+            for category_id in Category.objects.values_list("id", flat=True)
+        }
+        for category_id, product_count, active_count in counts:
+            rows[category_id] = cls(category_id=category_id, product_count=product_count, active_count=active_count)
+
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(rows.values())
+
+
+@receiver(post_save, sender=Product)
+def product_stats_post_save(sender, instance, created, *args, **kwargs):
+    """Signal to move the product between category counts when needed."""
+    if not settings.DASHBOARD_STATS_MATERIALIZED:
+        return
+    key = (instance.category_id, instance.is_active)
+    previous = None if created else getattr(instance, "_stats_key", None)
+    if previous != key:
+        if previous is not None:
+            CategoryStats.add(previous[0], -1, -int(previous[1]))
+        CategoryStats.add(key[0], 1, int(key[1]))
+    instance._stats_key = key
+
+
+@receiver(post_delete, sender=Product)
+def product_stats_post_delete(sender, instance, *args, **kwargs):
+    """Signal to remove a deleted product from its category counts."""
+    if not settings.DASHBOARD_STATS_MATERIALIZED:
+        return
+    category_id, is_active = getattr(instance, "_stats_key", (instance.category_id, instance.is_active))
+    CategoryStats.add(category_id, -1, -int(is_active))
+
+
+@receiver(pre_delete, sender=Category)
+def category_stats_pre_delete(sender, instance, *args, **kwargs):
+    """Signal to move the counts of a deleted category to uncategorized products."""
+    if not settings.DASHBOARD_STATS_MATERIALIZED:
+        return
+    stats = CategoryStats.objects.filter(category=instance).first()
+    if stats is not None:
+        CategoryStats.add(None, stats.product_count, stats.active_count)
 
 
 def product_image_upload_path(instance, filename):
-    """Generate dynamic upload path for product images."""
-    return f'products-images/{instance.product.id or "temp"}/{filename}'
+    """
+    Upload path of product images, the blob folder where the storage
+    renames them after their content, see products/blobs.py.
+    """
+    return f'{BLOB_DIR}/{filename}'
 
 
 class ProductImage(models.Model):
     product = models.ForeignKey(Product, related_name='images', on_delete=models.CASCADE)
-    image = models.ImageField(upload_to=product_image_upload_path, blank=True, null=True)
+    image = models.ImageField(upload_to=product_image_upload_path, storage=blob_storage, blank=True, null=True)
+    # Resized copies of the image, see products/images.py
+    variants = models.JSONField(null=True, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Images sharing a blob are looked up by name
+            models.Index(fields=['image'], name='productimage_image_idx'),
+        ]
+
     def __str__(self):
         return f"Image for {self.product.name}"
-    
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember the stored image so blob references can be moved when it changes
+        if "image" in instance.__dict__:
+            instance._loaded_image = instance.image.name
+        return instance
+
+
+class ImageBlob(models.Model):
+    """
+    Product image file stored once for every image with the same content,
+    see products/blobs.py.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    # Product images using the blob, it is collected once this drops to zero
+    ref_count = models.IntegerField(default=0)
+    stored_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} references)"
+
+
+@receiver(post_save, sender=ProductImage)
+def product_image_blob_post_save(sender, instance, created, *args, **kwargs):
+    """Signal to count the reference of a new or replaced image to its blob."""
+    loaded = None if created else getattr(instance, "_loaded_image", None)
+    if instance.image.name != loaded:
+        update_references(added=[instance.image.name], removed=[loaded])
+        instance._loaded_image = instance.image.name
+
+
+@receiver(post_delete, sender=ProductImage)
+def product_image_blob_post_delete(sender, instance, *args, **kwargs):
+    """Signal to release the reference of a deleted image to its blob, see collect_garbage."""
+    update_references(removed=[instance.image.name])
+
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=ProductImage)
+def product_catalog_changed(sender, instance, *args, **kwargs):
+    """Signal to invalidate cached catalog responses after any change."""
+    bump_catalog_version()
+
+
+@receiver(post_save, sender=Product)
+def product_document_post_save(sender, instance, *args, **kwargs):
+    """Signal to rebuild the stored document of a saved product."""
+    refresh_product_documents(Product.objects.filter(pk=instance.pk))
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def product_image_document_changed(sender, instance, *args, **kwargs):
+    """Signal to rebuild the document of the product when its images change."""
+    refresh_product_documents(Product.objects.filter(pk=instance.product_id))
+
+
+@receiver(post_save, sender=Category)
+def category_document_post_save(sender, instance, created, *args, **kwargs):
+    """
+    Signal to queue rebuilding the documents of the products of a saved
+    category, the task invalidates cached catalog responses once they are
+    written.
+
+    Invalidating on commit would let reads cache the old documents under
+    the new catalog version until the task runs.
+    """
+    # A new category has no products yet
+    if created:
+        bump_catalog_version()
+    else:
+        enqueue("products.refresh_category_documents", {"category_id": instance.pk})
+
+
+@receiver(pre_delete, sender=Category)
+def category_document_pre_delete(sender, instance, *args, **kwargs):
+    """Signal to remember the products which lose their category."""
+    instance._product_ids = list(Product.objects.filter(category=instance).values_list("id", flat=True))
+
+
+@receiver(post_delete, sender=Category)
+def category_document_post_delete(sender, instance, *args, **kwargs):
+    """Signal to queue rebuilding the documents of the products which lost their category."""
+    product_ids = getattr(instance, "_product_ids", [])
+    if product_ids:
+        enqueue("products.refresh_category_documents", {"product_ids": product_ids})
+    else:
+        bump_catalog_version()
+
+
+@receiver(post_save, sender=ProductImage)
+def product_image_variants_post_save(sender, instance, *args, **kwargs):
+    """Signal to queue rendering the variants of a new or replaced image."""
+    if instance.image and not has_current_variants(instance.image.name, instance.variants):
+        enqueue("products.render_image_variants", {"image_id": instance.pk})
+
+
+@receiver(post_save, sender=Category)
+def category_icon_variants_post_save(sender, instance, *args, **kwargs):
+    """Signal to queue rendering the variants of a new or replaced category icon."""
+    if instance.icon and not has_current_variants(instance.icon.name, instance.icon_variants):
+        enqueue("products.render_icon_variants", {"category_id": instance.pk})
+
+
+class VideoUpload(models.Model):
+    """Resumable chunked upload of a product video, see products/uploads.py."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    product = models.ForeignKey(Product, related_name="video_uploads", on_delete=models.CASCADE)
+    filename = models.CharField(max_length=255)
+    size = models.PositiveBigIntegerField()
+    offset = models.PositiveBigIntegerField(default=0)
+    # Storage name of the video once every chunk was received
+    video = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Upload of {self.filename} ({self.offset}/{self.size} bytes)"
+
+
+class Task(models.Model):
+    """Background task of the database task queue, see products/tasks.py."""
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (QUEUED, "Queued"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    # When a queued task is due, or when the claim of a running task expires
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='task_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} #{self.pk} ({self.status})"
 
 
 class Review(models.Model):
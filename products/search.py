@@ -0,0 +1,337 @@
+import re
+import heapq
+import logging
+import threading
+from collections import Counter, defaultdict
+from django.db import connection
+from django.db.models import Case, F, IntegerField, Value, When
+from django.db.models.functions import Cast
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from .cache import get_catalog_version
+
+
+logger = logging.getLogger(__name__)
+
+# Arabic harakat, superscript alef and tatweel are dropped before indexing
+ARABIC_DIACRITICS = re.compile(r"[\u064B-\u065F\u0670\u0640]")
+
+# Letters that are written interchangeably are folded to one form
+ARABIC_FOLDING = str.maketrans(
+    {
+        "أ": "ا",
+        "إ": "ا",
+        "آ": "ا",
+        "ٱ": "ا",
+        "ى": "ي",
+        "ة": "ه",
+    }
+)
+
+# Text search configuration, stemming is language specific so the
+# normalized text is indexed as is for both Arabic and English
+SEARCH_CONFIG = "simple"
+
+# Relevance weight of each indexed field, name matches rank first
+SEARCH_FIELDS = (
+    ("name", "A"),
+    ("description", "B"),
+    ("color", "C"),
+)
+FALLBACK_WEIGHTS = {"A": 1.0, "B": 0.4, "C": 0.2}
+
+# Ranks are stored as integers so they can be used as pagination cursors
+RANK_SCALE = 1000000
+
+
+def normalize_search_text(text):
+    """Lowercase the text, strip Arabic diacritics and fold alef, ya and ta marbuta."""
+    if not text:
+        return ""
+    text = ARABIC_DIACRITICS.sub("", text.lower())
+    return text.translate(ARABIC_FOLDING)
+
+
+def tokenize(text):
+    """Split normalized text into search terms."""
+    return re.findall(r"\w+", normalize_search_text(text))
+
+
+def build_search_vector(product):
+    """Weighted tsvector expression of the product's normalized text."""
+    vector = None
+    for field, weight in SEARCH_FIELDS:
+        field_vector = SearchVector(
+            Value(normalize_search_text(getattr(product, field))),
+            weight=weight,
+            config=SEARCH_CONFIG,
+        )
+        vector = field_vector if vector is None else vector + field_vector
+    return vector
+
+
+def search_products(queryset, search):
+    """
+    Filter the queryset by the search text and annotate `search_rank`.
+
+    Every search term must match, as a prefix, a word of the name,
+    description or color. PostgreSQL uses the indexed `search_vector`
+    column, other databases fall back to matching in Python.
+    """
+    terms = tokenize(search)
+    if not terms:
+        return queryset.none().annotate(search_rank=Value(0))
+
+    if connection.vendor != "postgresql":
+        return _search_products_in_python(queryset, terms)
+
+    query = SearchQuery(
+        " & ".join(f"{term}:*" for term in terms),
+        config=SEARCH_CONFIG,
+        search_type="raw",
+    )
+    return queryset.filter(search_vector=query).annotate(
+        search_rank=Cast(
+            SearchRank(F("search_vector"), query) * Value(float(RANK_SCALE)),
+            output_field=IntegerField(),
+        )
+    )
+
+
+def _search_products_in_python(queryset, terms):
+    ranks = {}
+    for pk, *values in queryset.values_list("pk", *(field for field, _ in SEARCH_FIELDS)):
+        fields = [
+            (tokenize(value), FALLBACK_WEIGHTS[weight])
+            for value, (_, weight) in zip(values, SEARCH_FIELDS)
+        ]
+        rank = 0.0
+        for term in terms:
+            matches = [
+                weight
+                for words, weight in fields
+                for word in words
+                if word.startswith(term)
+            ]
+            if not matches:
+                break
+            rank += sum(matches)
+        else:
+            ranks[pk] = int(rank / len(terms) * RANK_SCALE)
+
+    return queryset.filter(pk__in=ranks).annotate(
+        search_rank=Case(
+            *(When(pk=pk, then=Value(rank)) for pk, rank in ranks.items()),
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    )
+
+
+# Minimum trigram similarity of a misspelled word, the last word is
+# matched as a prefix since it is still being typed
+WORD_SIMILARITY_THRESHOLD = 0.3
+PREFIX_SIMILARITY_THRESHOLD = 0.5
+
+# Lookups stop once this many names matched, so very common words stay fast
+MAX_SUGGESTION_CANDIDATES = 200
+
+
+def trigrams(word, prefix=False):
+    """Trigrams of the word padded like pg_trgm, prefixes are not padded at the end."""
+    padded = f"  {word}" if prefix else f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SuggestionIndex:
+    """
+    In-memory trigram index over product and category names for autocomplete.
+
+    Names are split into normalized words and trigrams are indexed per
+    distinct word, so lookups only scan the vocabulary, not every name.
+
+    The index is stale after a write in this process or once the catalog
+    version changed, so writes of other workers show up too. Only the first
+    lookup of a process waits for the index to be built. Once it is stale,
+    it is rebuilt in a background thread and lookups keep using the
+    previous index until the new one replaces it, for the time of a build.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.changes = 0
+        self.built_changes = 0
+        self.built_version = None
+        self.suggestions = None
+
+    def invalidate(self):
+        self.changes += 1
+
+    def is_stale(self):
+        return self.built_changes != self.changes or self.built_version != get_catalog_version()
+
+    def build(self):
+        from categories.models import Category
+        from products.models import Product
+
+        # Changes made while building are picked up by the next rebuild
+        changes = self.changes
+        version = get_catalog_version()
+        entries = [
+            ("product", pk, slug, name)
+            for pk, slug, name in (
+                Product.objects.filter(is_active=True).values_list("pk", "slug", "name").iterator()
+            )
+        ]
+        entries += [
+            ("category", pk, None, name)
+            for pk, name in Category.objects.values_list("pk", "name").iterator()
+        ]
+        self.suggestions = Suggestions(entries)
+        self.built_changes = changes
+        self.built_version = version
+
+    def refresh(self):
+        """Rebuild the index in a background thread, unless a rebuild is running already."""
+        if not self.lock.acquire(blocking=False):
+            return
+        try:
+            threading.Thread(target=self._rebuild, name="suggestion-index", daemon=True).start()
+        except Exception:
+            self.lock.release()
+            raise
+
+    def _rebuild(self):
+        try:
+            self.build()
+        except Exception:
+            # The previous index is kept, the next lookup tries again
+            logger.exception("Rebuilding the suggestion index failed")
+        finally:
+            connection.close()
+            self.lock.release()
+
+    def suggest(self, text, limit=10):
+        """
+        Names matching every word of `text`, best matches first.
+
+        Returns a dict with `products` ({id, slug, name}) and `categories`
+        ({id, name}) lists of at most `limit` items each.
+        """
+        if self.suggestions is None:
+            with self.lock:
+                if self.suggestions is None:
+                    self.build()
+        elif self.is_stale():
+            self.refresh()
+        return self.suggestions.suggest(text, limit)
+
+
+class Suggestions:
+    """Trigram index of a fixed list of (kind, id, slug, name) entries, see SuggestionIndex."""
+
+    def __init__(self, entries):
+        vocabulary = {}
+        word_trigrams = []
+        word_entries = []
+        entry_words = []
+        postings = defaultdict(list)
+        for index, (_, _, _, name) in enumerate(entries):
+            word_ids = []
+            for word in set(tokenize(name)):
+                word_id = vocabulary.get(word)
+                if word_id is None:
+                    word_id = vocabulary[word] = len(word_trigrams)
+                    word_trigrams.append(trigrams(word))
+                    word_entries.append([])
+                    for trigram in word_trigrams[word_id]:
+                        postings[trigram].append(word_id)
+                word_entries[word_id].append(index)
+                word_ids.append(word_id)
+            entry_words.append(tuple(word_ids))
+
+        for indexes in word_entries:
+            indexes.sort(key=lambda index: len(entries[index][3]))
+
+        self.entries = entries
+        self.entry_words = entry_words
+        self.word_trigrams = word_trigrams
+        self.word_entries = word_entries
+        self.postings = postings
+
+    def match_word(self, word, prefix):
+        """Similarity of each vocabulary word close enough to `word`."""
+        query = trigrams(word, prefix=prefix)
+        shared = Counter()
+        for trigram in query:
+            shared.update(self.postings.get(trigram, ()))
+
+        matches = {}
+        for word_id, count in shared.items():
+            if prefix:
+                similarity = count / len(query)
+                threshold = PREFIX_SIMILARITY_THRESHOLD
+            else:
+                similarity = count / (len(query) + len(self.word_trigrams[word_id]) - count)
+                threshold = WORD_SIMILARITY_THRESHOLD
+            if similarity >= threshold:
+                matches[word_id] = similarity
+        return matches
+
+    def suggest(self, text, limit=10):
+        """Names matching every word of `text`, see SuggestionIndex.suggest."""
+        results = {"products": [], "categories": []}
+        words = tokenize(text)
+        matches = [
+            self.match_word(word, prefix=position == len(words) - 1)
+            for position, word in enumerate(words)
+        ]
+        if not matches or not all(matches):
+            return results
+
+        # Names containing a match for every word
+        entry_sets = sorted(
+            (
+                set().union(*(self.word_entries[word_id] for word_id in word_matches))
+                for word_matches in matches
+            ),
+            key=len,
+        )
+        allowed = entry_sets[0].intersection(*entry_sets[1:])
+
+        # Entries of each word are sorted by name length, so scanning the
+        # first word can stop early when it is very common
+        candidates = {"product": [], "category": []}
+        matched = 0
+        seen = set()
+        for word_id, _ in sorted(matches[0].items(), key=lambda item: -item[1]):
+            for index in self.word_entries[word_id]:
+                if index in seen or index not in allowed:
+                    continue
+                seen.add(index)
+                score = 0
+                for word_matches in matches:
+                    score += max(word_matches.get(word, 0) for word in self.entry_words[index])
+                kind, _, _, name = self.entries[index]
+                # Shorter names first among equal scores
+                candidates[kind].append((-score, len(name), index))
+                matched += 1
+                if matched >= MAX_SUGGESTION_CANDIDATES:
+                    break
+            if matched >= MAX_SUGGESTION_CANDIDATES:
+                break
+
+        results["products"] = [
+            {"id": pk, "slug": slug, "name": name}
+            for _, pk, slug, name in self._best(candidates["product"], limit)
+        ]
+        results["categories"] = [
+            {"id": pk, "name": name}
+            for _, pk, _, name in self._best(candidates["category"], limit)
+        ]
+        return results
+
+    def _best(self, candidates, limit):
+        return [self.entries[index] for _, _, index in heapq.nsmallest(limit, candidates)]
+
+
+suggestion_index = SuggestionIndex()
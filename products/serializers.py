@@ -1,25 +1,37 @@
 from rest_framework import serializers
-from .models import Category, Product, ProductImage, Review
+from instrumentation import TimedSerializerMixin
+from .models import Category, Product, ProductImage, Review, VideoUpload
 from categories.serializers import CategorySerializer
+from .images import check_image, variant_urls
+from .tasks import store_product_images, store_product_video
+from .uploads import MAX_CHUNK_SIZE
 
 
-class ProductImageSerializer(serializers.ModelSerializer):
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.mkv')
+MAX_VIDEO_SIZE = 1 * 1024 * 1024 * 1024
+
+
+class ProductImageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     created_at = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S", read_only=True)
+    srcset = serializers.SerializerMethodField()
     
     class Meta:
         model = ProductImage
-        fields = ['id', 'image', 'created_at']
+        fields = ['id', 'image', 'srcset', 'created_at']
         read_only_fields = ['created_at']
+
+    def get_srcset(self, obj):
+        """URLs of the resized variants by format and width, empty until they are rendered."""
+        return variant_urls(obj.image, obj.variants, self.context.get('request'))
         
     def validate_image(self, value):
-        if not value.name.lower().endswith(('.png', '.jpg', '.jpeg','arw')):
-            raise serializers.ValidationError("Only PNG, JPG, and JPEG images are allowed.")
-        if value.size > 5 * 1024 * 1024:
-            raise serializers.ValidationError("Image file size should not exceed 5MB.")
+        error = check_image(value)
+        if error:
+            raise serializers.ValidationError(error)
         return value
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     category = CategorySerializer(read_only=True)
     images = ProductImageSerializer(many=True, read_only=True)
 
@@ -71,9 +83,9 @@ class ProductSerializer(serializers.ModelSerializer):
 
     def validate_product_video(self, value):
         """Validate the uploaded video file."""
-        if not value.name.lower().endswith(('.mp4', '.mov', '.avi', '.mkv')):
+        if not value.name.lower().endswith(VIDEO_EXTENSIONS):
             raise serializers.ValidationError("Only MP4, MOV, AVI, and MKV video formats are allowed.")
-        if value.size > 1 * 1024 * 1024 * 1024:
+        if value.size > MAX_VIDEO_SIZE:
             raise serializers.ValidationError("Video file size should not exceed 1GB.")
         return value
 
@@ -82,12 +94,10 @@ class ProductSerializer(serializers.ModelSerializer):
         video_data = validated_data.pop('product_video', None)
         product = Product.objects.create(**validated_data)
 
-        for image in images_data:
-            ProductImage.objects.create(product=product, image=image)
-
+        # Files are stored now and attached to the product by background tasks
+        store_product_images(product, images_data)
         if video_data:
-            product.product_video = video_data
-            product.save()
+            store_product_video(product, video_data)
 
         return product
 
@@ -100,11 +110,9 @@ class ProductSerializer(serializers.ModelSerializer):
         instance.save()
 
         if images:
-            for image in images:
-                ProductImage.objects.create(product=instance, image=image)
+            store_product_images(instance, images)
         if video_data:
-            instance.product_video = video_data
-            instance.save()
+            store_product_video(instance, video_data)
 
         return instance
 
@@ -126,7 +134,36 @@ class ProductSerializer(serializers.ModelSerializer):
         return representation
 
 
-class ReviewSerializer(serializers.ModelSerializer):
+class VideoUploadSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    created_at = serializers.DateTimeField(format="%Y-%m-%d %H:%M:%S", read_only=True)
+    max_chunk_size = serializers.SerializerMethodField()
+    complete = serializers.SerializerMethodField()
+
+    class Meta:
+        model = VideoUpload
+        fields = ['id', 'filename', 'size', 'offset', 'max_chunk_size', 'complete', 'created_at']
+        read_only_fields = ['offset', 'created_at']
+
+    def get_max_chunk_size(self, obj):
+        return MAX_CHUNK_SIZE
+
+    def get_complete(self, obj):
+        return bool(obj.video)
+
+    def validate_filename(self, value):
+        if not value.lower().endswith(VIDEO_EXTENSIONS):
+            raise serializers.ValidationError("Only MP4, MOV, AVI, and MKV video formats are allowed.")
+        return value
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("Video file must not be empty.")
+        if value > MAX_VIDEO_SIZE:
+            raise serializers.ValidationError("Video file size should not exceed 1GB.")
+        return value
+
+
+class ReviewSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Review
         fields = ["id", "name", "review"]
\ No newline at end of file
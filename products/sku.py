@@ -0,0 +1,88 @@
+import os
+import string
+import threading
+from collections import deque
+from django.conf import settings
+from django.db import connection, transaction
+from hashids import Hashids
+
+
+# SKUs are 12 uppercase letters and digits, like the random SKUs made before
+SKU_ALPHABET = string.ascii_uppercase + string.digits
+SKU_LENGTH = 12
+
+# PostgreSQL sequence the SKU numbers are drawn from, see migration 0005
+SKU_SEQUENCE = "products_sku_seq"
+
+# Numbers each process reserves at a time, so most products need no query
+SKU_BLOCK_SIZE = 100
+
+_hashids = Hashids(salt=settings.SKU_HASHIDS_SALT, min_length=SKU_LENGTH, alphabet=SKU_ALPHABET)
+
+
+def encode_sku(number):
+    """SKU of a number, distinct numbers always give distinct SKUs."""
+    return _hashids.encode(number)
+
+
+def reserve_sku_numbers(count):
+    """
+    Reserve `count` numbers which no other process will ever get.
+
+    PostgreSQL draws them from a sequence, which is never rolled back, so
+    numbers stay reserved even when the calling transaction fails. Other
+    databases, used in development, increment the SkuCounter row instead.
+    """
+    if count <= 0:
+        return []
+
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(%s) FROM generate_series(1, %s)",
+                [SKU_SEQUENCE, count],
+            )
+            return [number for number, in cursor.fetchall()]
+
+    from .models import SkuCounter
+
+    with transaction.atomic():
+        counter, _ = SkuCounter.objects.select_for_update().get_or_create(pk=1)
+        start = counter.next_value
+        counter.next_value = start + count
+        counter.save(update_fields=["next_value"])
+    return list(range(start, start + count))
+
+
+def reserve_skus(count):
+    """Reserve a block of `count` SKUs at once, for bulk imports."""
+    return [encode_sku(number) for number in reserve_sku_numbers(count)]
+
+
+class SkuAllocator:
+    """
+    Hands out SKUs from blocks of numbers reserved by this process.
+
+    Blocks never overlap, so SKUs are unique across threads, workers and
+    servers without checking the products table.
+    """
+
+    def __init__(self, block_size=SKU_BLOCK_SIZE):
+        self.block_size = block_size
+        self.lock = threading.Lock()
+        self.numbers = deque()
+        self.pid = None
+
+    def allocate(self):
+        with self.lock:
+            # A forked worker must not reuse the numbers of its parent
+            if self.pid != os.getpid():
+                self.numbers.clear()
+                self.pid = os.getpid()
+            if not self.numbers:
+                self.numbers.extend(reserve_sku_numbers(self.block_size))
+            number = self.numbers.popleft()
+        return encode_sku(number)
+
+
+sku_allocator = SkuAllocator()
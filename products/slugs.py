@@ -0,0 +1,65 @@
+import re
+from django.db import IntegrityError, transaction
+
+
+# Slugs made unique by a numeric suffix, `<base>-<suffix>`
+SUFFIXED_SLUG = re.compile(r"^(?P<base>.+)-(?P<suffix>\d+)$")
+
+
+def next_free_suffix(base_slug):
+    """Suffix after the highest one used with the base slug, scanning existing slugs."""
+    from .models import Product
+
+    suffix = 1
+    for slug in Product.objects.filter(slug__startswith=f"{base_slug}-").values_list("slug", flat=True):
+        match = SUFFIXED_SLUG.match(slug)
+        if match and match["base"] == base_slug:
+            suffix = max(suffix, int(match["suffix"]) + 1)
+    return suffix
+
+
+def allocate_slug(base_slug):
+    """
+    Return an unused slug for the base slug: the base itself the first time,
+    then the base with the next suffix of its SlugCounter row.
+
+    The counter row is locked while the suffix is taken, so concurrent
+    inserts of the same name get different slugs, and the number of existing
+    duplicates does not matter.
+    """
+    from .models import Product, SlugCounter
+
+    with transaction.atomic():
+        counter = SlugCounter.objects.select_for_update().filter(base_slug=base_slug).first()
+        if counter is None:
+            try:
+                with transaction.atomic():
+                    SlugCounter.objects.create(base_slug=base_slug, next_suffix=next_free_suffix(base_slug))
+            except IntegrityError:
+                # Another insert of the same name created it first
+                pass
+            else:
+                # Slugs set by hand or before the counters existed are not counted
+                if not Product.objects.filter(slug=base_slug).exists():
+                    return base_slug
+            counter = SlugCounter.objects.select_for_update().get(base_slug=base_slug)
+
+        slug = f"{base_slug}-{counter.next_suffix}"
+        counter.next_suffix += 1
+        while Product.objects.filter(slug=slug).exists():
+            slug = f"{base_slug}-{counter.next_suffix}"
+            counter.next_suffix += 1
+        counter.save(update_fields=["next_suffix"])
+    return slug
+
+
+def store_slug_counters(counters):
+    """Save {base slug: next suffix} counters of slugs allocated in bulk."""
+    from .models import SlugCounter
+
+    SlugCounter.objects.bulk_create(
+        [SlugCounter(base_slug=base_slug, next_suffix=suffix) for base_slug, suffix in counters.items()],
+        update_conflicts=True,
+        unique_fields=["base_slug"],
+        update_fields=["next_suffix"],
+    )
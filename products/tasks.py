@@ -0,0 +1,248 @@
+import logging
+import traceback
+from datetime import timedelta
+from django.db import transaction
+from django.db.models import Count, Min, Q
+from django.utils import timezone
+from metrics import count_upload_bytes
+from .blobs import update_references
+from .cache import bump_catalog_version
+from .documents import refresh_product_documents
+from .images import create_category_icon_variants, create_product_image_variants
+
+
+logger = logging.getLogger(__name__)
+
+# Attempts of a task before it is marked as failed
+TASK_MAX_ATTEMPTS = 3
+
+# Failed attempts are retried after this many seconds, doubled each time
+TASK_RETRY_DELAY = 10
+TASK_MAX_RETRY_DELAY = 60 * 60
+
+# Seconds a claimed task stays invisible to other workers, a task still
+# running after that is considered lost and claimed again
+TASK_VISIBILITY_TIMEOUT = 5 * 60
+
+# Finished tasks are kept this long for the queue stats
+TASK_RETENTION = timedelta(days=7)
+
+_registry = {}
+
+
+def task(name):
+    """Register a function as the task `name`, it is called with the payload as keyword arguments."""
+
+    def register(function):
+        _registry[name] = function
+        return function
+
+    return register
+
+
+def enqueue(name, payload=None, *, delay=0, max_attempts=TASK_MAX_ATTEMPTS):
+    """
+    Queue the task `name` to run in a worker, see `manage.py run_tasks`.
+
+    The task is stored in the current transaction, so it only runs if that
+    transaction commits.
+    """
+    from .models import Task
+
+    if name not in _registry:
+        raise LookupError(f"Unknown task {name!r}.")
+    return Task.objects.create(
+        name=name,
+        payload=payload or {},
+        run_at=timezone.now() + timedelta(seconds=delay),
+        max_attempts=max_attempts,
+    )
+
+
+def claim_tasks(worker, limit, visibility_timeout=TASK_VISIBILITY_TIMEOUT):
+    """
+    Claim up to `limit` due tasks for the worker.
+
+    Rows locked by other workers are skipped instead of waited for, and
+    claimed tasks are hidden until their visibility timeout expires.
+    """
+    from .models import Task
+
+    now = timezone.now()
+    with transaction.atomic():
+        due = list(
+            Task.objects.select_for_update(skip_locked=True)
+            .filter(status__in=[Task.QUEUED, Task.RUNNING], run_at__lte=now)
+            .order_by("run_at")[:limit]
+        )
+        claimed = []
+        for task in due:
+            if task.status == Task.RUNNING and task.attempts >= task.max_attempts:
+                # The last attempt was lost, by a crashed worker for instance
+                task.status = Task.FAILED
+                task.last_error = "Visibility timeout expired on the last attempt."
+                task.finished_at = now
+                continue
+            task.status = Task.RUNNING
+            task.attempts += 1
+            task.locked_by = worker
+            task.started_at = now
+            task.run_at = now + timedelta(seconds=visibility_timeout)
+            claimed.append(task)
+        Task.objects.bulk_update(
+            due, ["status", "attempts", "locked_by", "started_at", "run_at", "last_error", "finished_at"]
+        )
+    return claimed
+
+
+def run_task(task):
+    """Run a claimed task, then mark it as done or schedule its retry. Returns whether it succeeded."""
+    from .models import Task
+
+    # A task whose visibility timeout expired may have been claimed again
+    current = Task.objects.filter(pk=task.pk, locked_by=task.locked_by, attempts=task.attempts)
+    try:
+        function = _registry.get(task.name)
+        if function is None:
+            raise LookupError(f"Unknown task {task.name!r}.")
+        function(**task.payload)
+    except Exception:
+        logger.exception("Task %s (%s) failed on attempt %s", task.pk, task.name, task.attempts)
+        if task.attempts >= task.max_attempts:
+            current.update(status=Task.FAILED, last_error=traceback.format_exc(), finished_at=timezone.now())
+        else:
+            delay = min(TASK_RETRY_DELAY * 2 ** (task.attempts - 1), TASK_MAX_RETRY_DELAY)
+            current.update(
+                status=Task.QUEUED,
+                last_error=traceback.format_exc(),
+                run_at=timezone.now() + timedelta(seconds=delay),
+            )
+        return False
+
+    current.update(status=Task.DONE, finished_at=timezone.now())
+    return True
+
+
+def prune_tasks(retention=TASK_RETENTION):
+    """Delete the tasks which finished successfully before the retention period."""
+    from .models import Task
+
+    return Task.objects.filter(status=Task.DONE, finished_at__lt=timezone.now() - retention).delete()[0]
+
+
+def get_task_queue_stats():
+    """Queue depth by status and the wait and run times of recently finished tasks."""
+    from .models import Task
+
+    now = timezone.now()
+    counts = Task.objects.aggregate(
+        queued=Count("id", filter=Q(status=Task.QUEUED)),
+        due=Count("id", filter=Q(status=Task.QUEUED, run_at__lte=now)),
+        running=Count("id", filter=Q(status=Task.RUNNING)),
+        failed=Count("id", filter=Q(status=Task.FAILED)),
+        oldest_due=Min("run_at", filter=Q(status=Task.QUEUED, run_at__lte=now)),
+    )
+    recent = Task.objects.filter(status=Task.DONE, finished_at__gte=now - timedelta(hours=1)).values_list(
+        "created_at", "started_at", "finished_at"
+    )
+    waits = sorted((started - created).total_seconds() for created, started, _ in recent)
+    runs = sorted((finished - started).total_seconds() for _, started, finished in recent)
+    oldest_due = counts.pop("oldest_due")
+    return {
+        **counts,
+        "oldest_due_seconds": (now - oldest_due).total_seconds() if oldest_due else None,
+        "done_last_hour": len(waits),
+        "wait_seconds_p50": _percentile(waits, 0.5),
+        "wait_seconds_p95": _percentile(waits, 0.95),
+        "run_seconds_p50": _percentile(runs, 0.5),
+        "run_seconds_p95": _percentile(runs, 0.95),
+    }
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    return round(values[min(int(len(values) * fraction), len(values) - 1)], 3)
+
+
+def store_product_images(product, files):
+    """
+    Store uploaded images under their final names and queue attaching them
+    to the product. Returns the stored names.
+    """
+    from .models import ProductImage
+
+    count_upload_bytes("image", sum(file.size for file in files))
+    # Files are hashed and written concurrently, see products/blobs.py
+    names = ProductImage._meta.get_field("image").storage.save_blobs(files)
+    if names:
+        enqueue("products.attach_images", {"product_id": product.pk, "names": names})
+    return names
+
+
+def store_product_video(product, file):
+    """Store an uploaded video under its final name and queue setting it on the product."""
+    from .models import Product
+
+    count_upload_bytes("video", file.size)
+    field = Product._meta.get_field("product_video")
+    name = field.storage.save(field.generate_filename(product, file.name), file)
+    enqueue("products.attach_video", {"product_id": product.pk, "name": name})
+    return name
+
+
+@task("products.attach_images")
+def attach_images(product_id, names):
+    """Create the images of stored files and render their variants."""
+    from .models import Product, ProductImage
+
+    if not Product.objects.filter(pk=product_id).exists():
+        return
+    # A retried attempt skips the images attached before it failed, and as
+    # names are content hashes, a photo the product already has is skipped too
+    attached = set(ProductImage.objects.filter(product_id=product_id, image__in=names).values_list("image", flat=True))
+    with transaction.atomic():
+        images = ProductImage.objects.bulk_create(
+            [ProductImage(product_id=product_id, image=name) for name in dict.fromkeys(names) if name not in attached]
+        )
+        # bulk_create sends no signal, so the blob references are counted here
+        update_references(added=[image.image.name for image in images])
+    for image in images:
+        create_product_image_variants(image.pk, refresh=False)
+    refresh_product_documents(Product.objects.filter(pk=product_id))
+    bump_catalog_version()
+
+
+@task("products.attach_video")
+def attach_video(product_id, name):
+    from .models import Product
+
+    product = Product.objects.filter(pk=product_id).first()
+    if product is not None:
+        product.product_video = name
+        product.save()
+
+
+@task("products.refresh_category_documents")
+def refresh_category_documents(category_id=None, product_ids=None):
+    """Rebuild the documents of the products of a category, or of the given products."""
+    from .models import Product
+
+    if product_ids is not None:
+        products = Product.objects.filter(pk__in=product_ids)
+    else:
+        products = Product.objects.filter(category_id=category_id)
+    refresh_product_documents(products)
+    # bulk_update sends no signal, and the category change itself is only
+    # invalidated here so no response is cached with the old documents
+    bump_catalog_version()
+
+
+@task("products.render_image_variants")
+def render_image_variants(image_id):
+    create_product_image_variants(image_id)
+
+
+@task("products.render_icon_variants")
+def render_icon_variants(category_id):
+    create_category_icon_variants(category_id)
@@ -1,3 +1,1997 @@
-from django.test import TestCase
+import base64
+import csv
+import datetime
+import decimal
+import fcntl
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import uuid
+from random import Random
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+from urllib.parse import parse_qs, quote, urlsplit
 
-# Create your tests here.
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.db.models import Count
+from django.db.models.functions import Lower
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import UnreadablePostError
+from django.utils import timezone
+from PIL import Image
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from custom import CustomCursorPagination
+from testing import QueryBudgetMixin
+from renderers import CustomJSONRenderer, orjson
+from categories.models import Category
+from products.blobs import BLOB_DIR, blob_storage, collect_garbage, recount_references
+from products.cache import bump_catalog_version, get_catalog_cache_stats, get_catalog_version
+from products.documents import build_product_document
+from products.export import EXPORT_FIELDS
+from products.facets import facet_index
+from products.images import (
+    PRODUCT_IMAGE_WIDTHS,
+    VARIANT_FORMATS,
+    create_category_icon_variants,
+    create_product_image_variants,
+    render_variants,
+)
+from products.models import CategoryStats, ImageBlob, Product, ProductImage, SlugCounter, Task, VideoUpload
+from products.search import SuggestionIndex, Suggestions, search_products, trigrams
+from products.sku import SkuAllocator, encode_sku, reserve_sku_numbers, reserve_skus, sku_allocator
+from products.slugs import allocate_slug, store_slug_counters
+from products.tasks import (
+    TASK_RETENTION,
+    TASK_RETRY_DELAY,
+    attach_images,
+    claim_tasks,
+    enqueue,
+    prune_tasks,
+    run_task,
+)
+from products.uploads import append_chunk, part_path
+from products.views import ProductViewSet
+from users.models import User
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ProductQueryBudgetTests(QueryBudgetMixin, TestCase):
+    """
+    Product read endpoints must run a constant number of queries,
+    whatever the number of products returned.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.category = Category.objects.create(name="Sofas")
+
+    def create_products(self, count):
+        for i in range(count):
+            product = Product.objects.create(
+                name=f"Product {Product.objects.count()}",
+                price=100 + i,
+                category=self.category,
+            )
+            for _ in range(2):
+                ProductImage.objects.create(
+                    product=product,
+                    image=SimpleUploadedFile("image.jpg", b"", content_type="image/jpeg"),
+                )
+
+    def test_product_list_budget(self):
+        self.create_products(1)
+        with self.assertQueryBudget(2):
+            response = self.client.get("/products/")
+        self.assertEqual(response.status_code, 200)
+
+        self.create_products(10)
+        with self.assertQueryBudget(2):
+            response = self.client.get("/products/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_product_detail_budget(self):
+        self.create_products(1)
+        product = Product.objects.get()
+        with self.assertQueryBudget(2):
+            response = self.client.get(f"/products/{product.id}/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_products_by_category_budget(self):
+        self.create_products(10)
+        self.client.force_authenticate(User.objects.create_user(username="staff", password="pass"))
+        with self.assertQueryBudget(3):
+            response = self.client.get(f"/category/{self.category.id}/products/")
+        self.assertEqual(response.status_code, 200)
+
+
+class ProductListPlanTests(TestCase):
+    """
+    Every filter combination of the product list must be answered from an
+    index. The plan of the first page is captured with EXPLAIN and a
+    sequential scan of the products table fails the test, as does a sort
+    when the list is ordered by price.
+    """
+
+    # Query parameters of the list, `category` is replaced by a seeded id
+    COMBINATIONS = [
+        {},
+        {"category": True},
+        {"best_seller": "true"},
+        {"best_seller": "false"},
+        {"price_min": "100", "price_max": "500"},
+        {"order_by_price": "min"},
+        {"order_by_price": "max"},
+        {"color": "red"},
+        {"category": True, "best_seller": "true"},
+        {"category": True, "order_by_price": "min"},
+        {"category": True, "order_by_price": "max"},
+        {"category": True, "price_min": "100", "price_max": "500"},
+        {"best_seller": "true", "price_min": "100"},
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.categories = [Category.objects.create(name=f"Category {i}") for i in range(5)]
+        Product.objects.bulk_create(
+            Product(
+                name=f"Product {i}",
+                slug=f"product-{i}",
+                sku=f"PLAN{i:08d}",
+                price=10 + i % 1000,
+                color=("red", "blue", "oak")[i % 3],
+                category=cls.categories[i % 5],
+                is_active=i % 10 != 0,
+                is_best_seller=i % 20 == 0,
+            )
+            for i in range(2000)
+        )
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE products_product" if connection.vendor == "postgresql" else "ANALYZE")
+
+    def list_queryset(self, params, user=None):
+        """First page of the list as the view and cursor pagination query it."""
+        request = Request(APIRequestFactory().get("/products/", params))
+        request.user = user or AnonymousUser()
+        view = ProductViewSet(request=request, action="list", format_kwarg=None, kwargs={})
+        queryset = view.get_queryset().select_related(None).prefetch_related(None)
+
+        pagination = CustomCursorPagination()
+        pagination.ordering = view.get_pagination_ordering()
+        pagination.fields = [
+            pagination._get_ordering_field(queryset, field.lstrip("-")) for field in pagination.ordering
+        ]
+        return queryset.order_by(*pagination._get_order_by(reverse=False))[: pagination.page_size + 1]
+
+    def assertNoSequentialScan(self, queryset):
+        if connection.vendor == "postgresql":
+            # The planner prefers a sequential scan on a table this small, so
+            # it is disabled to check that an index matches the query at all
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+            plan = queryset.explain()
+            sequential = "Seq Scan on products_product" in plan
+        else:
+            plan = queryset.explain()
+            sequential = re.search(r"\bSCAN products_product\b(?! USING)", plan) is not None
+        self.assertFalse(sequential, f"Sequential scan of the products:\n{plan}")
+        return plan
+
+    def assertNoSort(self, plan):
+        if connection.vendor == "postgresql":
+            sort = re.search(r"^\s*(->\s*)?(Incremental )?Sort\b", plan, re.MULTILINE) is not None
+        else:
+            sort = "USE TEMP B-TREE FOR" in plan and "ORDER BY" in plan
+        self.assertFalse(sort, f"Products are sorted instead of read in index order:\n{plan}")
+
+    def test_anonymous_list_plans(self):
+        for params in self.COMBINATIONS:
+            if params.get("category"):
+                params = {**params, "category": self.categories[2].pk}
+            with self.subTest(**params):
+                plan = self.assertNoSequentialScan(self.list_queryset(params))
+                if "order_by_price" in params:
+                    self.assertNoSort(plan)
+
+    def test_staff_category_list_plan(self):
+        user = User.objects.create_user(username="staff", password="pass")
+        self.assertNoSequentialScan(self.list_queryset({"category": self.categories[2].pk}, user))
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class RendererParityTests(TestCase):
+    """
+    The orjson path of CustomJSONRenderer must write the same bytes as the
+    stdlib JSONRenderer path.
+    """
+
+    def setUp(self):
+        if orjson is None:
+            self.skipTest("orjson is not installed")
+        # Catalog versions only change on commit, so responses cached by
+        # other tests would be served
+        cache.clear()
+        category = Category.objects.create(name="Sofas \u2028 وسائد")
+        for i in range(5):
+            Product.objects.create(name=f"Product {i} \u00e9\u2029", price=f"{100 + i}.50", category=category)
+
+    def render(self, data, use_orjson, response=None):
+        renderer = CustomJSONRenderer()
+        renderer.use_orjson = use_orjson
+        return renderer.render(data, "application/json", {"response": response})
+
+    def assertSameBytes(self, data, response=None):
+        self.assertEqual(self.render(data, True, response), self.render(data, False, response))
+
+    def test_api_payloads(self):
+        client = APIClient()
+        product = Product.objects.first()
+        for url in ["/products/", f"/products/{product.id}/", "/products/?page_size=2"]:
+            with self.subTest(url=url):
+                response = client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertSameBytes(response.data, response)
+
+    def test_edge_values(self):
+        values = {
+            "floats": [0.1, 1.0, 1.5, 123456789012345.0],
+            "decimals": [
+                decimal.Decimal("1E+2"),
+                decimal.Decimal("0.000001"),
+                decimal.Decimal("12.50"),
+                decimal.Decimal("1E+16"),
+            ],
+            "ints": [2**63, 2**64 - 1, 2**64, -(2**63) - 1, 10**30],
+            "datetime": datetime.datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo=datetime.timezone.utc),
+            "date": datetime.date(2024, 1, 2),
+            "time": datetime.time(3, 4, 5, 678901),
+            "uuid": uuid.UUID(int=1),
+            "keys": {1: "one", None: "none", True: "true"},
+            "text": "1e5 \x7f \u2028 \U0001f600",
+        }
+        for name, value in values.items():
+            with self.subTest(name=name):
+                self.assertSameBytes({name: value})
+
+    def test_floats_in_exponent_notation(self):
+        # orjson writes 1e16 where json writes 1e+16, the same number
+        data = {"floats": [1e-05, 1e16, 1.5e300, -0.00001234]}
+        self.assertEqual(json.loads(self.render(data, True)), json.loads(self.render(data, False)))
+
+    def test_out_of_range_decimals_are_refused(self):
+        for use_orjson in (True, False):
+            with self.subTest(use_orjson=use_orjson), self.assertRaises(ValueError):
+                self.render({"price": decimal.Decimal("NaN")}, use_orjson)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ProductCursorPaginationTests(TestCase):
+    """Keyset pagination of the product list."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        category = Category.objects.create(name="Chairs")
+        self.products = [
+            Product.objects.create(name=f"Chair {i}", price=100 + i % 3, category=category) for i in range(7)
+        ]
+        # Equal timestamps leave the ordering to the id tiebreaker
+        Product.objects.update(created_at=timezone.now())
+
+    def get_page(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def walk(self, url, link):
+        """Pages following `link` from `url`, as lists of ids."""
+        pages = []
+        while url:
+            page = self.get_page(url)
+            pages.append([product["id"] for product in page["data"]])
+            url = page[link]
+        return pages
+
+    def test_pages_cover_every_product_once_in_order(self):
+        pages = self.walk("/products/?page_size=3", "next")
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        ids = [pk for page in pages for pk in page]
+        self.assertEqual(ids, sorted((product.pk for product in self.products), reverse=True))
+
+    def test_price_ordering_pages(self):
+        pages = self.walk("/products/?page_size=2&order_by_price=min", "next")
+        ids = [pk for page in pages for pk in page]
+        expected = sorted(self.products, key=lambda product: (product.price, product.pk))
+        self.assertEqual(ids, [product.pk for product in expected])
+
+    def test_previous_links_walk_back(self):
+        forward = self.walk("/products/?page_size=3", "next")
+        first = self.get_page("/products/?page_size=3")
+        self.assertIsNone(first["previous"])
+        last_url = self.get_page(first["next"])["next"]
+        last = self.get_page(last_url)
+        self.assertIsNone(last["next"])
+        backward = self.walk(last["previous"], "previous")
+        self.assertEqual(backward, forward[-2::-1])
+
+    def test_paginated_by_default(self):
+        with mock.patch.object(CustomCursorPagination, "page_size", 5):
+            page = self.get_page("/products/")
+        self.assertEqual(
+            set(page), {"status", "message", "page_size", "next", "previous", "data"}
+        )
+        self.assertEqual(page["page_size"], 5)
+        self.assertEqual(len(page["data"]), 5)
+        self.assertIsNotNone(page["next"])
+        self.assertIsNone(page["previous"])
+
+    def test_pagination_opt_out(self):
+        with mock.patch.object(CustomCursorPagination, "page_size", 5):
+            page = self.get_page("/products/?paginate=false")
+        self.assertEqual(set(page), {"status", "message", "data"})
+        self.assertEqual(len(page["data"]), 7)
+
+    def test_invalid_cursors(self):
+        valid = parse_qs(urlsplit(self.get_page("/products/?page_size=3")["next"]).query)["cursor"][0]
+        payload = json.loads(urlsafe_b64decode(valid + "=" * (-len(valid) % 4)))
+
+        def encode(data):
+            return urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+        cursors = {
+            "garbage": "not a cursor",
+            "not json": urlsafe_b64encode(b"{").decode(),
+            "no position": encode({"r": 1}),
+            "short position": encode({"p": payload["p"][:1]}),
+            "bad date": encode({"p": ["yesterday", payload["p"][1]]}),
+            "bad id": encode({"p": [payload["p"][0], "x"]}),
+        }
+        for name, cursor in cursors.items():
+            with self.subTest(name):
+                response = self.client.get("/products/", {"page_size": 3, "cursor": cursor})
+                self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ProductSearchTests(TestCase):
+    """
+    Full-text search of the product list. PostgreSQL answers from the
+    search_vector column, other databases from the Python fallback, and both
+    must find and rank the same products.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name="Living room")
+        cls.sofa = Product.objects.create(name="Oak sofa", description="Three seats", price=100, category=category)
+        cls.table = Product.objects.create(name="Table", description="Solid oak top", price=100, category=category)
+        cls.chair = Product.objects.create(name="Chair", color="Oak", price=100, category=category)
+        cls.arabic = Product.objects.create(name="كُرْسِيّ أزرق", description="مريحة", price=100, category=category)
+        Product.objects.create(name="Lamp", description="Brass", price=100, category=category)
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, text):
+        return list(search_products(Product.objects.all(), text).order_by("-search_rank", "-id"))
+
+    def test_every_term_must_match_a_word_prefix(self):
+        self.assertEqual(self.search("sof seat"), [self.sofa])
+        self.assertEqual(self.search("sofa lamp"), [])
+        self.assertEqual(self.search("ak"), [])
+
+    def test_name_matches_rank_first(self):
+        self.assertEqual(self.search("oak"), [self.sofa, self.table, self.chair])
+
+    def test_arabic_normalization(self):
+        self.assertEqual(self.search("كرسي"), [self.arabic])
+        self.assertEqual(self.search("ازرق"), [self.arabic])
+        self.assertEqual(self.search("مريحه"), [self.arabic])
+
+    def test_text_without_terms_matches_nothing(self):
+        self.assertEqual(self.search("  ?! "), [])
+
+    def test_list_endpoint(self):
+        response = self.client.get("/products/", {"search": "OAK", "page_size": 2})
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        self.assertEqual([product["id"] for product in page["data"]], [self.sofa.pk, self.table.pk])
+        response = self.client.get(page["next"])
+        self.assertEqual([product["id"] for product in response.json()["data"]], [self.chair.pk])
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class CatalogCacheTests(TestCase):
+    """Response cache of anonymous catalog reads, invalidated by the catalog version."""
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Beds")
+        self.product = Product.objects.create(name="Bed", price=300, category=self.category)
+
+    def test_second_read_is_served_from_the_cache(self):
+        first = self.client.get("/products/")
+        self.assertEqual(first["X-Cache"], "MISS")
+        with self.assertNumQueries(0):
+            second = self.client.get("/products/")
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(second.content, first.content)
+
+    def test_hits_and_misses_are_counted_per_process(self):
+        before = get_catalog_cache_stats()
+        self.client.get("/products/")
+        self.client.get("/products/")
+        stats = get_catalog_cache_stats()
+        self.assertEqual(stats["hits"], before["hits"] + 1)
+        self.assertEqual(stats["misses"], before["misses"] + 1)
+        self.assertEqual(cache.get("catalog:hits"), None)
+
+    def test_parameter_order_and_empty_values_share_an_entry(self):
+        self.client.get("/products/?color=red&best_seller=true&name=")
+        response = self.client.get("/products/?best_seller=true&color=red")
+        self.assertEqual(response["X-Cache"], "HIT")
+
+    def test_hosts_do_not_share_entries(self):
+        # The next link of the page is an absolute URL
+        Product.objects.create(name="Bunk bed", price=400, category=self.category)
+        self.client.get("/products/?page_size=1", HTTP_HOST="shop.example.com")
+        response = self.client.get("/products/?page_size=1", HTTP_HOST="admin.example.com")
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertIn(b"admin.example.com", response.content)
+        self.assertNotIn(b"shop.example.com", response.content)
+
+    def test_committed_change_invalidates(self):
+        self.client.get("/products/")
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="Bunk bed", price=400, category=self.category)
+        self.assertGreater(get_catalog_version(), version)
+        response = self.client.get("/products/")
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(len(response.json()["data"]), 2)
+
+    def test_version_is_bumped_on_commit_only(self):
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.product.price = 320
+            self.product.save()
+            self.assertEqual(get_catalog_version(), version)
+        for callback in callbacks:
+            callback()
+        self.assertGreater(get_catalog_version(), version)
+
+    def test_products_by_category_are_cached(self):
+        Product.objects.create(name="Old bed", price=90, category=self.category, is_active=False)
+        url = f"/category/{self.category.pk}/products/"
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first["X-Cache"], "MISS")
+        self.assertEqual([product["name"] for product in first.json()["data"]["products"]], ["Bed"])
+        with self.assertNumQueries(0):
+            second = self.client.get(url)
+        self.assertEqual(second["X-Cache"], "HIT")
+        self.assertEqual(second.content, first.content)
+
+    def test_authenticated_reads_are_not_cached(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username="staff", password="pass"))
+        client.get("/categories/")
+        response = client.get("/categories/")
+        self.assertNotIn("X-Cache", response)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ConditionalCatalogResponseTests(TestCase):
+    """ETag and Last-Modified validators of catalog reads."""
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Desks")
+        self.product = Product.objects.create(name="Desk", price=250, category=self.category)
+
+    def test_validators_are_sent(self):
+        for url in ["/products/", f"/products/{self.product.pk}/", "/categories/", f"/categories/{self.category.pk}/"]:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response["ETag"].startswith('W/"'))
+                self.assertIn("Last-Modified", response)
+                self.assertIn("no-cache", response["Cache-Control"])
+
+    def test_matching_etag_is_not_modified_without_queries(self):
+        etag = self.client.get("/products/")["ETag"]
+        with self.assertNumQueries(0):
+            response = self.client.get("/products/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["ETag"], etag)
+
+    def test_matching_last_modified_is_not_modified(self):
+        last_modified = self.client.get("/categories/")["Last-Modified"]
+        response = self.client.get("/categories/", HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_the_catalog_and_the_request(self):
+        etag = self.client.get("/products/")["ETag"]
+        self.assertNotEqual(self.client.get("/products/?color=red")["ETag"], etag)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.price = 260
+            self.product.save()
+        response = self.client.get("/products/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_authenticated_users_get_their_own_etag(self):
+        etag = self.client.get("/products/")["ETag"]
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username="staff", password="pass"))
+        response = client.get("/products/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("private", response["Cache-Control"])
+
+
+def run_concurrently(function, count):
+    """Call `function(index)` from `count` threads started together, returning the results in order."""
+    barrier = threading.Barrier(count)
+
+    def call(index):
+        try:
+            barrier.wait()
+            return function(index)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(count) as executor:
+        return list(executor.map(call, range(count)))
+
+
+class SkuAllocationTests(TransactionTestCase):
+    """SKUs are drawn from reserved blocks of numbers, unique without checking the products."""
+
+    def test_sku_format(self):
+        skus = reserve_skus(50)
+        self.assertEqual(len(set(skus)), 50)
+        for sku in skus:
+            self.assertRegex(sku, r"^[A-Z0-9]{12}$")
+
+    def test_reserved_numbers_never_overlap(self):
+        first = reserve_sku_numbers(10)
+        second = reserve_sku_numbers(10)
+        self.assertEqual(len(set(first) | set(second)), 20)
+        self.assertEqual(reserve_sku_numbers(0), [])
+
+    def test_threads_share_the_blocks_of_their_allocator(self):
+        allocator = SkuAllocator(block_size=10)
+        with mock.patch("products.sku.reserve_sku_numbers", wraps=reserve_sku_numbers) as reserve:
+            skus = run_concurrently(lambda index: [allocator.allocate() for _ in range(5)], 8)
+        skus = [sku for thread_skus in skus for sku in thread_skus]
+        self.assertEqual(len(set(skus)), 40)
+        self.assertEqual(reserve.call_count, 4)
+
+    def test_allocators_of_other_processes_do_not_collide(self):
+        allocators = [SkuAllocator(block_size=3) for _ in range(3)]
+        skus = [allocator.allocate() for _ in range(7) for allocator in allocators]
+        self.assertEqual(len(set(skus)), len(skus))
+
+    def test_forked_process_reserves_its_own_block(self):
+        allocator = SkuAllocator(block_size=10)
+        allocator.allocate()
+        parent_block = {encode_sku(number) for number in allocator.numbers}
+        with mock.patch("products.sku.os.getpid", return_value=-1):
+            child = allocator.allocate()
+        self.assertNotIn(child, parent_block)
+
+    def test_products_get_distinct_skus(self):
+        category = Category.objects.create(name="Shelves")
+        products = [Product.objects.create(name=f"Shelf {i}", price=80, category=category) for i in range(5)]
+        self.assertEqual(len({product.sku for product in products}), 5)
+
+
+class SlugAllocationTests(TransactionTestCase):
+    """Product slugs get the next suffix of their base slug counter."""
+
+    def setUp(self):
+        self.category = Category.objects.create(name="Tables")
+
+    def create(self, name, **fields):
+        return Product.objects.create(name=name, price=150, category=self.category, **fields)
+
+    def test_duplicate_names_get_increasing_suffixes(self):
+        slugs = [self.create(name).slug for name in ["Oak table", "Oak table!", "Oak  table"]]
+        self.assertEqual(slugs, ["Oak-table", "Oak-table-1", "Oak-table-2"])
+        self.assertEqual(SlugCounter.objects.get(base_slug="Oak-table").next_suffix, 3)
+
+    def test_counter_starts_after_existing_suffixes(self):
+        Product.objects.bulk_create(
+            Product(name=name, slug=slug, sku=f"OLD{i}", price=150, category=self.category)
+            for i, (name, slug) in enumerate([("Desk", "Desk"), ("Desk 7", "Desk-7"), ("Desk top", "Desk-top-9")])
+        )
+        self.assertEqual(self.create("Desk!").slug, "Desk-8")
+
+    def test_slugs_set_by_hand_are_skipped(self):
+        self.create("Bench")
+        self.create("Bench 1", slug="Bench-1")
+        self.create("Bench 2", slug="Bench-2")
+        self.assertEqual(self.create("Bench!").slug, "Bench-3")
+
+    def test_base_slug_taken_by_hand(self):
+        self.create("Stool top", slug="Stool")
+        self.assertEqual(self.create("Stool").slug, "Stool-1")
+
+    def test_stored_counters_are_continued(self):
+        store_slug_counters({"Sideboard": 5})
+        self.create("Sideboard", slug="Sideboard")
+        self.assertEqual(self.create("Sideboard!").slug, "Sideboard-5")
+
+    @skipUnlessDBFeature("has_select_for_update")
+    def test_concurrent_allocations_are_distinct(self):
+        slugs = run_concurrently(lambda index: allocate_slug("Cabinet"), 8)
+        self.assertEqual(sorted(slugs), sorted(["Cabinet"] + [f"Cabinet-{i}" for i in range(1, 8)]))
+
+
+def image_bytes(size=(800, 600), image_format="JPEG", mode="RGB", color="red", exif=None):
+    buffer = io.BytesIO()
+    image = Image.new(mode, size, color)
+    if exif is not None:
+        image.save(buffer, image_format, exif=exif)
+    else:
+        image.save(buffer, image_format)
+    return buffer.getvalue()
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class ImageVariantTests(TestCase):
+    """Resized WebP and JPEG variants of product images and category icons."""
+
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.create(name="Armchairs")
+        self.product = Product.objects.create(name="Armchair", price=500, category=self.category)
+
+    def add_image(self, content, name="photo.jpg"):
+        return ProductImage.objects.create(product=self.product, image=SimpleUploadedFile(name, content))
+
+    def open_variant(self, name):
+        return Image.open(ProductImage._meta.get_field("image").storage.open(name))
+
+    def test_variants_of_every_format_and_width(self):
+        image = self.add_image(image_bytes((2000, 1000)))
+        variants = render_variants(image.image, PRODUCT_IMAGE_WIDTHS)
+        self.assertEqual(variants["source"], image.image.name)
+        for extension, image_format in [("webp", "WEBP"), ("jpeg", "JPEG")]:
+            self.assertEqual(list(variants[extension]), ["320", "640", "1024", "1600"])
+            for width, name in variants[extension].items():
+                with self.subTest(extension=extension, width=width), self.open_variant(name) as variant:
+                    self.assertEqual(variant.format, image_format)
+                    self.assertEqual(variant.size, (int(width), int(width) // 2))
+
+    def test_small_originals_are_not_enlarged(self):
+        image = self.add_image(image_bytes((500, 500)))
+        variants = render_variants(image.image, PRODUCT_IMAGE_WIDTHS)
+        self.assertEqual(list(variants["webp"]), ["320", "500"])
+
+    def test_exif_orientation_is_applied(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Rotated 90 degrees
+        image = self.add_image(image_bytes((400, 200), exif=exif))
+        variants = render_variants(image.image, (320,))
+        with self.open_variant(variants["jpeg"]["200"]) as variant:
+            self.assertEqual(variant.size, (200, 400))
+
+    def test_transparency_is_flattened_on_white_for_jpeg(self):
+        image = self.add_image(image_bytes((400, 400), "PNG", "RGBA", (0, 0, 0, 0)), "icon.png")
+        variants = render_variants(image.image, (320,))
+        with self.open_variant(variants["jpeg"]["320"]) as variant:
+            self.assertEqual(variant.convert("RGB").getpixel((10, 10)), (255, 255, 255))
+        with self.open_variant(variants["webp"]["320"]) as variant:
+            self.assertEqual(variant.mode, "RGBA")
+
+    def test_variant_names_follow_their_contents(self):
+        image = self.add_image(image_bytes())
+        first = render_variants(image.image, (320,))
+        self.assertEqual(render_variants(image.image, (320,)), first)
+        with mock.patch.dict(VARIANT_FORMATS, {"jpeg": ("JPEG", {"quality": 20})}):
+            second = render_variants(image.image, (320,))
+        self.assertNotEqual(second["jpeg"]["320"], first["jpeg"]["320"])
+        self.assertEqual(second["webp"]["320"], first["webp"]["320"])
+
+    def test_saving_an_image_queues_its_variants(self):
+        image = self.add_image(image_bytes())
+        task = Task.objects.get(name="products.render_image_variants")
+        self.assertEqual(task.payload, {"image_id": image.pk})
+
+    def test_images_of_the_same_file_share_variants(self):
+        content = image_bytes()
+        first, second = self.add_image(content), self.add_image(content)
+        self.assertEqual(first.image.name, second.image.name)
+        with mock.patch("products.images.render_variants", wraps=render_variants) as render:
+            create_product_image_variants(first.pk)
+            create_product_image_variants(second.pk)
+        self.assertEqual(render.call_count, 1)
+        first.refresh_from_db()
+        second.refresh_from_db()
+        self.assertEqual(first.variants, second.variants)
+
+    def test_srcset_is_empty_until_rendered(self):
+        image = self.add_image(image_bytes())
+        url = f"/products/{self.product.pk}/"
+        self.assertEqual(self.client.get(url).json()["data"]["images"][0]["srcset"], {})
+        create_product_image_variants(image.pk)
+        srcset = self.client.get(url).json()["data"]["images"][0]["srcset"]
+        self.assertEqual(set(srcset), {"webp", "jpeg"})
+        self.assertTrue(srcset["webp"]["320"].startswith("http://testserver/"))
+
+    def test_category_icon_variants(self):
+        self.category.icon = SimpleUploadedFile("icon.png", image_bytes((300, 300), "PNG"))
+        self.category.save()
+        create_category_icon_variants(self.category.pk)
+        self.category.refresh_from_db()
+        self.assertEqual(list(self.category.icon_variants["webp"]), ["64", "128", "256"])
+
+
+class InterruptedStream:
+    """Request body whose connection drops after `size` bytes."""
+
+    def __init__(self, data, size):
+        self.stream = io.BytesIO(data[:size])
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        if not data:
+            raise UnreadablePostError("Connection reset.")
+        return data
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    CHUNKED_UPLOAD_DIR=tempfile.mkdtemp(),
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class VideoUploadTests(TestCase):
+    """Resumable chunked uploads of product videos."""
+
+    video = bytes(range(256)) * 40
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="staff", password="pass"))
+        category = Category.objects.create(name="Wardrobes")
+        self.product = Product.objects.create(name="Wardrobe", price=900, category=category)
+        response = self.client.post(
+            f"/products/{self.product.pk}/video_upload/",
+            {"filename": "tour.mp4", "size": len(self.video)},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response["Upload-Offset"], "0")
+        self.url = response["Location"]
+        self.upload = VideoUpload.objects.get()
+
+    def send(self, offset, chunk, checksum=None):
+        headers = {"HTTP_UPLOAD_OFFSET": str(offset)}
+        if checksum:
+            headers["HTTP_UPLOAD_CHECKSUM"] = checksum
+        return self.client.patch(self.url, chunk, content_type="application/offset+octet-stream", **headers)
+
+    def offset(self):
+        return int(self.client.get(self.url)["Upload-Offset"])
+
+    def stored_video(self):
+        self.upload.refresh_from_db()
+        with Product._meta.get_field("product_video").storage.open(self.upload.video, "rb") as file:
+            return file.read()
+
+    def test_chunks_complete_the_upload(self):
+        for offset in range(0, len(self.video), 4096):
+            response = self.send(offset, self.video[offset:offset + 4096])
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(int(response["Upload-Offset"]), min(offset + 4096, len(self.video)))
+        self.assertTrue(response.json()["data"]["complete"])
+        self.assertEqual(self.stored_video(), self.video)
+        self.assertFalse(os.path.exists(part_path(self.upload)))
+        task = Task.objects.get(name="products.attach_video")
+        self.assertEqual(task.payload, {"product_id": self.product.pk, "name": self.upload.video})
+        self.assertTrue(run_task(claim_tasks("test", 1)[0]))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.product_video.name, self.upload.video)
+
+    def test_upload_resumes_after_a_dropped_connection(self):
+        offset = append_chunk(self.upload, InterruptedStream(self.video, 3000), 0, 5000)
+        self.assertEqual(offset, 3000)
+        self.assertEqual(self.offset(), 3000)
+        response = self.send(3000, self.video[3000:])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stored_video(), self.video)
+
+    def test_wrong_offset_is_a_conflict(self):
+        self.send(0, self.video[:100])
+        response = self.send(50, self.video[50:150])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response["Upload-Offset"], "100")
+        self.assertEqual(self.offset(), 100)
+
+    def test_checksum_mismatch_discards_the_chunk(self):
+        chunk = self.video[:100]
+        wrong = base64.b64encode(hashlib.sha256(b"other").digest()).decode()
+        response = self.send(0, chunk, f"sha256 {wrong}")
+        self.assertEqual(response.status_code, 460)
+        self.assertEqual(self.offset(), 0)
+        right = base64.b64encode(hashlib.sha256(chunk).digest()).decode()
+        self.assertEqual(self.send(0, chunk, f"sha256 {right}").status_code, 200)
+        self.assertEqual(self.offset(), 100)
+        self.assertEqual(self.send(100, chunk, "crc32 AAAA").status_code, 400)
+
+    def test_chunks_past_the_end_or_too_large_are_refused(self):
+        self.assertEqual(self.send(0, self.video + b"x").status_code, 400)
+        with mock.patch("products.uploads.MAX_CHUNK_SIZE", 10):
+            self.assertEqual(self.send(0, self.video[:11]).status_code, 413)
+        self.assertEqual(self.offset(), 0)
+
+    def test_concurrent_chunk_is_locked_out(self):
+        os.makedirs(os.path.dirname(part_path(self.upload)), exist_ok=True)
+        with open(part_path(self.upload), "ab") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            response = self.send(0, self.video[:100])
+        self.assertEqual(response.status_code, 423)
+
+    def test_cancelled_upload_is_deleted(self):
+        self.send(0, self.video[:100])
+        self.assertEqual(self.client.delete(self.url).status_code, 204)
+        self.assertFalse(VideoUpload.objects.exists())
+        self.assertFalse(os.path.exists(part_path(self.upload)))
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), MEDIA_SENDFILE_HEADER="")
+class MediaRangeTests(TestCase):
+    """Media files served with byte ranges and validators."""
+
+    content = bytes(range(256)) * 4
+
+    def setUp(self):
+        self.name = default_storage.save("videos/clip.mp4", ContentFile(self.content))
+        self.url = f"/media/{self.name}"
+
+    def get(self, **headers):
+        response = self.client.get(self.url, **headers)
+        body = b"".join(response.streaming_content) if response.streaming else response.content
+        return response, body
+
+    def test_whole_file(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+        self.assertEqual(response["Content-Length"], str(len(self.content)))
+        self.assertEqual(response["Content-Type"], "video/mp4")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+
+    def test_cache_control(self):
+        self.assertEqual(self.get()[0]["Cache-Control"], "public, max-age=300")
+        immutable = f"public, max-age={365 * 24 * 60 * 60}, immutable"
+        for name in [
+            f"{BLOB_DIR}/ab/cd/{'ab' * 32}.jpg",
+            f"{BLOB_DIR}/ab/cd/variants/{'ab' * 32}-320w-0123456789ab.webp",
+            "category_icons/variants/sofa-64w-0123456789ab.png",
+        ]:
+            with self.subTest(name):
+                default_storage.save(name, ContentFile(self.content))
+                response = self.client.get(f"/media/{name}")
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response["Cache-Control"], immutable)
+        icon = default_storage.save("category_icons/sofa.png", ContentFile(self.content))
+        self.assertEqual(self.client.get(f"/media/{icon}")["Cache-Control"], "public, max-age=300")
+
+    def test_partial_content(self):
+        cases = {
+            "bytes=0-99": (0, 99),
+            "bytes=1000-": (1000, 1023),
+            "bytes=-24": (1000, 1023),
+            "bytes=1000-5000": (1000, 1023),
+        }
+        for header, (start, end) in cases.items():
+            with self.subTest(header):
+                response, body = self.get(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(body, self.content[start:end + 1])
+                self.assertEqual(response["Content-Range"], f"bytes {start}-{end}/1024")
+                self.assertEqual(response["Content-Length"], str(end - start + 1))
+
+    def test_unsatisfiable_range(self):
+        for header in ["bytes=1024-", "bytes=5000-6000", "bytes=-0"]:
+            with self.subTest(header):
+                response, _ = self.get(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 416)
+                self.assertEqual(response["Content-Range"], "bytes */1024")
+
+    def test_ignored_ranges_send_the_whole_file(self):
+        for header in ["bytes=0-1,5-9", "items=0-10", "bytes=50-10"]:
+            with self.subTest(header):
+                response, body = self.get(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(body, self.content)
+
+    def test_if_range(self):
+        etag = self.get()[0]["ETag"]
+        response, _ = self.get(HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, 206)
+        response, body = self.get(HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.content)
+
+    def test_head_and_not_modified(self):
+        response = self.client.head(self.url, HTTP_RANGE="bytes=0-9")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, b"")
+        self.assertEqual(response["Content-Length"], "10")
+        etag = response["ETag"]
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag)[0].status_code, 304)
+
+    def test_missing_files_and_directories(self):
+        for path in ["videos/missing.mp4", "videos/", "../settings.py"]:
+            with self.subTest(path):
+                self.assertEqual(self.client.get(f"/media/{path}").status_code, 404)
+
+    @override_settings(MEDIA_SENDFILE_HEADER="X-Accel-Redirect", MEDIA_ACCEL_REDIRECT_PREFIX="/protected/")
+    def test_accel_redirect_path_is_quoted(self):
+        name = default_storage.save("videos/tour 100%?.mp4", ContentFile(b"video"))
+        response = self.client.get(f"/media/{quote(name)}")
+        self.assertEqual(response["X-Accel-Redirect"], "/protected/videos/tour%20100%25%3F.mp4")
+        self.assertEqual(response.content, b"")
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImageBlobTests(TestCase):
+    """Product images stored once per content, with counted references and garbage collection."""
+
+    def setUp(self):
+        category = Category.objects.create(name="Dressers")
+        self.product = Product.objects.create(name="Dresser", price=700, category=category)
+
+    def add_image(self, content, name="photo.jpg"):
+        return ProductImage.objects.create(product=self.product, image=SimpleUploadedFile(name, content))
+
+    def blob(self, name):
+        return ImageBlob.objects.get(name=name)
+
+    def test_blobs_are_named_after_content_and_format(self):
+        content = image_bytes((64, 64), "PNG")
+        image = self.add_image(content, "photo.html")
+        digest = hashlib.sha256(content).hexdigest()
+        self.assertTrue(image.image.name.startswith(f"{BLOB_DIR}/{digest[:2]}/{digest[2:4]}/{digest}"))
+        self.assertTrue(image.image.name.endswith(".png"))
+        self.assertTrue(self.add_image(b"<script></script>", "photo.jpg").image.name.endswith(".bin"))
+
+    def test_identical_images_share_one_blob(self):
+        content = image_bytes()
+        first, second = self.add_image(content), self.add_image(content, "copy.jpg")
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(self.blob(first.image.name).ref_count, 2)
+        self.assertEqual(self.blob(first.image.name).size, len(content))
+        folder, filename = os.path.split(blob_storage.path(first.image.name))
+        self.assertEqual([name for name in os.listdir(folder) if name != "variants"], [filename])
+        # No temporary file is left behind by the second upload
+        self.assertEqual(
+            [name for name in os.listdir(blob_storage.path(BLOB_DIR)) if name.endswith(".part")], []
+        )
+
+    def test_replacing_an_image_moves_its_reference(self):
+        image = self.add_image(image_bytes(color="red"))
+        old = image.image.name
+        image = ProductImage.objects.get(pk=image.pk)
+        image.image = SimpleUploadedFile("new.jpg", image_bytes(color="blue"))
+        image.save()
+        self.assertEqual(self.blob(old).ref_count, 0)
+        self.assertEqual(self.blob(image.image.name).ref_count, 1)
+
+    def test_garbage_collection(self):
+        content = image_bytes()
+        first, second = self.add_image(content), self.add_image(content)
+        name = first.image.name
+        create_product_image_variants(first.pk, refresh=False)
+        first.refresh_from_db()
+        variant = first.variants["webp"]["320"]
+
+        first.delete()
+        self.assertEqual(collect_garbage(grace_period=datetime.timedelta(0)), (0, 0))
+        second.delete()
+        self.assertEqual(self.blob(name).ref_count, 0)
+        # Blobs stored within the grace period may still be waiting for their image
+        self.assertEqual(collect_garbage(), (0, 0))
+        self.assertEqual(collect_garbage(grace_period=datetime.timedelta(0)), (1, len(content)))
+        self.assertFalse(blob_storage.exists(name))
+        self.assertFalse(blob_storage.exists(variant))
+        self.assertFalse(ImageBlob.objects.filter(name=name).exists())
+
+    def test_recount_repairs_counts(self):
+        image = self.add_image(image_bytes())
+        ImageBlob.objects.update(ref_count=5)
+        self.assertEqual(recount_references(), 1)
+        self.assertEqual(self.blob(image.image.name).ref_count, 1)
+        self.assertEqual(recount_references(), 0)
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class AddImagesTests(TestCase):
+    """Images uploaded in one request are checked together, stored as blobs and attached by a task."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="staff", password="pass"))
+        category = Category.objects.create(name="Mirrors")
+        self.product = Product.objects.create(name="Mirror", price=120, category=category)
+        self.url = f"/products/{self.product.pk}/add_images/"
+
+    def upload(self, *files):
+        return self.client.post(self.url, {"images": list(files)}, format="multipart")
+
+    def test_images_are_attached_by_the_task(self):
+        red, blue = image_bytes(color="red"), image_bytes(color="blue")
+        response = self.upload(
+            SimpleUploadedFile("a.jpg", red), SimpleUploadedFile("b.jpg", blue), SimpleUploadedFile("c.jpg", red)
+        )
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(response.json()["data"]["image_paths"]), 3)
+        self.assertFalse(self.product.images.exists())
+
+        task = Task.objects.get(name="products.attach_images")
+        self.assertTrue(run_task(claim_tasks("test", 1)[0]))
+        # The same photo twice is attached once
+        names = set(self.product.images.values_list("image", flat=True))
+        self.assertEqual(names, set(task.payload["names"]))
+        self.assertEqual(len(names), 2)
+        self.assertEqual(set(ImageBlob.objects.values_list("ref_count", flat=True)), {1})
+        self.product.refresh_from_db()
+        self.assertEqual(len(self.product.document["images"]), 2)
+        self.assertTrue(all(image["srcset"] for image in self.product.document["images"]))
+
+    def test_retried_attach_skips_attached_images(self):
+        self.upload(SimpleUploadedFile("a.jpg", image_bytes()))
+        payload = Task.objects.get(name="products.attach_images").payload
+        attach_images(**payload)
+        attach_images(**payload)
+        self.assertEqual(self.product.images.count(), 1)
+        self.assertEqual(ImageBlob.objects.get().ref_count, 1)
+
+    def test_one_invalid_file_rejects_the_batch(self):
+        response = self.upload(
+            SimpleUploadedFile("a.jpg", image_bytes()),
+            SimpleUploadedFile("b.jpg", b"not an image"),
+            SimpleUploadedFile("c.gif", image_bytes(image_format="GIF")),
+        )
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()["error"]["image"]
+        self.assertEqual(
+            errors,
+            ["b.jpg: The file is not a valid image.", "c.gif: Only PNG, JPG, and JPEG images are allowed."],
+        )
+        self.assertFalse(Task.objects.filter(name="products.attach_images").exists())
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_no_images(self):
+        self.assertEqual(self.upload().status_code, 400)
+
+    def test_images_of_a_new_product_are_attached_by_the_task(self):
+        response = self.client.post(
+            "/products/",
+            {
+                "name": "Wall mirror",
+                "price": "80.00",
+                "uploaded_images": [
+                    SimpleUploadedFile("a.jpg", image_bytes(color="red")),
+                    SimpleUploadedFile("b.png", image_bytes(image_format="PNG", color="blue")),
+                ],
+            },
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 201)
+        product = Product.objects.get(name="Wall mirror")
+        self.assertFalse(product.images.exists())
+
+        while tasks := claim_tasks("test", 10):
+            for task in tasks:
+                self.assertTrue(run_task(task))
+        self.assertEqual(product.images.count(), 2)
+        self.assertFalse(Task.objects.exclude(status=Task.DONE).exists())
+        product.refresh_from_db()
+        self.assertEqual(len(product.document["images"]), 2)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class FacetCountTests(TestCase):
+    """Facet counts of the bitmap index must equal the counts of the same filters in the ORM."""
+
+    FILTERS = [
+        {},
+        {"category": 0},
+        {"color": "oak"},
+        {"color": "Wal"},
+        {"price_min": decimal.Decimal("1000"), "price_max": decimal.Decimal("9999.99")},
+        {"price_min": decimal.Decimal("25000")},
+        {"best_seller": True},
+        {"best_seller": False, "category": 1},
+        {"search": "rustic"},
+        {"search": "rustic", "color": "white", "price_max": decimal.Decimal("5000")},
+        {"category": 2, "color": "oak", "price_min": decimal.Decimal("2500"), "best_seller": True},
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        # The counter rows the numbers left in the allocator came from were
+        # rolled back with an earlier test, they would be reserved again
+        sku_allocator.numbers.clear()
+        random = Random(20)
+        cls.categories = [Category.objects.create(name=f"Room {i}") for i in range(4)]
+        for i in range(150):
+            Product.objects.create(
+                name=f"Item {i}",
+                description=random.choice(["Rustic finish", "Modern lines", "Rustic and modern", ""]),
+                price=decimal.Decimal(random.choice([99, 1000, 1500, 2499.99, 2500, 7000, 24999, 60000])),
+                color=random.choice(["Oak", "oak", "Walnut", "White", "white oak", None, ""]),
+                wood_material=random.choice(["Beech", "beech", "Pine", None]),
+                category=random.choice(cls.categories),
+                is_active=random.random() > 0.2,
+                is_best_seller=random.random() > 0.7,
+            )
+
+    def setUp(self):
+        cache.clear()
+        facet_index.invalidate()
+
+    def resolve(self, filters):
+        if "category" in filters:
+            filters = {**filters, "category": self.categories[filters["category"]].pk}
+        return filters
+
+    def orm_queryset(self, filters, active_only, without=None):
+        queryset = Product.objects.all()
+        if active_only:
+            queryset = queryset.filter(is_active=True)
+        if filters.get("best_seller") is not None:
+            queryset = queryset.filter(is_best_seller=filters["best_seller"])
+        if filters.get("search"):
+            queryset = search_products(queryset, filters["search"])
+        if filters.get("category") is not None and without != "categories":
+            queryset = queryset.filter(category_id=filters["category"])
+        if filters.get("color") and without != "colors":
+            queryset = queryset.filter(color__icontains=filters["color"])
+        if without != "price_ranges":
+            if filters.get("price_min") is not None:
+                queryset = queryset.filter(price__gte=filters["price_min"])
+            if filters.get("price_max") is not None:
+                queryset = queryset.filter(price__lte=filters["price_max"])
+        return queryset
+
+    def orm_counts(self, queryset, field):
+        counts = queryset.exclude(**{f"{field}__isnull": True}).exclude(**{field: ""}).annotate(
+            key=Lower(field)
+        ).values("key").annotate(count=Count("id"))
+        return {row["key"]: row["count"] for row in counts}
+
+    def assertMatchesOrm(self, filters, active_only):
+        facets = facet_index.facets(filters, active_only)
+        self.assertEqual(facets["total"], self.orm_queryset(filters, active_only).count())
+
+        queryset = self.orm_queryset(filters, active_only, without="categories")
+        expected = dict(queryset.values_list("category_id").annotate(count=Count("id")))
+        self.assertEqual({item["id"]: item["count"] for item in facets["categories"]}, expected)
+
+        for facet, field in [("colors", "color"), ("wood_materials", "wood_material")]:
+            queryset = self.orm_queryset(filters, active_only, without=facet)
+            counts = {item["value"].casefold(): item["count"] for item in facets[facet]}
+            self.assertEqual(counts, self.orm_counts(queryset, field), facet)
+            self.assertEqual([item["count"] for item in facets[facet]], sorted(counts.values(), reverse=True))
+
+        queryset = self.orm_queryset(filters, active_only, without="price_ranges")
+        for bucket in facets["price_ranges"]:
+            bounded = queryset.filter(price__gte=bucket["min"])
+            if bucket["max"] is not None:
+                bounded = bounded.filter(price__lt=bucket["max"])
+            self.assertEqual(bucket["count"], bounded.count(), bucket)
+
+    def test_counts_match_the_orm(self):
+        for filters in self.FILTERS:
+            for active_only in (True, False):
+                with self.subTest(filters=filters, active_only=active_only):
+                    self.assertMatchesOrm(self.resolve(filters), active_only)
+
+    def test_spelling_variants_are_counted_together(self):
+        colors = {item["value"]: item["count"] for item in facet_index.facets({}, active_only=False)["colors"]}
+        self.assertEqual(len([value for value in colors if value.casefold() == "oak"]), 1)
+        self.assertEqual(
+            sum(count for value, count in colors.items() if value.casefold() == "oak"),
+            Product.objects.filter(color__iexact="oak").count(),
+        )
+
+    def test_index_follows_the_catalog_version(self):
+        total = facet_index.facets({}, active_only=False)["total"]
+        self.assertFalse(facet_index.is_stale())
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="Late item", price=10, category=self.categories[0])
+        self.assertTrue(facet_index.is_stale())
+
+        # The previous index answers while the new one is built in the background
+        with mock.patch.object(facet_index, "refresh") as refresh:
+            self.assertEqual(facet_index.facets({}, active_only=False)["total"], total)
+            response = self.client.get("/products/facets/")
+        self.assertEqual(refresh.call_count, 2)
+        self.assertIn("no-store", response["Cache-Control"])
+
+        facet_index.rebuild()
+        self.assertFalse(facet_index.is_stale())
+        self.assertEqual(facet_index.facets({}, active_only=False)["total"], total + 1)
+        self.assertNotIn("no-store", self.client.get("/products/facets/")["Cache-Control"])
+
+    def test_failed_rebuild_keeps_the_index(self):
+        total = facet_index.facets({}, active_only=False)["total"]
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="Late item", price=10, category=self.categories[0])
+        # As the background thread runs it, with the lock held and its own connection
+        facet_index.lock.acquire()
+        with mock.patch.object(facet_index, "build", side_effect=RuntimeError("Database is gone")):
+            with mock.patch("products.facets.connection"), self.assertLogs("products.facets", "ERROR"):
+                facet_index._rebuild()
+        self.assertTrue(facet_index.is_stale())
+        self.assertFalse(facet_index.lock.locked())
+        with mock.patch.object(facet_index, "refresh"):
+            self.assertEqual(facet_index.facets({}, active_only=False)["total"], total)
+
+    def test_endpoint(self):
+        response = self.client.get("/products/facets/", {"color": "oak", "price_min": "1000"})
+        self.assertEqual(response.status_code, 200)
+        expected = facet_index.facets({"color": "oak", "price_min": decimal.Decimal("1000")}, active_only=True)
+        self.assertEqual(response.json()["data"]["total"], expected["total"])
+        self.assertEqual(self.client.get("/products/facets/", {"price_min": "NaN"}).status_code, 400)
+
+
+@override_settings(
+    MEDIA_ROOT=tempfile.mkdtemp(),
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class ProductDocumentTests(TestCase):
+    """Stored product documents follow product, image and category changes."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.category = Category.objects.create(name="Chairs")
+        self.product = Product.objects.create(name="Armchair", price=150, category=self.category)
+
+    def document(self):
+        self.product.refresh_from_db()
+        return self.product.document
+
+    def test_product_save_rebuilds_the_document(self):
+        self.assertEqual(self.document()["name"], "Armchair")
+        self.product.name = "Rocking chair"
+        self.product.price = 180
+        self.product.save()
+        document = self.document()
+        self.assertEqual(document["name"], "Rocking chair")
+        self.assertEqual(document["price"], "180.00")
+
+    def test_image_changes_rebuild_the_document(self):
+        image = ProductImage.objects.create(
+            product=self.product, image=SimpleUploadedFile("chair.jpg", image_bytes(), content_type="image/jpeg")
+        )
+        self.assertEqual([item["id"] for item in self.document()["images"]], [image.pk])
+        image.delete()
+        self.assertEqual(self.document()["images"], [])
+
+    def test_category_rename_is_applied_by_the_task(self):
+        self.client.get("/products/")
+        version = get_catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = "Seats"
+            self.category.save()
+        # Nothing is invalidated before the documents are rebuilt
+        self.assertEqual(get_catalog_version(), version)
+        self.assertEqual(self.document()["category"]["name"], "Chairs")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertTrue(run_task(claim_tasks("test", 1)[0]))
+        self.assertEqual(self.document()["category"]["name"], "Seats")
+        self.assertGreater(get_catalog_version(), version)
+        response = self.client.get("/products/")
+        self.assertEqual(response["X-Cache"], "MISS")
+        self.assertEqual(response.json()["data"][0]["category"]["name"], "Seats")
+
+    def test_category_delete_is_applied_by_the_task(self):
+        self.category.delete()
+        self.assertTrue(run_task(claim_tasks("test", 1)[0]))
+        self.assertIsNone(self.document()["category"])
+
+    def test_missing_documents_are_built_without_storing_them(self):
+        ProductImage.objects.create(
+            product=self.product, image=SimpleUploadedFile("chair.jpg", image_bytes(), content_type="image/jpeg")
+        )
+        Product.objects.create(name="Stool", price=40, category=self.category)
+        Product.objects.update(document=None)
+
+        # The list, then the products and the images of the missing documents
+        with self.assertNumQueries(3):
+            response = self.client.get("/products/?order_by_price=max")
+        products = response.json()["data"]
+        self.assertEqual([product["name"] for product in products], ["Armchair", "Stool"])
+        self.assertTrue(products[0]["images"][0]["image"].startswith("http://testserver/media/"))
+        self.assertEqual(products[0]["category"]["name"], "Chairs")
+        self.assertFalse(Product.objects.filter(document__isnull=False).exists())
+
+
+class CheckProductDocumentsTests(TestCase):
+    """`manage.py check_product_documents` finds and rebuilds missing and outdated documents."""
+
+    def setUp(self):
+        category = Category.objects.create(name="Lamps")
+        self.products = [
+            Product.objects.create(name=f"Lamp {i}", price=30 + i, category=category) for i in range(3)
+        ]
+
+    def check(self, *args):
+        out = io.StringIO()
+        call_command("check_product_documents", *args, stdout=out)
+        return out.getvalue()
+
+    def break_documents(self):
+        """Remove the document of the first product and rename the second one in its document."""
+        Product.objects.filter(pk=self.products[0].pk).update(document=None)
+        stale = {**Product.objects.get(pk=self.products[1].pk).document, "name": "Old lamp"}
+        Product.objects.filter(pk=self.products[1].pk).update(document=stale)
+
+    def test_up_to_date(self):
+        self.assertIn("All product documents are up to date.", self.check())
+
+    def test_inconsistent_documents_fail(self):
+        self.break_documents()
+        with self.assertRaisesMessage(CommandError, "run with --fix"):
+            self.check()
+
+    def test_fix_rebuilds_them(self):
+        self.break_documents()
+        out = self.check("--fix")
+        self.assertIn("1 missing and 1 outdated documents.", out)
+        self.assertIn(f"Outdated products: {self.products[1].pk}", out)
+        self.assertIn("Rebuilt 2 documents.", out)
+        self.assertEqual(
+            list(Product.objects.order_by("pk").values_list("document__name", flat=True)),
+            ["Lamp 0", "Lamp 1", "Lamp 2"],
+        )
+        self.assertIn("All product documents are up to date.", self.check())
+
+
+@override_settings(DASHBOARD_STATS_MATERIALIZED=True)
+class CategoryStatsTests(TestCase):
+    """Materialized dashboard counts follow product and category changes."""
+
+    def setUp(self):
+        self.chairs = Category.objects.create(name="Chairs")
+        self.tables = Category.objects.create(name="Tables")
+
+    def stats(self):
+        """{category id: (products, active)} of the non-empty rows."""
+        return {
+            category_id: (products, active)
+            for category_id, products, active in CategoryStats.objects.values_list(
+                "category_id", "product_count", "active_count"
+            )
+            if products or active
+        }
+
+    def test_create(self):
+        Product.objects.create(name="Chair", price=50, category=self.chairs)
+        Product.objects.create(name="Old chair", price=20, category=self.chairs, is_active=False)
+        Product.objects.create(name="Crate", price=10)
+        self.assertEqual(self.stats(), {self.chairs.pk: (2, 1), None: (1, 1)})
+
+    def test_move_between_categories(self):
+        product = Product.objects.create(name="Stool", price=30, category=self.chairs)
+        product.category = self.tables
+        product.save()
+        self.assertEqual(self.stats(), {self.tables.pk: (1, 1)})
+        # A product loaded again moves from the category it was saved in
+        product = Product.objects.get(pk=product.pk)
+        product.category = None
+        product.save()
+        self.assertEqual(self.stats(), {None: (1, 1)})
+
+    def test_toggle_is_active(self):
+        product = Product.objects.create(name="Bench", price=80, category=self.chairs)
+        product.is_active = False
+        product.save()
+        self.assertEqual(self.stats(), {self.chairs.pk: (1, 0)})
+        product.is_active = True
+        product.save()
+        self.assertEqual(self.stats(), {self.chairs.pk: (1, 1)})
+
+    def test_unchanged_save_keeps_the_counts(self):
+        product = Product.objects.create(name="Desk chair", price=90, category=self.chairs)
+        product.price = 95
+        product.save()
+        self.assertEqual(self.stats(), {self.chairs.pk: (1, 1)})
+
+    def test_delete(self):
+        product = Product.objects.create(name="Rocker", price=120, category=self.chairs, is_active=False)
+        Product.objects.create(name="Armchair", price=150, category=self.chairs)
+        Product.objects.get(pk=product.pk).delete()
+        self.assertEqual(self.stats(), {self.chairs.pk: (1, 1)})
+
+    def test_category_delete_moves_counts_to_uncategorized(self):
+        Product.objects.create(name="Chair", price=50, category=self.chairs)
+        Product.objects.create(name="Old chair", price=20, category=self.chairs, is_active=False)
+        Product.objects.create(name="Crate", price=10)
+        category_id = self.chairs.pk
+        self.chairs.delete()
+        self.assertEqual(self.stats(), {None: (3, 2)})
+        self.assertFalse(CategoryStats.objects.filter(category_id=category_id).exists())
+
+    def test_refresh_command_matches_the_signals(self):
+        Product.objects.create(name="Chair", price=50, category=self.chairs)
+        Product.objects.create(name="Table", price=200, category=self.tables, is_active=False)
+        Product.objects.create(name="Crate", price=10)
+        expected = self.stats()
+        CategoryStats.objects.all().delete()
+        call_command("refresh_dashboard_stats", stdout=io.StringIO())
+        self.assertEqual(self.stats(), expected)
+
+    def test_dashboard_matches_the_live_query(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(username="staff", password="pass"))
+        Product.objects.create(name="Chair", price=50, category=self.chairs)
+        stool = Product.objects.create(name="Stool", price=30, category=self.chairs)
+        Product.objects.create(name="Table", price=200, category=self.tables, is_active=False)
+        Product.objects.create(name="Crate", price=10)
+        stool.category = self.tables
+        stool.is_active = False
+        stool.save()
+        Category.objects.create(name="Lamps")
+        self.chairs.delete()
+
+        materialized = client.get("/dashboard-stats/")
+        self.assertEqual(materialized.status_code, 200)
+        with self.settings(DASHBOARD_STATS_MATERIALIZED=False):
+            live = client.get("/dashboard-stats/")
+        self.assertEqual(materialized.json(), live.json())
+        self.assertEqual(live.json()["data"]["total_products"], 4)
+        self.assertEqual(live.json()["data"]["active_products"], 2)
+
+
+class TaskQueueTests(TestCase):
+    """Claiming, retrying and pruning tasks of the database task queue."""
+
+    def setUp(self):
+        self.calls = []
+        registry = {"tests.record": self.record, "tests.fail": self.fail_task}
+        patcher = mock.patch.dict("products.tasks._registry", registry)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def record(self, **payload):
+        self.calls.append(payload)
+
+    def fail_task(self, **payload):
+        raise RuntimeError("Task failed")
+
+    def make_due(self, task):
+        Task.objects.filter(pk=task.pk).update(run_at=timezone.now())
+
+    def test_unknown_tasks_are_refused(self):
+        with self.assertRaises(LookupError):
+            enqueue("tests.missing")
+
+    def test_claim(self):
+        first = enqueue("tests.record", {"n": 1})
+        second = enqueue("tests.record", {"n": 2})
+        enqueue("tests.record", {"n": 3}, delay=60)
+        claimed = claim_tasks("worker-a", 10)
+        self.assertEqual([task.pk for task in claimed], [first.pk, second.pk])
+        for task in Task.objects.filter(pk__in=[first.pk, second.pk]):
+            self.assertEqual(task.status, Task.RUNNING)
+            self.assertEqual(task.attempts, 1)
+            self.assertEqual(task.locked_by, "worker-a")
+        # Claimed tasks are hidden from other workers, the delayed one is not due
+        self.assertEqual(claim_tasks("worker-b", 10), [])
+
+        self.assertTrue(run_task(claimed[0]))
+        task = Task.objects.get(pk=first.pk)
+        self.assertEqual(task.status, Task.DONE)
+        self.assertIsNotNone(task.finished_at)
+        self.assertEqual(self.calls, [{"n": 1}])
+
+    def test_claim_limit(self):
+        for n in range(3):
+            enqueue("tests.record", {"n": n})
+        self.assertEqual(len(claim_tasks("worker-a", 2)), 2)
+        self.assertEqual(len(claim_tasks("worker-b", 2)), 1)
+
+    def test_retry_with_backoff(self):
+        task = enqueue("tests.fail", max_attempts=3)
+        for attempt, delay in [(1, TASK_RETRY_DELAY), (2, TASK_RETRY_DELAY * 2)]:
+            claimed = claim_tasks("worker-a", 1)[0]
+            self.assertEqual(claimed.attempts, attempt)
+            before = timezone.now()
+            with self.assertLogs("products.tasks", "ERROR"):
+                self.assertFalse(run_task(claimed))
+            task.refresh_from_db()
+            self.assertEqual(task.status, Task.QUEUED)
+            self.assertIn("RuntimeError: Task failed", task.last_error)
+            self.assertGreaterEqual(task.run_at, before + datetime.timedelta(seconds=delay))
+            self.assertLessEqual(task.run_at, timezone.now() + datetime.timedelta(seconds=delay))
+            # Not due before its retry delay
+            self.assertEqual(claim_tasks("worker-a", 1), [])
+            self.make_due(task)
+
+    def test_failed_after_max_attempts(self):
+        task = enqueue("tests.fail", max_attempts=2)
+        for _ in range(2):
+            with self.assertLogs("products.tasks", "ERROR"):
+                run_task(claim_tasks("worker-a", 1)[0])
+            self.make_due(task)
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.FAILED)
+        self.assertEqual(task.attempts, 2)
+        self.assertIsNotNone(task.finished_at)
+        self.assertEqual(claim_tasks("worker-a", 1), [])
+
+    def test_expired_claim_is_claimed_again(self):
+        task = enqueue("tests.record", {"n": 1})
+        lost = claim_tasks("worker-a", 1, visibility_timeout=0)[0]
+        reclaimed = claim_tasks("worker-b", 1)[0]
+        self.assertEqual(reclaimed.pk, task.pk)
+        self.assertEqual(reclaimed.attempts, 2)
+
+        # The late end of the first attempt leaves the new claim alone
+        self.assertTrue(run_task(lost))
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.RUNNING)
+        self.assertEqual(task.locked_by, "worker-b")
+
+        self.assertTrue(run_task(reclaimed))
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.DONE)
+
+    def test_expired_last_attempt_fails(self):
+        task = enqueue("tests.record", max_attempts=1)
+        claim_tasks("worker-a", 1, visibility_timeout=0)
+        self.assertEqual(claim_tasks("worker-b", 1), [])
+        task.refresh_from_db()
+        self.assertEqual(task.status, Task.FAILED)
+        self.assertEqual(task.last_error, "Visibility timeout expired on the last attempt.")
+
+    def test_prune(self):
+        old, recent, failed = (enqueue("tests.record") for _ in range(3))
+        long_ago = timezone.now() - TASK_RETENTION - datetime.timedelta(minutes=1)
+        Task.objects.filter(pk=old.pk).update(status=Task.DONE, finished_at=long_ago)
+        Task.objects.filter(pk=recent.pk).update(status=Task.DONE, finished_at=timezone.now())
+        Task.objects.filter(pk=failed.pk).update(status=Task.FAILED, finished_at=long_ago)
+        self.assertEqual(prune_tasks(), 1)
+        self.assertEqual(set(Task.objects.values_list("pk", flat=True)), {recent.pk, failed.pk})
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ProductExportTests(TestCase):
+    """Streaming NDJSON and CSV export of the catalog."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_user(username="staff", password="pass"))
+        category = Category.objects.create(name="Beds")
+        self.bed = Product.objects.create(name="Bed, double", price=400, color="oak", category=category)
+        self.image = ProductImage.objects.create(
+            product=self.bed, image=SimpleUploadedFile("bed.jpg", image_bytes(), content_type="image/jpeg")
+        )
+        self.crate = Product.objects.create(name="Crate", price=10, is_active=False)
+
+    def export(self, query=""):
+        response = self.client.get(f"/products/export/{query}")
+        self.assertEqual(response.status_code, 200)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_ndjson(self):
+        response, content = self.export()
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertRegex(response["Content-Disposition"], r'^attachment; filename="products-\d{14}\.ndjson"$')
+        records = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([record["id"] for record in records], [self.bed.pk, self.crate.pk])
+        self.assertEqual(list(records[0]), EXPORT_FIELDS)
+        self.assertEqual(records[0]["category"], "Beds")
+        self.assertEqual(records[0]["images"], [f"http://testserver{self.image.image.url}"])
+        self.assertEqual(records[0]["price"], "400.00")
+        self.assertIsNone(records[1]["category"])
+        self.assertFalse(records[1]["is_active"])
+
+    def test_csv(self):
+        response, content = self.export("?output=csv")
+        self.assertEqual(response["Content-Type"], "text/csv; charset=utf-8")
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(list(rows[0]), EXPORT_FIELDS)
+        self.assertEqual(rows[0]["name"], "Bed, double")
+        self.assertEqual(rows[0]["category"], "Beds")
+        self.assertEqual(rows[0]["images"], f"http://testserver{self.image.image.url}")
+        self.assertEqual(rows[1]["category"], "")
+        self.assertEqual(rows[1]["images"], "")
+
+    def test_products_without_a_stored_document(self):
+        expected = self.export()[1]
+        Product.objects.update(document=None)
+        self.assertEqual(self.export()[1], expected)
+        self.assertFalse(Product.objects.filter(document__isnull=False).exists())
+
+    def test_updated_since(self):
+        Product.objects.filter(pk=self.crate.pk).update(updated_at=timezone.now() - datetime.timedelta(days=3))
+        since = (timezone.now() - datetime.timedelta(days=1)).date().isoformat()
+        content = self.export(f"?updated_since={since}")[1]
+        self.assertEqual([json.loads(line)["id"] for line in content.splitlines()], [self.bed.pk])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get("/products/export/?output=xml").status_code, 400)
+        self.assertEqual(self.client.get("/products/export/?updated_since=yesterday").status_code, 400)
+
+    def test_anonymous_users_are_rejected(self):
+        response = APIClient().get("/products/export/")
+        self.assertIn(response.status_code, (401, 403))
+
+
+class ImportProductsTests(TestCase):
+    """`manage.py import_products` validates every row, then bulk inserts the valid ones."""
+
+    def setUp(self):
+        self.category = Category.objects.create(name="Tables")
+        self.existing = Product.objects.create(name="Oak table", price=300, category=self.category)
+        self.directory = tempfile.mkdtemp()
+
+    def write(self, rows, file_format="ndjson"):
+        path = os.path.join(self.directory, f"products.{file_format}")
+        with open(path, "w", encoding="utf-8", newline="") as file:
+            if file_format == "csv":
+                writer = csv.DictWriter(file, fieldnames=sorted({key for row in rows for key in row}))
+                writer.writeheader()
+                writer.writerows(rows)
+            elif file_format == "json":
+                json.dump(rows, file)
+            else:
+                file.writelines(json.dumps(row) + "\n" for row in rows)
+        return path
+
+    def run_import(self, rows, *args, file_format="ndjson"):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command("import_products", self.write(rows, file_format), *args, stdout=stdout, stderr=stderr)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def imported(self):
+        return Product.objects.exclude(pk=self.existing.pk).order_by("pk")
+
+    def test_formats(self):
+        for file_format in ["csv", "json", "ndjson"]:
+            with self.subTest(file_format):
+                row = {
+                    "name": f"Pine table {file_format}",
+                    "price": "120.50",
+                    "category": "Tables",
+                    "is_best_seller": "yes",
+                    "stock": "4",
+                }
+                self.run_import([row], file_format=file_format)
+                product = Product.objects.get(name=f"Pine table {file_format}")
+                self.assertEqual(product.price, decimal.Decimal("120.50"))
+                self.assertEqual(product.category, self.category)
+                self.assertTrue(product.is_best_seller)
+                self.assertEqual(product.stock, 4)
+
+    def test_duplicate_names_are_invalid(self):
+        rows = [
+            {"name": "Oak table", "price": 100},
+            {"name": "Walnut table", "price": 200},
+            {"name": "Walnut table", "price": 210},
+        ]
+        with self.assertRaisesMessage(CommandError, "2 invalid rows, nothing was imported."):
+            self.run_import(rows)
+        self.assertFalse(self.imported().exists())
+
+    def test_invalid_rows_are_reported_and_skipped(self):
+        rows = [
+            {"name": "Walnut table", "price": 200, "category_id": self.category.pk},
+            {"name": "Oak table", "price": 100},
+            {"name": "Glass table", "price": "cheap"},
+            {"name": "Steel table", "price": 90, "category": "Lamps"},
+            {"name": "Birch table", "price": 150, "is_active": "no"},
+        ]
+        stdout, stderr = self.run_import(rows, "--skip-invalid")
+        self.assertEqual(
+            stderr.splitlines(),
+            [
+                "Row 2: name: A product with this name already exists.",
+                "Row 3: price: “cheap” value must be a decimal number.",
+                "Row 4: category: Unknown category.",
+            ],
+        )
+        self.assertIn("3 invalid", stdout)
+        self.assertIn("Imported 2 products", stdout)
+        self.assertEqual(
+            list(self.imported().values_list("name", "is_active")), [("Walnut table", True), ("Birch table", False)]
+        )
+
+    def test_dry_run(self):
+        stdout, _ = self.run_import([{"name": "Walnut table", "price": 200}], "--dry-run")
+        self.assertIn("Validated 1 rows", stdout)
+        self.assertFalse(self.imported().exists())
+
+    def test_slugs_do_not_collide(self):
+        rows = [{"name": name, "price": 100} for name in ["Oak table!", "Oak  table", "Walnut table", "walnut table"]]
+        self.run_import(rows)
+        self.assertEqual(
+            list(self.imported().values_list("slug", flat=True)),
+            ["Oak-table-1", "Oak-table-2", "Walnut-table", "walnut-table"],
+        )
+        # The counters are stored, so the next product continues after them
+        self.assertEqual(SlugCounter.objects.get(base_slug="Oak-table").next_suffix, 3)
+        self.assertEqual(Product.objects.create(name="Oak table?", price=100).slug, "Oak-table-3")
+        self.assertEqual(Product.objects.create(name="Walnut table!", price=100).slug, "Walnut-table-1")
+
+    def test_skus_are_reserved_per_batch(self):
+        rows = [{"name": f"Table {i}", "price": 100 + i} for i in range(5)]
+        with mock.patch(
+            "products.management.commands.import_products.reserve_skus", wraps=reserve_skus
+        ) as reserve:
+            self.run_import(rows, "--batch-size", "2")
+        self.assertEqual([call.args for call in reserve.call_args_list], [(2,), (2,), (1,)])
+        skus = list(Product.objects.values_list("sku", flat=True))
+        self.assertEqual(len(set(skus)), len(skus))
+        self.assertTrue(all(skus))
+
+    def test_documents_and_search_vectors_are_set(self):
+        rows = [
+            {"name": "Walnut table", "price": 200, "category": "Tables", "description": "Solid walnut"},
+            {"name": "Glass table", "price": 150},
+        ]
+        self.run_import(rows)
+        for product in self.imported().select_related("category").prefetch_related("images"):
+            with self.subTest(product.name):
+                self.assertEqual(product.document, build_product_document(product))
+                if connection.vendor == "postgresql":
+                    self.assertIsNotNone(product.search_vector)
+        found = search_products(Product.objects.all(), "walnut")
+        self.assertEqual(list(found.values_list("name", flat=True)), ["Walnut table"])
+
+
+class SuggestionsTests(TestCase):
+    """Trigram index of product and category names used for autocomplete."""
+
+    def setUp(self):
+        self.suggestions = Suggestions(
+            [
+                ("product", 1, "Oak-table", "Oak table"),
+                ("product", 2, "Walnut-coffee-table", "Walnut coffee table"),
+                ("product", 3, "Oak-chair", "Oak chair"),
+                ("product", 4, "طاولة-خشب", "طاولة خشب"),
+                ("category", 5, None, "Tables"),
+            ]
+        )
+
+    def names(self, text, kind="products", limit=10):
+        return [item["name"] for item in self.suggestions.suggest(text, limit)[kind]]
+
+    def test_last_word_is_a_prefix(self):
+        self.assertEqual(self.names("oak ta"), ["Oak table"])
+        self.assertEqual(self.names("tab", "categories"), ["Tables"])
+
+    def test_misspelled_words(self):
+        self.assertEqual(self.names("wallnut table"), ["Walnut coffee table"])
+        self.assertEqual(self.names("oak tabel"), ["Oak table"])
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.names("walnut chair"), [])
+        self.assertEqual(self.names(""), [])
+
+    def test_best_matches_first(self):
+        self.assertEqual(self.names("table"), ["Oak table", "Walnut coffee table"])
+        self.assertEqual(self.names("oak"), ["Oak table", "Oak chair"])
+        self.assertEqual(self.names("oak", limit=1), ["Oak table"])
+
+    def test_arabic_spellings_are_folded(self):
+        self.assertEqual(self.names("طاوله"), ["طاولة خشب"])
+
+    def test_trigrams_are_padded_like_pg_trgm(self):
+        self.assertEqual(trigrams("oak"), {"  o", " oa", "oak", "ak "})
+        self.assertEqual(trigrams("oak", prefix=True), {"  o", " oa", "oak"})
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class SuggestEndpointTests(TestCase):
+    """`/products/suggest/` answers from a per-process index, rebuilt after catalog changes."""
+
+    def setUp(self):
+        cache.clear()
+        self.index = SuggestionIndex()
+        patcher = mock.patch("products.views.suggestion_index", self.index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.category = Category.objects.create(name="Sofas")
+        Product.objects.create(name="Leather sofa", price=900, category=self.category)
+        Product.objects.create(name="Old sofa", price=100, category=self.category, is_active=False)
+
+    def suggest(self, query):
+        response = self.client.get(f"/products/suggest/{query}")
+        self.assertEqual(response.status_code, 200)
+        return response.json()["data"]
+
+    def test_products_and_categories(self):
+        data = self.suggest("?q=sofa")
+        self.assertEqual(
+            data["products"],
+            [{"id": Product.objects.get(name="Leather sofa").pk, "slug": "Leather-sofa", "name": "Leather sofa"}],
+        )
+        self.assertEqual(data["categories"], [{"id": self.category.pk, "name": "Sofas"}])
+
+    def test_limit(self):
+        for i in range(25):
+            Product.objects.create(name=f"Sofa {i}", price=100, category=self.category)
+        self.assertEqual(len(self.suggest("?q=sofa&limit=3")["products"]), 3)
+        self.assertEqual(len(self.suggest("?q=sofa&limit=50")["products"]), 20)
+        self.assertEqual(len(self.suggest("?q=sofa&limit=x")["products"]), 10)
+
+    def test_index_follows_the_catalog_version(self):
+        self.suggest("?q=sofa")
+        # A product created by another worker only bumps the shared catalog version
+        Product.objects.create(name="Corner sofa", price=700, category=self.category)
+        self.assertFalse(self.index.is_stale())
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_catalog_version()
+        self.assertTrue(self.index.is_stale())
+
+        # The previous index answers while the new one is built in the background
+        with mock.patch.object(self.index, "refresh") as refresh:
+            names = [product["name"] for product in self.suggest("?q=sofa")["products"]]
+        refresh.assert_called_once()
+        self.assertEqual(names, ["Leather sofa"])
+
+        self.index.build()
+        self.assertFalse(self.index.is_stale())
+        names = [product["name"] for product in self.suggest("?q=sofa")["products"]]
+        self.assertEqual(names, ["Corner sofa", "Leather sofa"])
+
+    def test_local_writes_invalidate(self):
+        self.suggest("?q=sofa")
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(name="Corner sofa", price=700, category=self.category)
+        self.assertTrue(self.index.is_stale())
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ServerTimingTests(TestCase):
+    """Server-Timing header and request log of instrumentation.ServerTimingMiddleware."""
+
+    SERVER_TIMING = re.compile(
+        r'^db;dur=(?P<db>\d+\.\d);desc="(?P<queries>\d+) queries", serialize;dur=\d+\.\d, '
+        r"render;dur=\d+\.\d, total;dur=(?P<total>\d+\.\d)$"
+    )
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.create(name="Shelves")
+        self.product = Product.objects.create(name="Shelf", price=60, category=category)
+
+    def timing(self, response):
+        match = self.SERVER_TIMING.match(response["Server-Timing"])
+        self.assertIsNotNone(match, response["Server-Timing"])
+        return match
+
+    def test_header_format(self):
+        for url in ["/products/", f"/products/{self.product.pk}/", "/products/missing/", "/nowhere/"]:
+            with self.subTest(url):
+                self.timing(self.client.get(url))
+
+    def test_query_count_and_time(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f"/products/{self.product.pk}/")
+        match = self.timing(response)
+        self.assertEqual(int(match["queries"]), len(queries))
+        self.assertGreater(int(match["queries"]), 0)
+        self.assertLessEqual(float(match["db"]), float(match["total"]))
+
+        # Served from the response cache
+        self.client.get("/products/")
+        self.assertEqual(self.timing(self.client.get("/products/"))["queries"], "0")
+
+    def test_requests_over_the_threshold_of_their_view_are_warnings(self):
+        with self.assertLogs("instrumentation", "INFO") as logs:
+            self.client.get(f"/products/{self.product.pk}/")
+        self.assertEqual([record.levelname for record in logs.records], ["INFO"])
+        self.assertNotIn("query_threshold", logs.output[0])
+
+        with override_settings(QUERY_COUNT_THRESHOLDS={"product-detail": 1}):
+            with self.assertLogs("instrumentation", "WARNING") as logs:
+                self.client.get(f"/products/{self.product.pk}/")
+        record = logs.records[0]
+        self.assertIn("view=product-detail", record.getMessage())
+        self.assertIn("query_threshold=1", record.getMessage())
+        self.assertEqual(record.request_timings["query_threshold"], 1)
+
+    def test_default_threshold(self):
+        with override_settings(QUERY_COUNT_THRESHOLD=0, QUERY_COUNT_THRESHOLDS={}):
+            with self.assertLogs("instrumentation", "WARNING") as logs:
+                self.client.get(f"/products/{self.product.pk}/")
+        self.assertIn("query_threshold=0", logs.output[0])
+
+
+@override_settings(
+    METRICS_TOKEN="scrape-token",
+    CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}},
+)
+class MetricsTests(TestCase):
+    """Prometheus metrics endpoint and the request metrics it exports."""
+
+    def setUp(self):
+        cache.clear()
+
+    def scrape(self):
+        response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer scrape-token")
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def sample(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_token_is_required(self):
+        for headers in [{}, {"HTTP_AUTHORIZATION": "Bearer wrong"}, {"HTTP_AUTHORIZATION": "scrape-token"}]:
+            with self.subTest(**headers):
+                self.assertEqual(self.client.get("/metrics", **headers).status_code, 403)
+        with override_settings(METRICS_TOKEN=""):
+            response = self.client.get("/metrics", HTTP_AUTHORIZATION="Bearer ")
+            self.assertEqual(response.status_code, 403)
+
+    def test_prometheus_text_format(self):
+        self.client.get("/products/")
+        response = self.scrape()
+        self.assertEqual(response["Content-Type"], CONTENT_TYPE_LATEST)
+        content = response.content.decode()
+        self.assertIn("# TYPE http_request_duration_seconds histogram", content)
+        self.assertIn("# TYPE http_requests_total counter", content)
+        self.assertRegex(
+            content, r'http_requests_total\{method="GET",status="200",view="product-list"\} \d+\.\d+'
+        )
+
+    def test_requests_are_counted(self):
+        labels = {"method": "GET", "view": "product-list"}
+        requests = self.sample("http_requests_total", status="200", **labels)
+        observed = self.sample("http_request_duration_seconds_count", **labels)
+        queries = self.sample("http_request_queries_count", view="product-list")
+        misses = self.sample("cache_requests_total", cache="catalog", result="miss")
+        hits = self.sample("cache_requests_total", cache="catalog", result="hit")
+
+        self.client.get("/products/")
+        self.client.get("/products/")
+        self.assertEqual(self.sample("http_requests_total", status="200", **labels), requests + 2)
+        self.assertEqual(self.sample("http_request_duration_seconds_count", **labels), observed + 2)
+        self.assertEqual(self.sample("http_request_queries_count", view="product-list"), queries + 2)
+        self.assertEqual(self.sample("cache_requests_total", cache="catalog", result="miss"), misses + 1)
+        self.assertEqual(self.sample("cache_requests_total", cache="catalog", result="hit"), hits + 1)
+
+    def test_unmatched_requests(self):
+        before = self.sample("http_requests_total", method="GET", view="unmatched", status="404")
+        self.client.get("/nowhere/")
+        self.assertEqual(self.sample("http_requests_total", method="GET", view="unmatched", status="404"), before + 1)
@@ -0,0 +1,174 @@
+import base64
+import binascii
+import fcntl
+import hashlib
+import os
+from datetime import timedelta
+from django.conf import settings
+from django.core.files import File
+from django.http import UnreadablePostError
+from django.utils import timezone
+from metrics import count_upload_bytes
+from .tasks import enqueue
+
+
+# Largest chunk accepted by one PATCH request, so no request holds a
+# worker for long and a failed chunk is cheap to send again
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Request bodies are copied to the part file this many bytes at a time
+READ_SIZE = 64 * 1024
+
+# Unfinished uploads without a new chunk for this long are deleted
+UPLOAD_EXPIRY = timedelta(days=1)
+
+# Algorithms accepted in the Upload-Checksum header
+CHECKSUM_ALGORITHMS = ("md5", "sha1", "sha256")
+
+
+class UploadError(Exception):
+    """A chunk was refused, `status` is the HTTP status to answer with."""
+
+    status = 400
+    reason = None
+
+    def __init__(self, message, offset=None):
+        super().__init__(message)
+        self.offset = offset
+
+
+class OffsetMismatch(UploadError):
+    status = 409
+
+
+class ChunkTooLarge(UploadError):
+    status = 413
+
+
+class UploadLocked(UploadError):
+    status = 423
+
+
+class ChecksumMismatch(UploadError):
+    # As in the tus checksum extension
+    status = 460
+    reason = "Checksum Mismatch"
+
+
+def part_path(upload):
+    """Local file the chunks of the upload are appended to."""
+    return os.path.join(settings.CHUNKED_UPLOAD_DIR, f"{upload.pk}.part")
+
+
+def parse_checksum(header):
+    """Parse an `Upload-Checksum: <algorithm> <base64 digest>` header."""
+    try:
+        algorithm, encoded = header.split()
+        digest = base64.b64decode(encoded, validate=True)
+    except (ValueError, binascii.Error):
+        raise UploadError("Upload-Checksum must be '<algorithm> <base64 digest>'.")
+    if algorithm.lower() not in CHECKSUM_ALGORITHMS:
+        raise UploadError(f"Upload-Checksum algorithm must be one of {', '.join(CHECKSUM_ALGORITHMS)}.")
+    return algorithm.lower(), digest
+
+
+def append_chunk(upload, stream, offset, length, checksum=None):
+    """
+    Append `length` bytes of `stream` at `offset` of the upload, which must
+    be its current offset, and store the upload once it is complete.
+
+    Chunks are streamed to disk, so memory use does not depend on their
+    size. Without a checksum, the bytes received before a dropped
+    connection are kept and the client resumes after them; with one, a
+    chunk which does not match is discarded.
+    """
+    from .models import VideoUpload
+
+    if length < 0:
+        raise UploadError("Content-Length must not be negative.")
+    if length > MAX_CHUNK_SIZE:
+        raise ChunkTooLarge(f"Chunks must not exceed {MAX_CHUNK_SIZE} bytes.")
+    os.makedirs(settings.CHUNKED_UPLOAD_DIR, exist_ok=True)
+    with open(part_path(upload), "ab+") as file:
+        try:
+            fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadLocked("Another chunk of this upload is being received.")
+
+        # The offset is only read once the lock is held
+        upload.refresh_from_db(fields=["offset", "video"])
+        if upload.video or offset != upload.offset:
+            raise OffsetMismatch("Upload-Offset does not match the offset of the upload.", upload.offset)
+        if upload.offset + length > upload.size:
+            raise UploadError("The chunk goes past the end of the upload.", upload.offset)
+
+        # Bytes written after the last committed offset, by a crashed
+        # request for instance, are dropped
+        file.truncate(upload.offset)
+        hasher = hashlib.new(checksum[0]) if checksum else None
+        received = 0
+        try:
+            while received < length:
+                data = stream.read(min(READ_SIZE, length - received))
+                if not data:
+                    break
+                file.write(data)
+                if hasher:
+                    hasher.update(data)
+                received += len(data)
+        except (OSError, UnreadablePostError):
+            # The client went away, what was received is kept below
+            pass
+        count_upload_bytes("video", received)
+
+        if hasher and (received != length or hasher.digest() != checksum[1]):
+            file.truncate(upload.offset)
+            raise ChecksumMismatch("The chunk does not match Upload-Checksum.", upload.offset)
+
+        file.flush()
+        os.fsync(file.fileno())
+        upload.offset += received
+        VideoUpload.objects.filter(pk=upload.pk).update(offset=upload.offset, updated_at=timezone.now())
+
+        if upload.offset == upload.size:
+            complete_upload(upload)
+    return upload.offset
+
+
+class _PartFile(File):
+    """Lets FileSystemStorage move the part file instead of copying it."""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def complete_upload(upload):
+    """Store the assembled file as a product video and queue attaching it to the product."""
+    from .models import Product, VideoUpload
+
+    field = Product._meta.get_field("product_video")
+    path = part_path(upload)
+    with open(path, "rb") as file:
+        name = field.storage.save(field.generate_filename(upload.product, upload.filename), _PartFile(file))
+    if os.path.exists(path):
+        os.remove(path)
+
+    upload.video = name
+    VideoUpload.objects.filter(pk=upload.pk).update(video=name)
+    enqueue("products.attach_video", {"product_id": upload.product_id, "name": name})
+
+
+def delete_upload(upload):
+    """Delete an upload and its part file."""
+    if os.path.exists(part_path(upload)):
+        os.remove(part_path(upload))
+    upload.delete()
+
+
+def delete_expired_uploads():
+    """Delete the unfinished uploads which received no chunk for UPLOAD_EXPIRY."""
+    from .models import VideoUpload
+
+    expired = VideoUpload.objects.filter(video="", updated_at__lt=timezone.now() - UPLOAD_EXPIRY)
+    for upload in expired:
+        delete_upload(upload)
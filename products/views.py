@@ -2,29 +2,59 @@ from rest_framework import viewsets, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.decorators import action
-from .models import Product, ProductImage,Review
-from .serializers import ProductSerializer, ProductImageSerializer, ReviewSerializer
+from .models import CategoryStats, Product, ProductImage,Review, VideoUpload
+from .serializers import ProductSerializer, ProductImageSerializer, ReviewSerializer, VideoUploadSerializer
+from .blobs import collect_garbage
+from .cache import cache_catalog_response, conditional_catalog_response
+from .documents import render_product_documents
+from .export import export_csv, export_ndjson, export_records
+from .facets import facet_index
+from .images import check_images
+from .search import search_products, suggestion_index
+from .tasks import get_task_queue_stats, store_product_images
+from .uploads import UploadError, append_chunk, delete_expired_uploads, delete_upload, parse_checksum
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from categories.models import Category
 from support.models import Support
-from datetime import timedelta
-from django.utils.timezone import now
+from datetime import datetime, timedelta
+from decimal import Decimal, InvalidOperation
+from django.utils.cache import patch_cache_control
+from django.utils.timezone import now, is_naive, make_aware
+from django.utils.dateparse import parse_date, parse_datetime
+from django.http import StreamingHttpResponse
+from django.urls import reverse
+from rest_framework.exceptions import ValidationError
+from django.conf import settings
+from django.db.models import Count, Q
 from rest_framework.exceptions import NotFound
-from django.db.models import Q
+from custom import CustomCursorPagination
 
 
 class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.all()
+    queryset = Product.objects.select_related("category").prefetch_related("images")
     serializer_class = ProductSerializer
+    pagination_class = CustomCursorPagination
 
     def get_permissions(self):
-        if self.request.method == "GET":
+        if self.request.method == "GET" and self.action != "export":
             return [AllowAny()]
         return [IsAuthenticated()]
 
+    def get_pagination_ordering(self):
+        """Keyset ordering matching `order_by_price`, with `id` as tiebreaker."""
+        order_by_price = self.request.query_params.get("order_by_price")
+        if order_by_price == "max":
+            return ("-price", "-id")
+        if order_by_price == "min":
+            return ("price", "id")
+        if self.request.query_params.get("search"):
+            return ("-search_rank", "-id")
+        return ("-created_at", "-id")
+
     def get_queryset(self):
-        # Base queryset
-        queryset = Product.objects.all()
+        # Base queryset, category and images are loaded up front so the
+        # serializer does not query them once per product
+        queryset = Product.objects.select_related("category").prefetch_related("images")
 
         # Get query parameters
         name = self.request.query_params.get("name")
@@ -59,19 +89,17 @@ class ProductViewSet(viewsets.ModelViewSet):
             best_seller_bool = best_seller.lower() in ["true", "1", "yes"]
             queryset = queryset.filter(is_best_seller=best_seller_bool)
 
-        # Search functionality: filter across name and description
+        # Full-text search across name, description and color
         if search:
-            queryset = queryset.filter(
-                Q(name__icontains=search)
-                | Q(description__icontains=search)
-                | Q(color__icontains=search)
-            )
+            queryset = search_products(queryset, search)
 
         # Apply ordering by price
         if order_by_price == "max":
             queryset = queryset.order_by("-price")  # Order by descending price
         elif order_by_price == "min":
             queryset = queryset.order_by("price")  # Order by ascending price
+        elif search:
+            queryset = queryset.order_by("-search_rank", "-id")  # Most relevant first
 
         # Handle unauthenticated users to return only active products
         if self.request.method == "GET" and not self.request.user.is_authenticated:
@@ -79,17 +107,32 @@ class ProductViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    @conditional_catalog_response
+    @cache_catalog_response
+    def list(self, request, *args, **kwargs):
+        # Products are rendered from their stored documents, without the
+        # serializer, so the category and images are not loaded
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = queryset.select_related(None).prefetch_related(None).defer("search_vector")
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(render_product_documents(page, request))
+        return Response(render_product_documents(queryset, request))
+
+    @conditional_catalog_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
     def create(self, request, *args, **kwargs):
         images = request.FILES.getlist('image_files')
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+        self.validate_images(images)
         product = serializer.save()
 
-        # Save and validate images
-        for image in images:
-            image_serializer = ProductImageSerializer(data={'image': image})
-            image_serializer.is_valid(raise_exception=True)
-            image_serializer.save(product=product)
+        # Images are attached to the product by a background task
+        store_product_images(product, images)
 
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
@@ -100,18 +143,103 @@ class ProductViewSet(viewsets.ModelViewSet):
         instance = self.get_object()
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
+        self.validate_images(images)
         product = serializer.save()
 
         if images:
             # Uncomment this line to delete existing images before adding new ones
             # instance.images.all().delete()
-            for image in images:
-                image_serializer = ProductImageSerializer(data={'image': image})
-                image_serializer.is_valid(raise_exception=True)
-                image_serializer.save(product=product)
+            store_product_images(product, images)
 
         return Response(serializer.data)
 
+    def validate_images(self, images):
+        """Validate uploaded images before anything is saved, concurrently and from their headers only."""
+        errors = check_images(images)
+        if errors:
+            raise ValidationError({"image": errors})
+
+    @action(detail=False, methods=['get'])
+    def suggest(self, request):
+        """
+        Autocomplete endpoint for the search box, tolerant to misspellings.
+
+        Returns the id, slug and name of matching active products and the
+        id and name of matching categories, `?q=` is the typed text.
+        """
+        try:
+            limit = min(max(int(request.query_params.get("limit", 10)), 1), 20)
+        except ValueError:
+            limit = 10
+        return Response(suggestion_index.suggest(request.query_params.get("q", ""), limit))
+
+    @action(detail=False, methods=['get'])
+    @conditional_catalog_response
+    def facets(self, request):
+        """
+        Product counts for the filter sidebar, by category, color, wood,
+        fabric and upholstery material and price range.
+
+        Accepts the `category`, `color`, `price_min`, `price_max`,
+        `best_seller` and `search` filters of the list. The counts of each
+        facet ignore its own filter, so other choices keep their counts.
+        """
+        params = request.query_params
+        filters = {"color": params.get("color"), "search": params.get("search")}
+        try:
+            if params.get("category"):
+                filters["category"] = int(params["category"])
+            for name in ("price_min", "price_max"):
+                if params.get(name):
+                    filters[name] = Decimal(params[name])
+                    if not filters[name].is_finite():
+                        raise ValueError(name)
+        except (ValueError, InvalidOperation):
+            raise ValidationError({"detail": "category must be an id and price_min and price_max numbers."})
+        if params.get("best_seller") is not None:
+            filters["best_seller"] = params["best_seller"].lower() in ["true", "1", "yes"]
+
+        stale = facet_index.is_stale()
+        response = Response(facet_index.facets(filters, active_only=not request.user.is_authenticated))
+        if stale:
+            # Counts of the previous catalog version, while the index is
+            # rebuilt, must not be kept under the ETag of the current one
+            patch_cache_control(response, no_store=True)
+        return response
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream the whole catalog as NDJSON (default) or CSV, `?output=csv`.
+
+        `?updated_since=` (ISO date or datetime) only exports products
+        updated since then. Rows are read in chunks, so memory use does not
+        grow with the catalog size.
+        """
+        output = request.query_params.get("output", "ndjson")
+        if output not in ("ndjson", "csv"):
+            raise ValidationError({"output": "Must be 'ndjson' or 'csv'."})
+
+        queryset = Product.objects.all()
+        updated_since = request.query_params.get("updated_since")
+        if updated_since:
+            since = parse_datetime(updated_since)
+            if since is None and parse_date(updated_since) is not None:
+                since = datetime.combine(parse_date(updated_since), datetime.min.time())
+            if since is None:
+                raise ValidationError({"updated_since": "Must be an ISO 8601 date or datetime."})
+            if is_naive(since):
+                since = make_aware(since)
+            queryset = queryset.filter(updated_at__gte=since)
+
+        records = export_records(queryset, request)
+        if output == "csv":
+            response = StreamingHttpResponse(export_csv(records), content_type="text/csv; charset=utf-8")
+        else:
+            response = StreamingHttpResponse(export_ndjson(records), content_type="application/x-ndjson")
+        response["Content-Disposition"] = f'attachment; filename="products-{now():%Y%m%d%H%M%S}.{output}"'
+        return response
+
     @action(detail=True, methods=['patch'], permission_classes=[IsAuthenticated])
     def toggle_status(self, request, pk=None):
         """Endpoint to toggle the visibility of a product."""
@@ -135,21 +263,38 @@ class ProductViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        image_paths = []
-        for image in images:
-            image_serializer = ProductImageSerializer(data={'image': image})
-            if image_serializer.is_valid(raise_exception=True):
-                product_image = image_serializer.save(product=product)
-                image_paths.append(product_image.image.url)
+        self.validate_images(images)
+        # The files are stored now and attached to the product by a background task
+        storage = ProductImage._meta.get_field('image').storage
+        image_paths = [storage.url(name) for name in store_product_images(product, images)]
 
         return Response(
             {
-                "detail": f"{len(images)} images added to product {product.name}.",
+                "detail": f"{len(images)} images will be added to product {product.name}.",
                 "image_paths": image_paths
             },
-            status=status.HTTP_201_CREATED
+            status=status.HTTP_202_ACCEPTED
         )
 
+    @action(detail=True, methods=['post'])
+    def video_upload(self, request, pk=None):
+        """
+        Start a resumable upload of the product video, for large files.
+
+        The body gives the `filename` and total `size` in bytes, the chunks
+        are then sent to the returned Location, see VideoUploadView.
+        """
+        product = self.get_object()
+        delete_expired_uploads()
+        serializer = VideoUploadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        upload = serializer.save(product=product)
+
+        response = Response(serializer.data, status=status.HTTP_201_CREATED)
+        response["Location"] = reverse("video_upload", args=[upload.pk])
+        response["Upload-Offset"] = upload.offset
+        return response
+
     @action(detail=True, methods=['delete'])
     def delete_images(self, request, pk=None):
         """Endpoint to delete multiple images from a product."""
@@ -163,6 +308,8 @@ class ProductViewSet(viewsets.ModelViewSet):
             )
 
         deleted_count, _ = ProductImage.objects.filter(id__in=image_ids, product=product).delete()
+        # Files no other image uses are deleted with their variants
+        collect_garbage()
         return Response(
             {"detail": f"{deleted_count} images deleted from product {product.name}."},
             status=status.HTTP_200_OK
@@ -190,8 +337,14 @@ from products.serializers import ProductSerializer  # Assuming you have a serial
 class ProductsByCategoryView(APIView):
     """
     API View to retrieve all products for a specific category.
+
+    Public like the product list, anonymous users only see active products.
     """
 
+    permission_classes = [AllowAny]
+
+    @conditional_catalog_response
+    @cache_catalog_response
     def get(self, request, category_id, *args, **kwargs):
         try:
             # Get the category by ID
@@ -200,12 +353,14 @@ class ProductsByCategoryView(APIView):
             raise NotFound(detail="Category not found")
 
         # Retrieve all products for this category 
-        products = Product.objects.filter(category=category)
+        products = Product.objects.filter(category=category).defer("search_vector")
+        if not request.user.is_authenticated:
+            products = products.filter(is_active=True)
 
-        # Serialize the products
-        serializer = ProductSerializer(products, many=True)
+        # Render the products from their stored documents, missing ones are built in one batch
+        data = render_product_documents(products)
 
-        return Response({"category": category.name, "products": serializer.data})
+        return Response({"category": category.name, "products": data})
 
 
 class DashboardStatsView(APIView):
@@ -214,35 +369,40 @@ class DashboardStatsView(APIView):
     """
 
     def get(self, request, *args, **kwargs):
-        # 1. All products
-        total_products = Product.objects.count()
-
-        # 2. All active products
-        active_products = Product.objects.filter(is_active=True).count()
-
-        # 3. All inactive products
-        inactive_products = Product.objects.filter(is_active=False).count()
+        # 1. Total and active products per category, in one grouped query or
+        # from the materialized table
+        if settings.DASHBOARD_STATS_MATERIALIZED:
+            counts = CategoryStats.objects.values_list("category_id", "product_count", "active_count")
+        else:
+            counts = Product.objects.values_list("category_id").annotate(
+                product_count=Count("id"),
+                active_count=Count("id", filter=Q(is_active=True)),
+            )
+        counts = {category_id: (total, active) for category_id, total, active in counts}
 
-        # 4. All categories
-        total_categories = Category.objects.count()
+        # 2. All, active and inactive products
+        total_products = sum(total for total, _ in counts.values())
+        active_products = sum(active for _, active in counts.values())
+        inactive_products = total_products - active_products
 
-        # 5. Number of products for each category
-        categories = Category.objects.all()
+        # 3. All categories and their number of products
+        categories = Category.objects.values_list("id", "name")
+        total_categories = len(categories)
         category_stats = [
             {
-                "category_name": category.name,
-                "product_count": Product.objects.filter(category=category).count(),
+                "category_name": name,
+                "product_count": counts.get(category_id, (0, 0))[0],
             }
-            for category in categories
+            for category_id, name in categories
         ]
 
-        # 6. All messages
-        total_support_messages = Support.objects.count()
-
-        # 7. New messages (last 24 hours)
-        new_support_messages = Support.objects.filter(
-            created_at__gte=now() - timedelta(days=1)
-        ).count()
+        # 4. All messages and new messages (last 24 hours)
+        support_stats = Support.objects.aggregate(
+            total=Count("id"),
+            new=Count("id", filter=Q(created_at__gte=now() - timedelta(days=1))),
+        )
+        total_support_messages = support_stats["total"]
+        new_support_messages = support_stats["new"]
 
         # Prepare response data
         data = {
@@ -258,6 +418,71 @@ class DashboardStatsView(APIView):
         return Response(data)
 
 
+class VideoUploadView(APIView):
+    """
+    API View to send the chunks of a resumable video upload, in the style
+    of the tus protocol.
+
+    GET (or HEAD) returns the received size in `Upload-Offset`, to resume
+    after a failure. PATCH appends a chunk: the raw bytes as body,
+    `Upload-Offset` set to the current offset and optionally
+    `Upload-Checksum: sha256 <base64 digest of the chunk>`. The video is
+    attached to the product once every byte is received. DELETE cancels
+    the upload.
+    """
+
+    def get_upload(self, upload_id):
+        upload = VideoUpload.objects.filter(pk=upload_id).first()
+        if upload is None:
+            raise NotFound("Upload not found.")
+        return upload
+
+    def upload_response(self, upload):
+        response = Response(VideoUploadSerializer(upload).data)
+        response["Upload-Offset"] = upload.offset
+        response["Upload-Length"] = upload.size
+        response["Cache-Control"] = "no-store"
+        return response
+
+    def get(self, request, upload_id, *args, **kwargs):
+        return self.upload_response(self.get_upload(upload_id))
+
+    def patch(self, request, upload_id, *args, **kwargs):
+        upload = self.get_upload(upload_id)
+        try:
+            offset = int(request.headers["Upload-Offset"])
+            length = int(request.headers["Content-Length"])
+        except (KeyError, ValueError):
+            raise ValidationError({"detail": "Upload-Offset and Content-Length headers are required."})
+
+        try:
+            checksum = request.headers.get("Upload-Checksum")
+            # The body is read from the request stream, never parsed
+            append_chunk(upload, request, offset, length, parse_checksum(checksum) if checksum else None)
+        except UploadError as error:
+            response = Response({"detail": str(error), "offset": error.offset}, status=error.status)
+            if error.reason:
+                response.reason_phrase = error.reason
+            if error.offset is not None:
+                response["Upload-Offset"] = error.offset
+            return response
+        return self.upload_response(upload)
+
+    def delete(self, request, upload_id, *args, **kwargs):
+        delete_upload(self.get_upload(upload_id))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class TaskQueueStatsView(APIView):
+    """
+    API View to monitor the background task queue: queue depth by status
+    and wait and run times of the tasks finished in the last hour.
+    """
+
+    def get(self, request, *args, **kwargs):
+        return Response(get_task_queue_stats())
+
+
 class ReviewView(APIView):
     def get(self, request):
         reviews = Review.objects.all()
@@ -1,12 +1,32 @@
+import math
+from decimal import Decimal
 from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 class CustomJSONRenderer(JSONRenderer):
     """
     A custom renderer that formats the JSON response to include
     status, message, data, and error fields.
+
+    The JSON is encoded with orjson when it is installed. Dates and times
+    and the types orjson does not handle natively (Decimal, lazy strings,
+    ...) go through DRF's encoder, Decimals are written as the stdlib writes
+    them. Only native floats in exponent notation are written differently,
+    1e16 instead of 1e+16, which is the same JSON number. Integers wider
+    than 64 bits, which orjson refuses, are encoded by JSONRenderer.
     """
 
+    use_orjson = orjson is not None
+    orjson_options = (
+        orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else None
+    )
+
     def render(self, data, accepted_media_type=None, renderer_context=None):
 
         # Access the response object
@@ -20,7 +40,7 @@ class CustomJSONRenderer(JSONRenderer):
                 "error": data,
             }
 
-            return super().render(response_data, accepted_media_type, renderer_context)
+            return self.encode(response_data, accepted_media_type, renderer_context)
 
         # Default message
         message = "Request succeeded"
@@ -35,18 +55,15 @@ class CustomJSONRenderer(JSONRenderer):
         # Handle pagination response format
         if isinstance(data, dict) and "results" in data:
 
-            # Prepare the paginated response data structure
-            response_data = {
-                "status": "success",
-                "message": message,
-                "total_items": data.get("total_items"),
-                "total_pages": data.get("total_pages"),
-                "page_size": data.get("page_size"),
-                "current_page": int(data.get("current_page")),
-                "next": data.get("next"),
-                "previous": data.get("previous"),
-                "data": data.get("results"),
-            }
+            # Prepare the paginated response data structure, cursor
+            # pagination sends no counts and no page number
+            response_data = {"status": "success", "message": message}
+            for key in ("total_items", "total_pages", "page_size", "current_page", "next", "previous"):
+                if key in data:
+                    response_data[key] = data[key]
+            if response_data.get("current_page") is not None:
+                response_data["current_page"] = int(response_data["current_page"])
+            response_data["data"] = data.get("results")
 
         else:
             # Non-paginated response structure
@@ -59,5 +76,34 @@ class CustomJSONRenderer(JSONRenderer):
         # disable cross-origin policy remember to delete this line
         # response["Cross-Origin-Opener-Policy"] = "unsafe-none"
 
-        # Call the parent class's render method to convert the Python dict to JSON
-        return super().render(response_data, accepted_media_type, renderer_context)
+        # Convert the Python dict to JSON
+        return self.encode(response_data, accepted_media_type, renderer_context)
+
+    def encode(self, data, accepted_media_type=None, renderer_context=None):
+        """Encode data to JSON bytes, with orjson unless indentation is requested."""
+        if not self.use_orjson or self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=_orjson_default, option=self.orjson_options)
+        except orjson.JSONEncodeError:
+            # Integers wider than 64 bits, or a type neither encoder handles
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Same escaping as JSONRenderer, so the JSON stays a javascript subset
+        if b"\xe2\x80\xa8" in ret or b"\xe2\x80\xa9" in ret:
+            ret = ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(b"\xe2\x80\xa9", b"\\u2029")
+        return ret
+
+
+_default_encoder = encoders.JSONEncoder()
+
+
+def _orjson_default(obj):
+    if isinstance(obj, Decimal):
+        # DRF's encoder turns Decimals into floats, written here as json writes them
+        value = float(obj)
+        if not math.isfinite(value):
+            raise ValueError("Out of range float values are not JSON compliant")
+        return orjson.Fragment(float.__repr__(value).encode())
+    return _default_encoder.default(obj)
@@ -1,8 +1,9 @@
 from rest_framework import serializers
+from instrumentation import TimedSerializerMixin
 from .models import Support
 
 
-class SupportSerializer(serializers.ModelSerializer):
+class SupportSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     """
     Serializer for Support.
     """
@@ -0,0 +1,44 @@
+"""
+Helpers shared by the test suites of the apps.
+
+Kept out of the application modules, so running the site never imports
+django.test.
+"""
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """
+    Test case mixin to enforce a maximum number of SQL queries per endpoint.
+
+    Usage:
+        with self.assertQueryBudget(3):
+            self.client.get("/products/")
+    """
+
+    def assertQueryBudget(self, budget, using=connection):
+        return _QueryBudgetContext(self, budget, using)
+
+
+class _QueryBudgetContext(CaptureQueriesContext):
+    """Context manager which fails the test when the budget is exceeded"""
+
+    def __init__(self, test_case, budget, connection):
+        self.test_case = test_case
+        self.budget = budget
+        super().__init__(connection)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super().__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+        executed = len(self)
+        queries = "\n".join(
+            f"{i}. {query['sql']}" for i, query in enumerate(self.captured_queries, start=1)
+        )
+        self.test_case.assertLessEqual(
+            executed,
+            self.budget,
+            f"{executed} queries executed, budget is {self.budget}\nCaptured queries were:\n{queries}",
+        )
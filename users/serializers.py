@@ -2,12 +2,13 @@ from rest_framework import serializers
 from django.contrib.auth.hashers import check_password
 from django.contrib.auth import password_validation
 from dynamic_rest.serializers import DynamicModelSerializer
+from instrumentation import TimedSerializerMixin
 from .models import User
 
 
 
 
-class UserSerializer(DynamicModelSerializer):
+class UserSerializer(TimedSerializerMixin, DynamicModelSerializer):
     """
     Serializer for User.
     """